@@ -0,0 +1,160 @@
+"""
+Async API Module
+asyncio wrappers around PDFReader and AudioConverter for use from an event loop
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from pdf_reader import PDFReader, ENGINE_PYPDF2
+
+# Pages extracted ahead of the consumer when iterating asynchronously
+PREFETCH_PAGES = 2
+
+
+class AsyncPDFReader:
+    def __init__(self, engine=ENGINE_PYPDF2, max_workers=4):
+        self.reader = PDFReader(engine)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix="pdf-extract")
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+    
+    @property
+    def total_pages(self):
+        return self.reader.total_pages
+    
+    async def _run(self, function, *args):
+        """Run a blocking reader call on the extraction executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, *args)
+    
+    async def open_pdf(self, file_path):
+        """Open and parse a PDF; returns (success, message)"""
+        return await self._run(self.reader.open_pdf, file_path)
+    
+    async def get_page_text(self, page_number):
+        """Extract the text of a page; returns (success, text)"""
+        return await self._run(self.reader.get_page_text, page_number)
+    
+    async def get_text_store(self, page_numbers=None):
+        """Collect pages into a BookTextStore; returns (success, store)"""
+        return await self._run(self.reader.get_text_store, page_numbers)
+    
+    async def pages(self, start_page=0, end_page=None):
+        """Iterate (page_number, text) over text pages with `async for`
+        
+        Image-only and blank pages are skipped when the document has been
+        classified. A few pages are extracted ahead of the consumer; leaving
+        the loop early cancels the pages not yet started.
+        """
+        text_pages, _ = self.reader.get_text_pages(start_page, end_page)
+        pending = []
+        
+        try:
+            for page_number in text_pages:
+                pending.append((page_number, asyncio.ensure_future(self.get_page_text(page_number))))
+                if len(pending) <= PREFETCH_PAGES:
+                    continue
+                
+                yield await self._next_page(pending)
+            
+            while pending:
+                yield await self._next_page(pending)
+            
+        finally:
+            for _, future in pending:
+                future.cancel()
+    
+    async def _next_page(self, pending):
+        """Wait for the oldest prefetched page"""
+        page_number, future = pending.pop(0)
+        success, text = await future
+        if not success:
+            raise RuntimeError(text)
+        return page_number, text
+    
+    async def close(self):
+        """Close the PDF and shut down the executor"""
+        await self._run(self.reader.close_pdf)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AsyncAudioConverter:
+    def __init__(self, audio_converter):
+        self.audio_converter = audio_converter
+        
+        # TTS engines are not thread safe, so every call runs on one thread
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts")
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+    
+    def _threadsafe(self, loop, callback):
+        """Wrap a progress callback so it runs on the event loop thread"""
+        if callback is None:
+            return None
+        return lambda *args: loop.call_soon_threadsafe(callback, *args)
+    
+    async def _run_cancellable(self, function, *args):
+        """Run a blocking engine call, stopping the engine if the caller is cancelled"""
+        concurrent_future = self.executor.submit(function, *args)
+        future = asyncio.wrap_future(concurrent_future)
+        
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # A queued call is dropped; a running one is interrupted and
+            # allowed to wind down before the next call can use the engine
+            if not concurrent_future.cancel():
+                self._stop_engine()
+                try:
+                    await future
+                except Exception:
+                    pass
+            raise
+    
+    def _stop_engine(self):
+        """Interrupt whatever the engine is doing"""
+        engine = self.audio_converter.engine
+        if engine is not None:
+            engine.stop()
+    
+    async def speak_text(self, text, sentence_callback=None, word_callback=None):
+        """Speak text and return (success, message) once it has been spoken
+        
+        Callbacks are invoked on the event loop thread. Cancelling the
+        awaiting task stops the engine.
+        """
+        loop = asyncio.get_running_loop()
+        return await self._run_cancellable(
+            self.audio_converter.speak_text, text, True,
+            self._threadsafe(loop, sentence_callback),
+            self._threadsafe(loop, word_callback)
+        )
+    
+    async def save_to_audio_file(self, text, filename):
+        """Render text to a WAV file and return (success, message)"""
+        return await self._run_cancellable(self.audio_converter.save_to_audio_file, text, filename)
+    
+    async def export_pages(self, reader, filename, start_page=0, end_page=None):
+        """Render the text pages of an AsyncPDFReader to one WAV file"""
+        text_pages, _ = reader.reader.get_text_pages(start_page, end_page)
+        if not text_pages:
+            return False, "No pages with text to export"
+        
+        success, store = await reader.get_text_store(text_pages)
+        if not success:
+            return False, store
+        
+        return await self.save_to_audio_file(store.get_text(), filename)
+    
+    async def close(self):
+        """Shut down the executor; the AudioConverter itself is left to its owner"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -1,23 +1,263 @@
 """
 Audio Converter Module
 Handles text to speech conversion using pyttsx3
+
+speak() and save() return a SpeechJob at once: a Future that resolves to
+the call's (success, message) result, can be cancelled while it runs, and
+reports progress events raised from the engine's callback hooks. The
+blocking speak_text() and save_to_audio_file() run the same jobs inline.
 """
-import pyttsx3
 import threading
+import re
 import os
+import wave
+from concurrent.futures import Future, wait
+from contextlib import contextmanager
+from types import SimpleNamespace
 
-class AudioConverter:
+from profiling import profiled
+
+try:
+    import pyttsx3
+except ImportError:
+    pyttsx3 = None
+
+# Select the speech backend with this environment variable
+TTS_BACKEND_ENV = "AUDIOBOOK_TTS_BACKEND"
+BACKEND_PYTTSX3 = "pyttsx3"
+BACKEND_FAKE = "fake"
+TTS_BACKENDS = (BACKEND_PYTTSX3, BACKEND_FAKE)
+
+# A sentence runs up to and including its terminal punctuation
+SENTENCE_PATTERN = re.compile(r'[^.!?]+(?:[.!?]+|$)')
+WORD_PATTERN = re.compile(r'\S+')
+
+# Progress events of a SpeechJob and their arguments. Chunks are the
+# sentences of speech and the files of a save.
+EVENT_CHUNK_STARTED = "chunk-started"    # (index, start, end) character offsets
+EVENT_WORD = "word"                      # (character offset,)
+EVENT_CHUNK_FINISHED = "chunk-finished"  # (index, completed)
+SPEECH_EVENTS = (EVENT_CHUNK_STARTED, EVENT_WORD, EVENT_CHUNK_FINISHED)
+
+# Audio written by the fake backend: 16-bit mono silence
+FAKE_FRAME_RATE = 8000
+FAKE_VOICE = SimpleNamespace(id="fake", name="Fake Voice", gender="Unknown", age="Unknown")
+
+
+def split_sentences(text):
+    """Split text into sentences, returned as (start, end) character offsets"""
+    spans = []
+    
+    for match in SENTENCE_PATTERN.finditer(text):
+        start, end = match.span()
+        
+        # Trim surrounding whitespace from the span
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        
+        if start < end:
+            spans.append((start, end))
+    
+    return spans
+
+
+def get_default_backend():
+    """Backend selected by the environment, pyttsx3 unless overridden"""
+    return os.environ.get(TTS_BACKEND_ENV) or BACKEND_PYTTSX3
+
+
+class FakeTTSEngine:
+    """Stand-in for a pyttsx3 engine for tests and headless services
+    
+    Speech completes instantly while still reporting utterance and word
+    progress, and files are written as silent WAV audio as long as the
+    text would take to speak at the current rate.
+    """
+    
     def __init__(self):
+        self.properties = {'rate': 200, 'volume': 1.0, 'voice': FAKE_VOICE.id, 'voices': [FAKE_VOICE]}
+        self.queue = []
+        self.callbacks = []
+        self.stopping = False
+    
+    def getProperty(self, name):
+        return self.properties[name]
+    
+    def setProperty(self, name, value):
+        self.properties[name] = value
+    
+    def connect(self, topic, callback):
+        token = {'topic': topic, 'cb': callback}
+        self.callbacks.append(token)
+        return token
+    
+    def disconnect(self, token):
+        self.callbacks.remove(token)
+    
+    def _notify(self, topic, **kwargs):
+        for token in list(self.callbacks):
+            if token['topic'] == topic:
+                token['cb'](**kwargs)
+    
+    def say(self, text, name=None):
+        self.queue.append(('say', text, name))
+    
+    def save_to_file(self, text, filename, name=None):
+        self.queue.append(('save', text, (filename, name)))
+    
+    def runAndWait(self):
+        self.stopping = False
+        
+        while self.queue and not self.stopping:
+            command, text, target = self.queue.pop(0)
+            
+            if command == 'say':
+                self._notify('started-utterance', name=target)
+                for match in WORD_PATTERN.finditer(text):
+                    if self.stopping:
+                        break
+                    self._notify('started-word', name=target, location=match.start(),
+                                 length=len(match.group()))
+                self._notify('finished-utterance', name=target, completed=not self.stopping)
+            else:
+                # Saves report utterances like pyttsx3's drivers do
+                filename, name = target
+                self._notify('started-utterance', name=name)
+                self._write_silence(text, filename)
+                self._notify('finished-utterance', name=name, completed=True)
+    
+    def _write_silence(self, text, filename):
+        """Write silence lasting as long as text takes to speak"""
+        words = len(WORD_PATTERN.findall(text))
+        frames = int(words * 60 / self.properties['rate'] * FAKE_FRAME_RATE)
+        
+        with wave.open(filename, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(FAKE_FRAME_RATE)
+            wav.writeframes(b"\x00\x00" * frames)
+    
+    def stop(self):
+        self.stopping = True
+        self.queue.clear()
+
+
+class SpeechJob(Future):
+    """Handle of one speak or save call
+    
+    A concurrent.futures.Future whose result is the (success, message)
+    tuple of the call, or (success, message, marks) for saves with sentence
+    marks, so it works with wait(), add_done_callback() and
+    asyncio.wrap_future(). Listeners of SPEECH_EVENTS are called on the
+    thread running the job. Unlike a plain Future, cancelling never makes
+    result() raise: a job cancelled before it starts finishes with
+    (False, "Speech cancelled"), and a running one has its engine stopped
+    and finishes with (False, "Speech stopped"). A job waits for the jobs
+    in previous, which used the engine before it, to finish before it starts.
+    """
+    
+    def __init__(self, converter, text, listeners=None, previous=()):
+        super().__init__()
+        self.converter = converter
+        self.text = text
+        self.previous = list(previous)
+        self.listeners = {event: [] for event in SPEECH_EVENTS}
+        self.spoken_offset = 0
+        self.stop_requested = False
+        # Guards the move from waiting to running against cancel()
+        self.start_lock = threading.RLock()
+        
+        for event, callback in (listeners or {}).items():
+            self.on(event, callback)
+    
+    def on(self, event, callback):
+        """Call callback with the event's arguments whenever event is raised"""
+        self.listeners[event].append(callback)
+        return self
+    
+    def emit(self, event, *args):
+        if event == EVENT_WORD:
+            self.spoken_offset = args[0]
+        for callback in list(self.listeners[event]):
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Error in {event} listener: {str(e)}")
+    
+    def cancel(self):
+        """Drop the job if it has not started, or stop the engine if it is running"""
+        with self.start_lock:
+            if self.done():
+                return False
+            self.stop_requested = True
+            if not self.running():
+                self.set_result((False, "Speech cancelled"))
+                return True
+        
+        engine = self.converter.engine
+        if engine is not None:
+            engine.stop()
+        return True
+    
+    def run(self, function, *args):
+        """Run an engine call on the current thread and resolve the job with its result"""
+        wait(self.previous)
+        self.previous = []
+        with self.start_lock:
+            if self.done():
+                return self.result()
+            self.set_running_or_notify_cancel()
+        
+        try:
+            result = function(self, *args)
+        except Exception as e:
+            result = (False, f"Error during speech: {str(e)}")
+        if self.stop_requested and result[0]:
+            result = (False, "Speech stopped") + tuple(result[2:])
+        
+        self.set_result(result)
+        return result
+
+
+class AudioConverter:
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = get_default_backend()
+        
+        self.backend = backend
         self.engine = None
-        self.is_speaking = False
         self.is_paused = False
-        self.speech_thread = None
+        # Unfinished jobs that use the engine, oldest first; guarded by lock
+        self.jobs = []
+        self.last_job = None
+        self.lock = threading.Lock()
         self.initialize_engine()
     
+    @property
+    def is_speaking(self):
+        """Whether a speak or save job is running or waiting and has not been stopped"""
+        with self.lock:
+            return any(not job.done() and not job.stop_requested for job in self.jobs)
+    
+    @property
+    def spoken_offset(self):
+        """Character offset of the latest word spoken by the current or last job"""
+        job = self.last_job
+        return job.spoken_offset if job is not None else 0
+    
     def initialize_engine(self):
         """Initialize the TTS engine with default settings"""
         try:
-            self.engine = pyttsx3.init()
+            if self.backend == BACKEND_FAKE:
+                self.engine = FakeTTSEngine()
+            elif self.backend == BACKEND_PYTTSX3:
+                if pyttsx3 is None:
+                    raise RuntimeError("pyttsx3 is not installed")
+                self.engine = pyttsx3.init()
+            else:
+                raise ValueError(f"Unknown TTS backend: {self.backend}")
             
             # Set default properties
             self.set_voice_rate(150)  # Default speaking rate
@@ -90,6 +330,18 @@ class AudioConverter:
             print(f"Error setting voice rate: {str(e)}")
             return False
     
+    def get_voice_rate(self):
+        """Get speaking rate (words per minute)"""
+        try:
+            if self.engine is None:
+                return 150
+            
+            return self.engine.getProperty('rate')
+            
+        except Exception as e:
+            print(f"Error getting voice rate: {str(e)}")
+            return 150
+    
     def set_volume(self, volume):
         """Set volume (0.0 to 1.0)"""
         try:
@@ -104,56 +356,138 @@ class AudioConverter:
             print(f"Error setting volume: {str(e)}")
             return False
     
-    def speak_text(self, text, blocking=False):
-        """Convert text to speech"""
-        try:
-            if self.engine is None:
-                return False, "TTS engine not initialized"
-            
-            if self.is_speaking:
-                return False, "Already speaking"
-            
-            if not text.strip():
-                return False, "No text to speak"
+    def _start_job(self, text, listeners=None, queue=False, busy_message="Already speaking"):
+        """Register a new job that uses the engine
+        
+        Every speak and save goes through here, so checking for and starting
+        a job is atomic. Jobs that were stopped but are still winding down
+        never block a new one; it starts once they have finished. Other
+        unfinished jobs make the new one wait its turn if queue is set, and
+        refuse it otherwise. Returns (job, None) or (None, reason).
+        """
+        if self.engine is None:
+            return None, "TTS engine not initialized"
+        
+        with self.lock:
+            self.jobs = [job for job in self.jobs if not job.done()]
+            if not queue and any(not job.stop_requested for job in self.jobs):
+                return None, busy_message
             
-            if blocking:
-                # Synchronous speech
-                self.is_speaking = True
-                self.engine.say(text)
-                self.engine.runAndWait()
-                self.is_speaking = False
-                return True, "Speech completed"
-            else:
-                # Asynchronous speech
-                self.speech_thread = threading.Thread(target=self._speak_async, args=(text,))
-                self.speech_thread.daemon = True
-                self.speech_thread.start()
-                return True, "Speech started"
-            
-        except Exception as e:
-            self.is_speaking = False
-            return False, f"Error during speech: {str(e)}"
+            job = SpeechJob(self, text, listeners, previous=self.jobs)
+            self.jobs.append(job)
+            self.last_job = job
+            return job, None
+    
+    def _finished_job(self, result, text=""):
+        """A job that could not start, already resolved with result"""
+        job = SpeechJob(self, text)
+        job.set_result(result)
+        return job
     
-    def _speak_async(self, text):
-        """Internal method for asynchronous speech"""
+    def speak(self, text, listeners=None):
+        """Start speaking text on a background thread and return its SpeechJob
+        
+        listeners maps SPEECH_EVENTS to callbacks and is registered before
+        speech starts, so no event is missed. A job that cannot start (e.g.
+        another one is still speaking) is returned already finished with
+        (False, reason).
+        """
+        if not text.strip():
+            return self._finished_job((False, "No text to speak"), text)
+        
+        job, reason = self._start_job(text, listeners)
+        if job is None:
+            return self._finished_job((False, reason), text)
+        
+        threading.Thread(target=job.run, args=(self._run_speech,), daemon=True).start()
+        return job
+    
+    @profiled("tts.speak_text")
+    def speak_text(self, text, blocking=False, sentence_callback=None, word_callback=None):
+        """Convert text to speech
+        
+        If sentence_callback is given, it is called with the (start, end)
+        character offsets of each sentence as the engine starts speaking it.
+        If word_callback is given, it is called with the character offset of
+        each word as it is spoken. spoken_offset always holds the latest one.
+        """
+        listeners = {}
+        if sentence_callback is not None:
+            listeners[EVENT_CHUNK_STARTED] = lambda index, start, end: sentence_callback(start, end)
+        if word_callback is not None:
+            listeners[EVENT_WORD] = word_callback
+        
+        if not blocking:
+            job = self.speak(text, listeners)
+            if job.done():
+                return job.result()
+            return True, "Speech started"
+        
+        if not text.strip():
+            return False, "No text to speak"
+        
+        job, reason = self._start_job(text, listeners)
+        if job is None:
+            return False, reason
+        return job.run(self._run_speech)
+    
+    @contextmanager
+    def _report_progress(self, job, spans):
+        """Forward the engine's utterance and word callbacks to a job
+        
+        Utterances are queued with their index into spans as name, so word
+        locations can be reported relative to the whole text.
+        """
+        def on_started(name):
+            index = int(name)
+            start, end = spans[index]
+            job.spoken_offset = start
+            job.emit(EVENT_CHUNK_STARTED, index, start, end)
+        
+        def on_word(name, location, length):
+            job.emit(EVENT_WORD, spans[int(name)][0] + location)
+        
+        def on_finished(name, completed):
+            job.emit(EVENT_CHUNK_FINISHED, int(name), completed)
+        
+        tokens = [
+            self.engine.connect('started-utterance', on_started),
+            self.engine.connect('started-word', on_word),
+            self.engine.connect('finished-utterance', on_finished)
+        ]
         try:
-            self.is_speaking = True
-            self.engine.say(text)
+            yield
+        finally:
+            for token in tokens:
+                self.engine.disconnect(token)
+    
+    @profiled("tts.run_speech")
+    def _run_speech(self, job):
+        """Queue a job's text on the engine and run until it has been spoken"""
+        # Each sentence is a named utterance so progress maps to the whole text
+        spans = split_sentences(job.text)
+        
+        with self._report_progress(job, spans):
+            for i, (start, end) in enumerate(spans):
+                self.engine.say(job.text[start:end], str(i))
             self.engine.runAndWait()
-            self.is_speaking = False
-        except Exception as e:
-            print(f"Error in async speech: {str(e)}")
-            self.is_speaking = False
+        
+        return True, "Speech completed"
     
     def stop_speech(self):
-        """Stop current speech"""
+        """Stop current speech or saving, and drop the jobs waiting for the engine
+        
+        Returns without waiting for the engine to wind down; a job started
+        right after still runs, once the stopped one has finished.
+        """
         try:
             if self.engine is None:
                 return False
             
-            if self.is_speaking:
-                self.engine.stop()
-                self.is_speaking = False
+            with self.lock:
+                jobs = list(self.jobs)
+            for job in reversed(jobs):
+                job.cancel()
             
             return True
             
@@ -161,8 +495,35 @@ class AudioConverter:
             print(f"Error stopping speech: {str(e)}")
             return False
     
+    def save(self, text, filename, listeners=None, sentence_marks=False):
+        """Start saving text as audio on a background thread and return its SpeechJob
+        
+        The job resolves to save_to_audio_file's result, or with
+        sentence_marks to save_with_sentence_marks's. Like speak(), it is
+        refused while another job is using the engine.
+        """
+        job, reason = self._start_job(text, listeners, busy_message="TTS engine is busy")
+        if job is None:
+            result = (False, reason, []) if sentence_marks else (False, reason)
+            return self._finished_job(result, text)
+        
+        function = self._save_marked if sentence_marks else self._save
+        threading.Thread(target=job.run, args=(function, filename), daemon=True).start()
+        return job
+    
+    @profiled("tts.save_to_audio_file")
     def save_to_audio_file(self, text, filename):
-        """Save text as audio file"""
+        """Save text as audio file
+        
+        Waits for any job already using the engine to finish first.
+        """
+        job, reason = self._start_job(text, queue=True)
+        if job is None:
+            return False, reason
+        return job.run(self._save, filename)
+    
+    def _save(self, job, filename):
+        text = job.text
         try:
             if self.engine is None:
                 return False, "TTS engine not initialized"
@@ -174,9 +535,10 @@ class AudioConverter:
             if not filename.lower().endswith('.wav'):
                 filename += '.wav'
             
-            # Save to file
-            self.engine.save_to_file(text, filename)
-            self.engine.runAndWait()
+            # Save to file as one chunk
+            with self._report_progress(job, [(0, len(text))]):
+                self.engine.save_to_file(text, filename, "0")
+                self.engine.runAndWait()
             
             # Check if file was created
             if os.path.exists(filename):
@@ -187,6 +549,78 @@ class AudioConverter:
         except Exception as e:
             return False, f"Error saving audio: {str(e)}"
     
+    def save_with_sentence_marks(self, text, filename):
+        """Save text as audio and report the frame where each sentence starts
+        
+        Sentences are queued as separate files for one engine run and then
+        joined, so their positions in the audio are exact rather than
+        estimated. Returns (success, message, marks) where marks is a list of
+        (character offset, frame offset) per sentence. Waits for any job
+        already using the engine to finish first.
+        """
+        job, reason = self._start_job(text, queue=True)
+        if job is None:
+            return False, reason, []
+        
+        result = job.run(self._save_marked, filename)
+        if len(result) == 2:
+            # Stopped before it started, so nothing was saved
+            return result + ([],)
+        return result
+    
+    def _save_marked(self, job, filename):
+        text = job.text
+        spans = split_sentences(text)
+        if self.engine is None:
+            return False, "TTS engine not initialized", []
+        if not spans:
+            return False, "No text to save", []
+        
+        if not filename.lower().endswith('.wav'):
+            filename += '.wav'
+        part_paths = [f"{filename}.{i}.part.wav" for i in range(len(spans))]
+        
+        try:
+            with self._report_progress(job, spans):
+                for i, ((start, end), part_path) in enumerate(zip(spans, part_paths)):
+                    self.engine.save_to_file(text[start:end], part_path, str(i))
+                self.engine.runAndWait()
+            
+            if not any(os.path.exists(part_path) for part_path in part_paths):
+                return False, "Failed to create audio file", []
+            
+            marks = []
+            params = None
+            frames = 0
+            with wave.open(filename, 'wb') as output:
+                for (start, _), part_path in zip(spans, part_paths):
+                    marks.append((start, frames))
+                    if not os.path.exists(part_path):
+                        # Nothing speakable in this sentence
+                        continue
+                    
+                    with wave.open(part_path, 'rb') as part:
+                        if params is None:
+                            params = part.getparams()
+                            output.setnchannels(params.nchannels)
+                            output.setsampwidth(params.sampwidth)
+                            output.setframerate(params.framerate)
+                        elif part.getparams()[:3] != params[:3]:
+                            raise ValueError("Sentences were rendered in different audio formats")
+                        
+                        output.writeframes(part.readframes(part.getnframes()))
+                        frames += part.getnframes()
+            
+            return True, f"Audio saved to {filename}", marks
+            
+        except Exception as e:
+            return False, f"Error saving audio: {str(e)}", []
+            
+        finally:
+            for part_path in part_paths:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+    
     def is_busy(self):
         """Check if TTS engine is currently speaking"""
         return self.is_speaking
@@ -220,7 +654,7 @@ class AudioConverter:
                 self.engine.stop()
                 del self.engine
                 self.engine = None
-                
+            
         except Exception as e:
             print(f"Error during cleanup: {str(e)}")
     
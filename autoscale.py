@@ -0,0 +1,522 @@
+"""
+Autoscale Module
+Worker pools that grow and shrink with measured throughput, CPU saturation
+and memory use, for page extraction and for export_parallel's synthesis
+
+Every few seconds the controller looks at each pool's pages/second, the
+machine's CPU busy fraction and the resident memory of all workers, and
+adds a worker while that pays off, takes one away when it did not, and
+never lets the workers together exceed the memory ceiling. Every change is
+logged with its reason.
+"""
+import argparse
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import time
+from collections import deque
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from pdf_reader import PDFReader, ENGINE_PYPDF2
+from process_utils import get_physical_memory, get_rss
+from profiling import PROFILE_MODES, profile_run, profile_stage, page_boundary, record_time, get_profile_dir
+from renderer import export_parallel
+
+# Seconds between scaling decisions, and the window throughput is measured over
+SCALE_INTERVAL = 2.0
+THROUGHPUT_WINDOW = 6.0
+
+# Above this CPU busy fraction, more CPU-bound workers cannot help
+CPU_SATURATION = 0.9
+
+# Relative throughput gain that justifies the last worker added
+MIN_GAIN = 0.1
+
+# Memory ceiling as a fraction of physical memory unless configured
+DEFAULT_MEMORY_FRACTION = 0.5
+
+# Times a task is retried after the worker running it died
+MAX_TASK_RETRIES = 1
+
+# Per-process state of extraction workers
+_worker_reader = None
+
+
+class CPUMonitor:
+    """Machine-wide CPU busy fraction since the previous sample"""
+    
+    def __init__(self):
+        self.previous = self._read_times()
+    
+    def _read_times(self):
+        """(busy, total) CPU time counters"""
+        try:
+            with open("/proc/stat") as f:
+                values = [int(value) for value in f.readline().split()[1:]]
+            idle = values[3] + (values[4] if len(values) > 4 else 0)
+            return sum(values) - idle, sum(values)
+        except (OSError, ValueError, IndexError):
+            return None
+    
+    def sample(self):
+        """Busy fraction between 0 and 1, or None if it cannot be measured"""
+        current = self._read_times()
+        if current is None:
+            if psutil is not None:
+                return psutil.cpu_percent() / 100
+            try:
+                return min(1.0, os.getloadavg()[0] / (os.cpu_count() or 1))
+            except (OSError, AttributeError):
+                return None
+        
+        previous, self.previous = self.previous, current
+        if previous is None or current[1] == previous[1]:
+            return None
+        return (current[0] - previous[0]) / (current[1] - previous[1])
+
+
+def scaling_decision(size, min_workers, max_workers, backlog, throughput, previous,
+                     cpu, rss_total, rss_per_worker, memory_limit):
+    """Decide the next size of one pool; returns (new size, reason)
+    
+    previous is (size, throughput) measured before the last change, or
+    None. Memory comes first, then whether the last change paid off, then
+    whether there is work and CPU to add a worker for.
+    """
+    if memory_limit and rss_total is not None and rss_total > memory_limit and size > min_workers:
+        return size - 1, (f"RSS {rss_total / 2**20:.0f} MB over ceiling "
+                          f"{memory_limit / 2**20:.0f} MB")
+    
+    if previous is not None and size > previous[0]:
+        if throughput < previous[1] * (1 + MIN_GAIN):
+            return previous[0], (f"no gain from worker {size} "
+                                 f"({previous[1]:.2f} -> {throughput:.2f} pages/s)")
+    
+    if backlog <= size:
+        if size > max(min_workers, backlog):
+            return max(min_workers, backlog), f"backlog of {backlog} needs fewer workers"
+        return size, "backlog covered"
+    
+    if size >= max_workers:
+        return size, f"at maximum of {max_workers} workers"
+    
+    if cpu is not None and cpu >= CPU_SATURATION:
+        return size, f"CPU saturated at {cpu:.0%}"
+    
+    if memory_limit and rss_total is not None and rss_per_worker:
+        if rss_total + rss_per_worker > memory_limit:
+            return size, (f"another worker would exceed the {memory_limit / 2**20:.0f} MB ceiling")
+    
+    cpu_text = f"CPU at {cpu:.0%}" if cpu is not None else "CPU unknown"
+    return size + 1, f"{cpu_text}, backlog of {backlog}"
+
+
+def _pool_worker(function, initializer, initargs, connection):
+    """Worker process loop: run tasks sent over the connection until told to stop"""
+    if initializer is not None:
+        initializer(*initargs)
+    
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        
+        task_id, args = task
+        try:
+            connection.send((task_id, True, function(*args)))
+        except Exception as e:
+            connection.send((task_id, False, str(e)))
+
+
+class _PoolWorker:
+    """A worker process, its connection and the task it is running"""
+    
+    def __init__(self, process, connection):
+        self.process = process
+        self.connection = connection
+        # (task id, args) sent to the worker and not answered yet
+        self.task = None
+
+
+class ScalablePool:
+    """Process pool whose number of workers can change while it runs
+    
+    Each worker has its own connection and runs one task at a time, so
+    the pool knows which task a worker had when it dies. That task is
+    retried on another worker up to MAX_TASK_RETRIES times and then
+    returned as failed.
+    """
+    
+    def __init__(self, name, function, initializer=None, initargs=(),
+                 min_workers=1, max_workers=None):
+        self.name = name
+        self.function = function
+        self.initializer = initializer
+        self.initargs = initargs
+        self.min_workers = min_workers
+        self.max_workers = max_workers or os.cpu_count() or 1
+        
+        # Spawned like export_parallel's fixed pool, so workers never inherit
+        # locks held by other threads of the parent
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = []
+        # Workers asked to stop that may still be finishing a task
+        self.stopping = []
+        self.target_size = 0
+        # Tasks not sent to a worker yet, results not returned yet, and
+        # how often each task was lost with its worker
+        self.backlog = deque()
+        self.finished = deque()
+        self.retries = {}
+        self.pending = 0
+        self.completions = deque()
+        self.previous = None
+    
+    @property
+    def size(self):
+        return len(self.workers)
+    
+    def resize(self, size):
+        """Start or stop workers; a stopped worker finishes its current task first"""
+        size = max(self.min_workers, min(self.max_workers, size))
+        self.target_size = size
+        
+        while len(self.workers) < size:
+            connection, child_connection = self.context.Pipe()
+            process = self.context.Process(
+                target=_pool_worker,
+                args=(self.function, self.initializer, self.initargs, child_connection),
+                daemon=True
+            )
+            process.start()
+            child_connection.close()
+            self.workers.append(_PoolWorker(process, connection))
+        
+        # Idle workers go first; a busy one reads the stop after its result
+        self.workers.sort(key=lambda worker: worker.task is None)
+        while len(self.workers) > size:
+            worker = self.workers.pop()
+            self._send(worker, None)
+            self.stopping.append(worker)
+        self._reap()
+        self._dispatch()
+    
+    def _send(self, worker, message):
+        try:
+            worker.connection.send(message)
+        except OSError:
+            # Dead workers are noticed when their connection is polled
+            pass
+    
+    def _dispatch(self):
+        """Hand backlog tasks to idle workers"""
+        for worker in self.workers:
+            if not self.backlog:
+                break
+            if worker.task is None:
+                worker.task = self.backlog.popleft()
+                self._send(worker, worker.task)
+    
+    def _reap(self):
+        """Join stopped workers that have exited without a task"""
+        for worker in [worker for worker in self.stopping
+                       if worker.task is None and not worker.process.is_alive()]:
+            self._remove(worker)
+    
+    def _remove(self, worker):
+        worker.process.join()
+        worker.connection.close()
+        if worker in self.workers:
+            self.workers.remove(worker)
+        else:
+            self.stopping.remove(worker)
+    
+    def _lost(self, worker):
+        """Retry or fail the task of a worker that died, and replace the worker"""
+        self._remove(worker)
+        if worker.task is not None:
+            task_id, args = worker.task
+            self.retries[task_id] = self.retries.get(task_id, 0) + 1
+            if self.retries[task_id] <= MAX_TASK_RETRIES:
+                self.backlog.appendleft(worker.task)
+            else:
+                self.finished.append((task_id, False, f"Worker process died with exit code "
+                                                      f"{worker.process.exitcode}"))
+        self.resize(self.target_size)
+    
+    def _poll(self, timeout):
+        """Collect results and notice dead workers"""
+        workers = {worker.connection: worker for worker in self.workers + self.stopping}
+        for connection in multiprocessing.connection.wait(list(workers), timeout):
+            worker = workers[connection]
+            if worker not in self.workers and worker not in self.stopping:
+                # Already joined while replacing another worker
+                continue
+            try:
+                result = connection.recv()
+            except (EOFError, OSError):
+                self._lost(worker)
+                continue
+            
+            worker.task = None
+            self.finished.append(result)
+        self._reap()
+        self._dispatch()
+    
+    def submit(self, task_id, *args):
+        self.backlog.append((task_id, args))
+        self.pending += 1
+        self._dispatch()
+    
+    def get_result(self, timeout):
+        """Next (task id, success, result), or None on timeout"""
+        if not self.finished:
+            self._poll(timeout)
+        if not self.finished:
+            return None
+        
+        self.pending -= 1
+        self.completions.append(time.monotonic())
+        return self.finished.popleft()
+    
+    def throughput(self, window=THROUGHPUT_WINDOW):
+        """Tasks completed per second over the last window"""
+        cutoff = time.monotonic() - window
+        while self.completions and self.completions[0] < cutoff:
+            self.completions.popleft()
+        return len(self.completions) / window
+    
+    def rss(self):
+        """(total resident bytes, per worker average) of live workers
+        
+        Stopped workers still finishing a task count towards the total
+        until they exit; the average is over the active workers.
+        """
+        self._reap()
+        sizes = [get_rss(worker.process.pid) for worker in self.workers if worker.process.is_alive()]
+        sizes = [size for size in sizes if size is not None]
+        stopping = [get_rss(worker.process.pid) for worker in self.stopping]
+        stopping = [size for size in stopping if size is not None]
+        if not sizes and not stopping:
+            return None, None
+        return sum(sizes) + sum(stopping), sum(sizes) / len(sizes) if sizes else None
+    
+    def shutdown(self):
+        """Stop every worker, including ones already asked to stop"""
+        workers = self.workers + self.stopping
+        for worker in self.workers:
+            self._send(worker, None)
+        for worker in workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+            worker.connection.close()
+        self.workers = []
+        self.stopping = []
+
+
+class Autoscaler:
+    """Periodically resizes pools and logs every decision"""
+    
+    def __init__(self, pools=(), memory_limit=None, verbose=True):
+        if memory_limit is None:
+            physical = get_physical_memory()
+            memory_limit = int(physical * DEFAULT_MEMORY_FRACTION) if physical else None
+        
+        self.pools = []
+        self.memory_limit = memory_limit
+        self.verbose = verbose
+        self.cpu_monitor = CPUMonitor()
+        self.last_check = time.monotonic()
+        # (time, pool name, old size, new size, reason) of every change
+        self.decisions = []
+        for pool in pools:
+            self.add(pool)
+    
+    def add(self, pool):
+        """Start a pool at its minimum size and size it from now on"""
+        pool.resize(pool.min_workers)
+        self.pools.append(pool)
+        self._log(pool, 0, pool.size, "initial size")
+    
+    def remove(self, pool):
+        """Stop sizing a pool, e.g. once it is shut down"""
+        if pool in self.pools:
+            self.pools.remove(pool)
+    
+    def _log(self, pool, old_size, new_size, reason):
+        self.decisions.append((time.time(), pool.name, old_size, new_size, reason))
+        if self.verbose:
+            print(f"{pool.name} pool: {old_size} -> {new_size} workers ({reason})")
+    
+    def maybe_scale(self):
+        """Make one round of decisions if the interval has passed"""
+        now = time.monotonic()
+        if now - self.last_check < SCALE_INTERVAL:
+            return
+        self.last_check = now
+        
+        cpu = self.cpu_monitor.sample()
+        usage = [pool.rss() for pool in self.pools]
+        rss_total = sum(total for total, _ in usage if total is not None) or None
+        
+        for pool, (_, rss_per_worker) in zip(self.pools, usage):
+            throughput = pool.throughput()
+            size, reason = scaling_decision(
+                pool.size, pool.min_workers, pool.max_workers, pool.pending,
+                throughput, pool.previous, cpu, rss_total, rss_per_worker, self.memory_limit
+            )
+            
+            if size != pool.size:
+                old_size = pool.size
+                pool.previous = (old_size, throughput) if size > old_size else None
+                pool.resize(size)
+                self._log(pool, old_size, pool.size, reason)
+            elif pool.previous is not None and pool.previous[0] < size:
+                # The last growth paid off; measure the next one against now
+                pool.previous = None
+
+
+def _init_extract_worker(file_path, engine, decryption_key=None):
+    """Open the PDF once per extraction worker
+    
+    Encrypted PDFs are opened with the key the parent derived, so workers
+    neither need the password nor derive the key again.
+    """
+    global _worker_reader
+    _worker_reader = PDFReader(engine)
+    _worker_reader.open_pdf(file_path, decryption_key=decryption_key)
+
+
+def _extract_page(page_number):
+    """Extract one page in an extraction worker; returns (text, seconds)"""
+    start = time.perf_counter()
+    success, text = _worker_reader.get_page_text(page_number)
+    if not success:
+        raise RuntimeError(text)
+    return text, time.perf_counter() - start
+
+
+def extract_adaptive(file_path, page_numbers, autoscaler, engine=ENGINE_PYPDF2,
+                     decryption_key=None, max_workers=None):
+    """Extract pages on a self-sizing pool; returns (success, [(page, text)] or message)"""
+    extractors = ScalablePool("extract", _extract_page, _init_extract_worker,
+                              (file_path, engine, decryption_key), max_workers=max_workers)
+    autoscaler.add(extractors)
+    
+    try:
+        for page_number in page_numbers:
+            extractors.submit(page_number, page_number)
+        
+        texts = {}
+        while extractors.pending:
+            result = extractors.get_result(timeout=0.05)
+            autoscaler.maybe_scale()
+            if result is None:
+                continue
+            
+            page_number, success, value = result
+            if not success:
+                return False, f"Page {page_number + 1} failed in extraction: {value}"
+            texts[page_number], seconds = value
+            record_time("pdf.get_page_text", seconds)
+            page_boundary(f"page {page_number + 1}")
+        
+        return True, [(page_number, texts[page_number]) for page_number in page_numbers]
+        
+    finally:
+        autoscaler.remove(extractors)
+        extractors.shutdown()
+
+
+def convert_adaptive(file_path, output_path, backend=None, rate=150, voice_id=None,
+                     engine=ENGINE_PYPDF2, memory_limit=None, max_workers=None, verbose=True,
+                     password=None, profile=None):
+    """Convert a PDF to one WAV file with self-sizing extraction and synthesis pools
+    
+    Pages are extracted on an autoscaled pool and then exported with
+    export_parallel, whose synthesis pool the same autoscaler sizes.
+    Returns (success, message or summary) where the summary includes the
+    scaling decisions taken. profile works as for export_parallel and
+    covers both extraction and synthesis in one report.
+    """
+    reader = PDFReader(engine)
+    success, message = reader.open_pdf(file_path, password=password)
+    if not success:
+        return False, message
+    reader.classify_pages()
+    text_pages, _ = reader.get_text_pages()
+    decryption_key = reader.decryption_key
+    reader.close_pdf()
+    
+    if not text_pages:
+        return False, "No pages with text to convert"
+    
+    max_workers = max_workers or os.cpu_count() or 1
+    autoscaler = Autoscaler(memory_limit=memory_limit, verbose=verbose)
+    started = time.monotonic()
+    
+    try:
+        with profile_run(get_profile_dir(output_path), profile):
+            with profile_stage("extract"):
+                success, chunks = extract_adaptive(file_path, text_pages, autoscaler, engine,
+                                                   decryption_key, max_workers)
+            if not success:
+                return False, chunks
+            
+            # The export is a stage of this profiled run rather than a run of its own
+            success, message = export_parallel(chunks, output_path, max_workers, backend, rate,
+                                               voice_id, autoscaler=autoscaler, profile=False)
+            if not success:
+                return False, message
+        
+    except Exception as e:
+        return False, f"Error converting {os.path.basename(file_path)}: {str(e)}"
+    
+    elapsed = time.monotonic() - started
+    return True, {
+        'output_path': output_path,
+        'pages': len(text_pages),
+        'seconds': round(elapsed, 2),
+        'pages_per_second': round(len(text_pages) / elapsed, 2),
+        'decisions': autoscaler.decisions
+    }
+
+
+def main():
+    """Convert a PDF with autoscaled pools from the command line"""
+    parser = argparse.ArgumentParser(description="Convert a PDF with self-sizing worker pools")
+    parser.add_argument("pdf")
+    parser.add_argument("output")
+    parser.add_argument("--backend", default=None)
+    parser.add_argument("--rate", type=int, default=150)
+    parser.add_argument("--memory-limit-mb", type=int, default=None)
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument("--password", default=None, help="password of an encrypted PDF")
+    parser.add_argument("--profile", choices=PROFILE_MODES, default=None,
+                        help="write a profiling report next to the output")
+    args = parser.parse_args()
+    
+    memory_limit = args.memory_limit_mb * 2**20 if args.memory_limit_mb else None
+    success, result = convert_adaptive(args.pdf, args.output, args.backend, args.rate,
+                                       memory_limit=memory_limit, max_workers=args.max_workers,
+                                       password=args.password, profile=args.profile)
+    if not success:
+        print(result)
+        sys.exit(1)
+    
+    print(f"Converted {result['pages']} pages in {result['seconds']}s "
+          f"({result['pages_per_second']} pages/s) to {result['output_path']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Bookmarks Module
+Tracks the reading position and saves it to the library with debounced writes
+"""
+import threading
+
+from audio_converter import split_sentences
+
+# Seconds to wait after the last position update before writing it
+SAVE_DELAY = 2.0
+
+
+def sentence_start(text, offset):
+    """Get the start offset of the sentence containing offset"""
+    start = 0
+    
+    for sentence_begin, sentence_end in split_sentences(text):
+        if sentence_begin > offset:
+            break
+        start = sentence_begin
+    
+    return start
+
+
+class PositionTracker:
+    def __init__(self, library, file_hash, save_delay=SAVE_DELAY):
+        self.library = library
+        self.file_hash = file_hash
+        self.save_delay = save_delay
+        self.lock = threading.Lock()
+        self.timer = None
+        self.pending = None
+        self.saved = None
+    
+    def update(self, page, offset):
+        """Record the position being spoken; written after save_delay of quiet"""
+        with self.lock:
+            self.pending = (page, offset)
+            
+            # Word callbacks arrive several times a second; one pending timer
+            # coalesces all updates made before it fires
+            if self.timer is None:
+                self.timer = threading.Timer(self.save_delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+    
+    def flush(self):
+        """Write the latest position now
+        
+        A position of a book not yet added to the library stays pending
+        until a later flush, once the book has been added.
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            
+            position = self.pending
+            self.pending = None
+        
+        if position is None or position == self.saved:
+            return
+        
+        try:
+            if self.library.update_position(self.file_hash, *position):
+                self.saved = position
+                return
+        except Exception as e:
+            print(f"Error saving reading position: {str(e)}")
+        
+        with self.lock:
+            if self.pending is None:
+                self.pending = position
+    
+    def get_position(self):
+        """Get the latest known position (pending or saved)"""
+        with self.lock:
+            return self.pending or self.saved
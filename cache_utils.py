@@ -0,0 +1,36 @@
+"""
+Cache Utilities Module
+Locates the on-disk cache and identifies documents by content hash
+"""
+import hashlib
+import os
+
+# Override the cache location with this environment variable
+CACHE_DIR_ENV = "AUDIOBOOK_CACHE_DIR"
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def get_cache_dir(*subdirs):
+    """Get (and create) a directory inside the application cache"""
+    base_dir = os.environ.get(CACHE_DIR_ENV)
+    if not base_dir:
+        base_dir = os.path.join(os.path.expanduser("~"), ".cache", "pdf_audiobook")
+    
+    path = os.path.join(base_dir, *subdirs)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def compute_file_hash(file_path):
+    """Compute the SHA-256 hash of a file's contents"""
+    digest = hashlib.sha256()
+    
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    
+    return digest.hexdigest()
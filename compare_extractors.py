@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Extractor Comparison Script
+Validates the fast text extractor against PyPDF2's extract_text on a corpus
+of PDF files and reports per-page speed and word-level agreement
+
+Usage: python compare_extractors.py <pdf file or directory>...
+"""
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+from pdf_reader import PDFReader, ENGINE_PYPDF2, ENGINE_FAST
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Minimum word-level agreement for a file to pass
+MIN_SIMILARITY = 0.95
+
+
+def word_similarity(reference, candidate):
+    """Word-level F1 score between two texts, ignoring layout and spacing"""
+    reference_words = Counter(WORD_PATTERN.findall(reference.lower()))
+    candidate_words = Counter(WORD_PATTERN.findall(candidate.lower()))
+    
+    if not reference_words and not candidate_words:
+        return 1.0
+    
+    common = sum((reference_words & candidate_words).values())
+    if common == 0:
+        return 0.0
+    
+    precision = common / sum(candidate_words.values())
+    recall = common / sum(reference_words.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def time_engine(file_path, engine):
+    """Extract every page with an engine; return (texts, seconds)"""
+    reader = PDFReader(engine)
+    try:
+        success, message = reader.open_pdf(file_path)
+        if not success:
+            raise RuntimeError(message)
+        
+        texts = []
+        start_time = time.perf_counter()
+        for page_num in range(reader.total_pages):
+            success, text = reader.get_page_text(page_num)
+            texts.append(text if success else "")
+        elapsed = time.perf_counter() - start_time
+        
+        return texts, elapsed
+        
+    finally:
+        reader.close_pdf()
+
+
+def compare_file(file_path):
+    """Compare both engines on one file"""
+    reference_texts, reference_time = time_engine(file_path, ENGINE_PYPDF2)
+    fast_texts, fast_time = time_engine(file_path, ENGINE_FAST)
+    
+    similarity = word_similarity("\n".join(reference_texts), "\n".join(fast_texts))
+    
+    return {
+        'pages': len(reference_texts),
+        'pypdf2_time': reference_time,
+        'fast_time': fast_time,
+        'similarity': similarity
+    }
+
+
+def find_pdfs(paths):
+    """Expand directories into the PDF files below them"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.lower().endswith('.pdf'):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def main():
+    """Compare extractors on the files given on the command line"""
+    if len(sys.argv) < 2:
+        print(__doc__.strip().splitlines()[-1])
+        sys.exit(1)
+    
+    total_pages = 0
+    total_reference = 0.0
+    total_fast = 0.0
+    failures = 0
+    
+    for file_path in find_pdfs(sys.argv[1:]):
+        try:
+            result = compare_file(file_path)
+        except Exception as e:
+            print(f"✗ {file_path}: {str(e)}")
+            failures += 1
+            continue
+        
+        total_pages += result['pages']
+        total_reference += result['pypdf2_time']
+        total_fast += result['fast_time']
+        
+        passed = result['similarity'] >= MIN_SIMILARITY
+        if not passed:
+            failures += 1
+        
+        speedup = result['pypdf2_time'] / result['fast_time'] if result['fast_time'] else 0.0
+        print(f"{'✓' if passed else '✗'} {file_path}: {result['pages']} pages, "
+              f"similarity {result['similarity']:.3f}, {speedup:.1f}x faster")
+    
+    if total_pages:
+        print("-" * 40)
+        print(f"PyPDF2: {1000 * total_reference / total_pages:.2f} ms/page")
+        print(f"Fast:   {1000 * total_fast / total_pages:.2f} ms/page")
+        if total_fast:
+            print(f"Speedup: {total_reference / total_fast:.1f}x")
+    
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
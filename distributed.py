@@ -0,0 +1,421 @@
+"""
+Distributed Rendering Module
+Render books across machines through a shared (e.g. NFS) work directory
+
+A coordinator splits a book into chunk tasks under <root>/pending. Workers on
+any node claim a task by renaming it into <root>/claimed (only one rename can
+succeed), keep the claim alive by touching it, render the chunk with
+AudioConverter and publish the segment with an atomic rename. Claims whose
+lease has expired, and tasks that failed to render, are moved back to
+pending, so crashed workers lose nothing but the chunk in progress. A task
+that fails MAX_ATTEMPTS times is moved to <root>/failed instead. The
+coordinator assembles the book once every segment exists.
+
+Usage:
+    python distributed.py submit <root> <pdf> <output.wav> [--rate 150] [--voice ID]
+    python distributed.py worker <root> [--backend fake]
+    python distributed.py assemble <root> <book id>
+"""
+import argparse
+import hashlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+
+from audio_converter import AudioConverter, TTS_BACKENDS
+from cache_utils import compute_file_hash
+from duration_estimator import DurationEstimator, plan_work
+from renderer import concatenate_wav
+
+PENDING_DIR = "pending"
+CLAIMED_DIR = "claimed"
+DONE_DIR = "done"
+FAILED_DIR = "failed"
+BOOKS_DIR = "books"
+SEGMENTS_DIR = "segments"
+TEMP_DIR = "tmp"
+
+# A claim not touched for this many seconds belongs to a dead worker
+LEASE_SECONDS = 60.0
+# Claims are touched this many times per lease
+HEARTBEATS_PER_LEASE = 4
+
+# A task that failed or whose worker died this many times is given up
+MAX_ATTEMPTS = 3
+
+# Seconds an idle worker waits before looking for tasks again
+POLL_INTERVAL = 1.0
+
+# Chunks are sized for roughly this many workers
+PLANNED_WORKERS = 8
+
+
+def _path(root, *parts):
+    return os.path.join(root, *parts)
+
+
+def init_work_dir(root):
+    """Create the shared directory layout"""
+    for name in (PENDING_DIR, CLAIMED_DIR, DONE_DIR, FAILED_DIR, BOOKS_DIR, SEGMENTS_DIR, TEMP_DIR):
+        os.makedirs(_path(root, name), exist_ok=True)
+
+
+def _write_atomic(root, path, payload):
+    """Write JSON so other nodes never see a partial file"""
+    temp_path = _path(root, TEMP_DIR, uuid.uuid4().hex)
+    with open(temp_path, 'w') as f:
+        json.dump(payload, f)
+    os.replace(temp_path, path)
+
+
+def shared_now(root, worker_id):
+    """Current time according to the shared file system
+    
+    Lease ages are compared with file modification times set by the file
+    server, so this avoids trusting the local clock of each node.
+    """
+    clock_path = _path(root, TEMP_DIR, f"clock-{worker_id}")
+    with open(clock_path, 'w'):
+        pass
+    return os.path.getmtime(clock_path)
+
+
+def make_book_id(file_path, settings):
+    """Id of a PDF rendered with the given settings
+    
+    Rate and voice are part of the id, so rendering the same PDF with other
+    settings never reuses segments of an earlier rendering.
+    """
+    key = compute_file_hash(file_path) + json.dumps(settings, sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+def submit_book(root, book_id, chunks, output_path, settings, estimator=None):
+    """Write the tasks of a book to the pending directory
+    
+    chunks is a list of (key, text) in reading order. Chunks are split and
+    ranked longest-first so workers pick up the biggest work first. settings
+    holds the 'rate' and 'voice' to render with.
+    """
+    init_work_dir(root)
+    
+    if estimator is None:
+        estimator = DurationEstimator()
+    rate = settings.get('rate', 150)
+    
+    chunks = [(key, text) for key, text in chunks if text.strip()]
+    order = {key: index for index, (key, _) in enumerate(chunks)}
+    items = plan_work(chunks, PLANNED_WORKERS, lambda text: estimator.estimate_synthesis_seconds(text, rate))
+    
+    segment_dir = _path(root, SEGMENTS_DIR, book_id)
+    os.makedirs(segment_dir, exist_ok=True)
+    
+    segments = sorted(f"{order[key]:05d}_{part:03d}" for key, part, _, _ in items)
+    _write_atomic(root, _path(root, BOOKS_DIR, book_id + ".json"), {
+        'book_id': book_id,
+        'output_path': os.path.abspath(output_path),
+        'settings': settings,
+        'segments': segments,
+        'submitted_at': time.time()
+    })
+    
+    # Task names sort by rank, so claiming in name order is longest-first
+    for rank, (key, part, text, seconds) in enumerate(items):
+        segment = f"{order[key]:05d}_{part:03d}"
+        task_name = f"{rank:06d}-{book_id}-{segment}.json"
+        _write_atomic(root, _path(root, PENDING_DIR, task_name), {
+            'book_id': book_id,
+            'segment': segment,
+            'text': text,
+            'settings': settings
+        })
+    
+    return len(items)
+
+
+def _retry_task(root, claimed_path, task_name, max_attempts):
+    """Count a failed attempt at a claimed task and queue it again, or give it up
+    
+    Returns False if the claim was already taken away, else True.
+    """
+    # Owning the claim first makes sure only one node counts the attempt
+    owned_path = _path(root, TEMP_DIR, uuid.uuid4().hex)
+    try:
+        os.rename(claimed_path, owned_path)
+    except FileNotFoundError:
+        return False
+    
+    with open(owned_path) as f:
+        task = json.load(f)
+    task['attempts'] = task.get('attempts', 0) + 1
+    
+    target_dir = FAILED_DIR if task['attempts'] >= max_attempts else PENDING_DIR
+    _write_atomic(root, _path(root, target_dir, task_name), task)
+    os.remove(owned_path)
+    return True
+
+
+def requeue_expired(root, worker_id, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+    """Move claims whose lease has expired back to pending; returns how many
+    
+    Each expiry counts as a failed attempt; see MAX_ATTEMPTS.
+    """
+    now = shared_now(root, worker_id)
+    requeued = 0
+    
+    for task_name in os.listdir(_path(root, CLAIMED_DIR)):
+        claimed_path = _path(root, CLAIMED_DIR, task_name)
+        try:
+            if now - os.path.getmtime(claimed_path) <= lease_seconds:
+                continue
+        except FileNotFoundError:
+            # Finished or requeued by someone else meanwhile
+            continue
+        
+        if _retry_task(root, claimed_path, task_name, max_attempts):
+            requeued += 1
+    
+    return requeued
+
+
+def claim_task(root):
+    """Claim the highest ranked pending task; returns (task name, task) or None"""
+    for task_name in sorted(os.listdir(_path(root, PENDING_DIR))):
+        claimed_path = _path(root, CLAIMED_DIR, task_name)
+        try:
+            os.rename(_path(root, PENDING_DIR, task_name), claimed_path)
+        except FileNotFoundError:
+            # Another worker won the race for this task
+            continue
+        
+        # The rename keeps the old modification time; start the lease now.
+        # A claim requeued in this window is merely rendered twice.
+        os.utime(claimed_path)
+        with open(claimed_path) as f:
+            return task_name, json.load(f)
+    
+    return None
+
+
+def _heartbeat(claimed_path, stop_event, interval):
+    """Keep touching a claim every interval seconds until the task is finished"""
+    while not stop_event.wait(interval):
+        try:
+            os.utime(claimed_path)
+        except FileNotFoundError:
+            # The lease expired and the task was taken away
+            return
+
+
+def render_task(root, task_name, task, audio_converter, worker_id,
+                lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+    """Render a claimed task and publish its segment; returns (success, message)
+    
+    A task that fails to render is queued again right away, or given up
+    after max_attempts.
+    """
+    claimed_path = _path(root, CLAIMED_DIR, task_name)
+    stop_event = threading.Event()
+    heartbeat = threading.Thread(
+        target=_heartbeat, args=(claimed_path, stop_event, lease_seconds / HEARTBEATS_PER_LEASE),
+        daemon=True
+    )
+    heartbeat.start()
+    temp_path = None
+    
+    try:
+        settings = task['settings']
+        audio_converter.set_voice_rate(settings.get('rate', 150))
+        if settings.get('voice') is not None and audio_converter.engine is not None:
+            audio_converter.engine.setProperty('voice', settings['voice'])
+        
+        segment_path = _path(root, SEGMENTS_DIR, task['book_id'], task['segment'] + ".wav")
+        temp_path = f"{segment_path}.{worker_id}.part.wav"
+        success, message = audio_converter.save_to_audio_file(task['text'], temp_path)
+        if success:
+            os.replace(temp_path, segment_path)
+        
+    finally:
+        stop_event.set()
+        heartbeat.join()
+        
+        # A failed render may leave a partial file behind
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+    
+    if not success:
+        _retry_task(root, claimed_path, task_name, max_attempts)
+        return False, message
+    
+    try:
+        os.rename(claimed_path, _path(root, DONE_DIR, task_name))
+    except FileNotFoundError:
+        # Our lease expired; the segment is identical whoever renders it
+        pass
+    
+    return True, f"Rendered {task['segment']} of {task['book_id']}"
+
+
+def run_worker(root, backend=None, worker_id=None, stop_event=None,
+               exit_when_idle=False, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+    """Claim and render tasks until stopped; returns the number rendered
+    
+    With exit_when_idle the worker returns once no task is pending or
+    claimed, instead of waiting for more work.
+    """
+    init_work_dir(root)
+    
+    if worker_id is None:
+        worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    
+    audio_converter = AudioConverter(backend)
+    if audio_converter.engine is None:
+        return 0
+    
+    rendered = 0
+    while stop_event is None or not stop_event.is_set():
+        requeue_expired(root, worker_id, lease_seconds, max_attempts)
+        
+        claimed = claim_task(root)
+        if claimed is None:
+            if exit_when_idle and not os.listdir(_path(root, CLAIMED_DIR)):
+                break
+            time.sleep(POLL_INTERVAL)
+            continue
+        
+        task_name, task = claimed
+        success, message = render_task(root, task_name, task, audio_converter, worker_id,
+                                       lease_seconds, max_attempts)
+        if success:
+            rendered += 1
+        else:
+            print(f"[{worker_id}] {message}")
+    
+    audio_converter.cleanup()
+    return rendered
+
+
+def get_book_progress(root, book_id):
+    """Get (rendered segments, total segments) of a submitted book"""
+    with open(_path(root, BOOKS_DIR, book_id + ".json")) as f:
+        book = json.load(f)
+    
+    segment_dir = _path(root, SEGMENTS_DIR, book_id)
+    done = sum(os.path.exists(_path(segment_dir, segment + ".wav")) for segment in book['segments'])
+    return done, len(book['segments'])
+
+
+def assemble_book(root, book_id):
+    """Join a book's segments into its output file once all are rendered"""
+    try:
+        with open(_path(root, BOOKS_DIR, book_id + ".json")) as f:
+            book = json.load(f)
+        
+        segment_dir = _path(root, SEGMENTS_DIR, book_id)
+        segment_paths = [_path(segment_dir, segment + ".wav") for segment in book['segments']]
+        missing = sum(not os.path.exists(path) for path in segment_paths)
+        if missing:
+            return False, f"{missing} of {len(segment_paths)} segments not rendered yet"
+        
+        concatenate_wav(segment_paths, book['output_path'])
+        return True, f"Audio saved to {book['output_path']}"
+        
+    except Exception as e:
+        return False, f"Error assembling {book_id}: {str(e)}"
+
+
+def get_failed_tasks(root, book_id):
+    """Names of the tasks of a book that were given up after MAX_ATTEMPTS"""
+    return [task_name for task_name in os.listdir(_path(root, FAILED_DIR))
+            if f"-{book_id}-" in task_name]
+
+
+def wait_and_assemble(root, book_id, poll_interval=POLL_INTERVAL, lease_seconds=LEASE_SECONDS,
+                      max_attempts=MAX_ATTEMPTS):
+    """Coordinator loop: recover expired claims until the book can be assembled"""
+    coordinator_id = f"coordinator-{socket.gethostname()}-{os.getpid()}"
+    
+    while True:
+        requeue_expired(root, coordinator_id, lease_seconds, max_attempts)
+        
+        failed = get_failed_tasks(root, book_id)
+        if failed:
+            return False, f"{len(failed)} segment(s) of {book_id} failed {max_attempts} times"
+        
+        done, total = get_book_progress(root, book_id)
+        if done == total:
+            return assemble_book(root, book_id)
+        
+        time.sleep(poll_interval)
+
+
+def main():
+    """Submit books, run workers or assemble from the command line"""
+    parser = argparse.ArgumentParser(description="Distributed audiobook rendering")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    submit = commands.add_parser("submit", help="split a PDF into tasks and wait for it")
+    submit.add_argument("root")
+    submit.add_argument("pdf")
+    submit.add_argument("output")
+    submit.add_argument("--rate", type=int, default=150)
+    submit.add_argument("--voice", default=None, help="voice id of the TTS engine")
+    submit.add_argument("--no-wait", action="store_true")
+    
+    worker = commands.add_parser("worker", help="render tasks")
+    worker.add_argument("root")
+    worker.add_argument("--backend", choices=TTS_BACKENDS, default=None)
+    worker.add_argument("--exit-when-idle", action="store_true")
+    
+    assemble = commands.add_parser("assemble", help="join a finished book")
+    assemble.add_argument("root")
+    assemble.add_argument("book_id")
+    
+    args = parser.parse_args()
+    
+    if args.command == "worker":
+        rendered = run_worker(args.root, args.backend, exit_when_idle=args.exit_when_idle)
+        print(f"Rendered {rendered} task(s)")
+        return
+    
+    if args.command == "assemble":
+        success, message = assemble_book(args.root, args.book_id)
+        print(message)
+        sys.exit(0 if success else 1)
+    
+    from pdf_reader import PDFReader
+    
+    reader = PDFReader()
+    success, message = reader.open_pdf(args.pdf)
+    if not success:
+        print(message)
+        sys.exit(1)
+    
+    reader.classify_pages()
+    text_pages, _ = reader.get_text_pages()
+    chunks = []
+    for page_number in text_pages:
+        success, text = reader.get_page_text(page_number)
+        if not success:
+            print(text)
+            sys.exit(1)
+        chunks.append((page_number, text))
+    reader.close_pdf()
+    
+    settings = {'rate': args.rate, 'voice': args.voice}
+    book_id = make_book_id(args.pdf, settings)
+    count = submit_book(args.root, book_id, chunks, args.output, settings)
+    print(f"Submitted {book_id} as {count} task(s)")
+    
+    if not args.no_wait:
+        success, message = wait_and_assemble(args.root, book_id)
+        print(message)
+        sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
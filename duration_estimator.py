@@ -0,0 +1,185 @@
+"""
+Duration Estimator Module
+Cheap per-chunk estimates of spoken duration and synthesis time, calibrated
+from measurements and persisted in the cache, plus longest-first work planning
+"""
+import json
+import math
+import os
+import threading
+
+from audio_converter import split_sentences, WORD_PATTERN, BACKEND_PYTTSX3
+from cache_utils import get_cache_dir
+
+MODEL_FILE_NAME = "duration_model.json"
+
+# Average characters per word including the following space
+CHARS_PER_WORD = 6.0
+
+# Uncalibrated model: audio runs at the configured rate and synthesis
+# takes a tenth of the audio's duration plus a fixed cost per chunk
+DEFAULT_SPEECH_RATIO = 1.0
+DEFAULT_SYNTHESIS_RATIO = 0.1
+CHUNK_OVERHEAD = 0.05
+
+# Weight of a new measurement once a few have been averaged
+CALIBRATION_WEIGHT = 0.2
+
+# Measurements of less than this much nominal speech (seconds) are too noisy to use
+MIN_CALIBRATION_SECONDS = 1.0
+
+# Chunks expected to take more than 1/SPLIT_SHARE of a worker's fair share are split
+SPLIT_SHARE = 2
+
+
+def count_words(text):
+    """Number of whitespace-separated words in text"""
+    return len(WORD_PATTERN.findall(text))
+
+
+def format_duration(seconds):
+    """Format seconds as M:SS or H:MM:SS"""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+class DurationEstimator:
+    def __init__(self, backend=BACKEND_PYTTSX3, model_path=None):
+        if model_path is None:
+            model_path = os.path.join(get_cache_dir(), MODEL_FILE_NAME)
+        
+        self.backend = backend
+        self.model_path = model_path
+        self.lock = threading.Lock()
+        
+        self.speech_ratio = DEFAULT_SPEECH_RATIO
+        self.synthesis_ratio = DEFAULT_SYNTHESIS_RATIO
+        self.speech_samples = 0
+        self.synthesis_samples = 0
+        
+        self.load()
+    
+    def load(self):
+        """Read this backend's calibration from the model file"""
+        try:
+            with open(self.model_path) as f:
+                model = json.load(f).get(self.backend)
+        except (OSError, ValueError):
+            model = None
+        
+        if model:
+            with self.lock:
+                self.speech_ratio = model['speech_ratio']
+                self.synthesis_ratio = model['synthesis_ratio']
+                self.speech_samples = model['speech_samples']
+                self.synthesis_samples = model['synthesis_samples']
+    
+    def save(self):
+        """Write this backend's calibration, keeping other backends' entries"""
+        try:
+            try:
+                with open(self.model_path) as f:
+                    models = json.load(f)
+            except (OSError, ValueError):
+                models = {}
+            
+            with self.lock:
+                models[self.backend] = {
+                    'speech_ratio': self.speech_ratio,
+                    'synthesis_ratio': self.synthesis_ratio,
+                    'speech_samples': self.speech_samples,
+                    'synthesis_samples': self.synthesis_samples
+                }
+            
+            temp_path = self.model_path + ".tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(models, f, indent=2)
+            os.replace(temp_path, self.model_path)
+            
+            return True, "Duration model saved"
+            
+        except Exception as e:
+            return False, f"Error saving duration model: {str(e)}"
+    
+    def nominal_seconds(self, text, rate):
+        """Speaking time of text at rate words per minute, before calibration
+        
+        Words and characters are averaged so that long words and dense
+        text (numbers, abbreviations) are not underestimated.
+        """
+        words = (count_words(text) + len(text) / CHARS_PER_WORD) / 2
+        return words * 60 / max(rate, 1)
+    
+    def estimate_audio_seconds(self, text, rate):
+        """Expected duration of the spoken text"""
+        return self.nominal_seconds(text, rate) * self.speech_ratio
+    
+    def estimate_synthesis_seconds(self, text, rate):
+        """Expected time to render the text to a file"""
+        return CHUNK_OVERHEAD + self.estimate_audio_seconds(text, rate) * self.synthesis_ratio
+    
+    def record(self, text, rate, audio_seconds=None, synthesis_seconds=None):
+        """Calibrate the model with a measured audio duration and/or synthesis time"""
+        nominal = self.nominal_seconds(text, rate)
+        if nominal < MIN_CALIBRATION_SECONDS:
+            return
+        
+        with self.lock:
+            # Plain average for the first few samples, moving average after
+            if audio_seconds is not None:
+                self.speech_samples += 1
+                weight = max(CALIBRATION_WEIGHT, 1 / self.speech_samples)
+                self.speech_ratio += weight * (audio_seconds / nominal - self.speech_ratio)
+            
+            if synthesis_seconds is not None and audio_seconds:
+                self.synthesis_samples += 1
+                weight = max(CALIBRATION_WEIGHT, 1 / self.synthesis_samples)
+                ratio = max(0.0, synthesis_seconds - CHUNK_OVERHEAD) / audio_seconds
+                self.synthesis_ratio += weight * (ratio - self.synthesis_ratio)
+
+
+def split_text(text, parts):
+    """Split text at sentence boundaries into about `parts` pieces of similar length"""
+    starts = [start for start, _ in split_sentences(text)]
+    if parts <= 1 or len(starts) <= 1:
+        return [text]
+    
+    target = len(text) / parts
+    cuts = [0]
+    for start in starts[1:]:
+        if start - cuts[-1] >= target and len(cuts) < parts:
+            cuts.append(start)
+    cuts.append(len(text))
+    
+    return [text[cuts[i]:cuts[i + 1]] for i in range(len(cuts) - 1)]
+
+
+def plan_work(chunks, workers, estimate):
+    """Order chunks for parallel rendering, longest first
+    
+    chunks is a list of (key, text) and estimate a callable returning the
+    expected seconds for a text. Chunks expected to take much longer than
+    a fair share of the total are split at sentence boundaries first, so
+    that no single chunk keeps one worker busy after the others finish.
+    Returns (key, part, text, seconds) items; parts of a chunk are numbered
+    in reading order.
+    """
+    estimates = [(key, text, estimate(text)) for key, text in chunks]
+    total = sum(seconds for _, _, seconds in estimates)
+    limit = total / (max(workers, 1) * SPLIT_SHARE)
+    
+    items = []
+    for key, text, seconds in estimates:
+        parts = [text]
+        if limit > 0 and seconds > limit:
+            parts = split_text(text, math.ceil(seconds / limit))
+        
+        for part, part_text in enumerate(parts):
+            part_seconds = seconds if len(parts) == 1 else estimate(part_text)
+            items.append((key, part, part_text, part_seconds))
+    
+    items.sort(key=lambda item: item[3], reverse=True)
+    return items
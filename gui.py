@@ -3,14 +3,70 @@ GUI Module
 Handles the graphical user interface using Tkinter
 """
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+from tkinter import ttk, filedialog, messagebox, simpledialog
 import threading
+import bisect
 import os
+import time
+from pdf_reader import PDFReader, PAGE_IMAGE, PAGE_BLANK
+from text_preview import VirtualTextPreview
+from search_index import load_or_build_index
+from library import preprocess_document
+from cache_utils import compute_file_hash
+from bookmarks import PositionTracker, sentence_start
+from duration_estimator import DurationEstimator, format_duration
+from renderer import export_parallel
+from autoscale import Autoscaler
+from audio_converter import EVENT_CHUNK_STARTED, EVENT_WORD
+
+def describe_skipped_pages(skipped_pages):
+    """Summarize (page_number, page_type) pairs of skipped pages"""
+    images = [page + 1 for page, page_type in skipped_pages if page_type == PAGE_IMAGE]
+    blanks = [page + 1 for page, page_type in skipped_pages if page_type == PAGE_BLANK]
+    
+    parts = []
+    if images:
+        parts.append(f"{len(images)} image-only")
+    if blanks:
+        parts.append(f"{len(blanks)} blank")
+    
+    pages = ", ".join(str(page) for page in sorted(images + blanks)[:10])
+    if len(skipped_pages) > 10:
+        pages += ", ..."
+    
+    return f"skipped {' and '.join(parts)} page(s): {pages}"
+
+
+def build_reading_text(reader, first_page, first_offset=0):
+    """Collect the text read from a page and offset to the end of the book
+    
+    May extract every page, so the GUI calls it off the Tk thread.
+    Image-only and blank pages are skipped. Returns (success, message or
+    (text, page_starts, text_pages, skipped_pages)), where page_starts
+    holds the offset in text at which each of text_pages starts.
+    """
+    text_pages, skipped_pages = reader.get_text_pages(first_page)
+    if first_page not in text_pages:
+        first_offset = 0
+    if not text_pages:
+        return False, "No pages with text to read"
+    
+    # The store's page offsets map spoken offsets back to pages;
+    # the first page starts first_offset characters in
+    success, store = reader.get_text_store(text_pages)
+    if not success:
+        return False, store
+    
+    text = store.get_text(first_offset)
+    page_starts = [store.page_start(i) - first_offset for i in range(len(store))]
+    return True, (text, page_starts, text_pages, skipped_pages)
+
 
 class AudiobookGUI:
-    def __init__(self, pdf_reader, audio_converter):
+    def __init__(self, pdf_reader, audio_converter, library=None):
         self.pdf_reader = pdf_reader
         self.audio_converter = audio_converter
+        self.library = library
         
         # Main window
         self.root = tk.Tk()
@@ -24,6 +80,33 @@ class AudiobookGUI:
         self.total_pages = tk.IntVar()
         self.speaking_status = tk.StringVar(value="Ready")
         
+        # Background PDF loading state
+        self.loading = False
+        self.load_id = 0
+        self.load_cancel_event = None
+        # File name, spinbox state and whether buttons were enabled before loading
+        self.pre_load_state = ("", "normal", False)
+        
+        # Search state
+        self.file_path = None
+        self.file_hash = None
+        self.search_index = None
+        self.index_cancel_event = None
+        self.search_query = tk.StringVar()
+        self.search_hits = []
+        self.search_hit_index = 0
+        self.last_search = None
+        
+        # Reading position state
+        self.position_tracker = None
+        self.resume_position = None
+        self.reading_job = None
+        # Set to cancel collecting the text of a reading that has not started yet
+        self.reading_cancel_event = None
+        
+        # Spoken duration and export time estimates, calibrated as we go
+        self.duration_estimator = DurationEstimator(audio_converter.backend)
+        
         # Create GUI components
         self.create_widgets()
         
@@ -75,6 +158,16 @@ class AudiobookGUI:
         )
         self.browse_button.pack(side="right")
         
+        # Cancel loading button
+        self.cancel_load_button = ttk.Button(
+            file_frame,
+            text="Cancel",
+            command=self.cancel_loading,
+            width=10,
+            state="disabled"
+        )
+        self.cancel_load_button.pack(side="right", padx=(0, 5))
+        
         # Page selection frame
         page_frame = ttk.LabelFrame(self.root, text="Page Selection", padding=10)
         page_frame.pack(fill="x", padx=20, pady=10)
@@ -101,6 +194,24 @@ class AudiobookGUI:
         )
         self.total_pages_label.pack(side="left", padx=5)
         
+        # Search box
+        self.search_button = ttk.Button(
+            page_frame,
+            text="Search",
+            command=self.search_text,
+            width=10,
+            state="disabled"
+        )
+        self.search_button.pack(side="right")
+        
+        self.search_entry = ttk.Entry(
+            page_frame,
+            textvariable=self.search_query,
+            width=20
+        )
+        self.search_entry.pack(side="right", padx=5)
+        self.search_entry.bind("<Return>", lambda event: self.search_text())
+        
         # Control buttons frame
         control_frame = ttk.LabelFrame(self.root, text="Controls", padding=10)
         control_frame.pack(fill="x", padx=20, pady=10)
@@ -145,6 +256,14 @@ class AudiobookGUI:
         )
         self.save_audio_button.pack(side="left", padx=5)
         
+        self.resume_button = ttk.Button(
+            button_frame2,
+            text="Resume Reading",
+            command=self.resume_reading,
+            width=18
+        )
+        self.resume_button.pack(side="left", padx=5)
+        
         self.settings_button = ttk.Button(
             button_frame2,
             text="Voice Settings",
@@ -169,24 +288,9 @@ class AudiobookGUI:
         preview_frame = ttk.LabelFrame(self.root, text="Text Preview", padding=10)
         preview_frame.pack(fill="both", expand=True, padx=20, pady=10)
         
-        # Text widget with scrollbar
-        text_frame = tk.Frame(preview_frame)
-        text_frame.pack(fill="both", expand=True)
-        
-        self.text_widget = tk.Text(
-            text_frame,
-            wrap="word",
-            width=60,
-            height=10,
-            font=("Arial", 10),
-            state="disabled"
-        )
-        
-        scrollbar = ttk.Scrollbar(text_frame, orient="vertical", command=self.text_widget.yview)
-        self.text_widget.configure(yscrollcommand=scrollbar.set)
-        
-        self.text_widget.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
+        # Virtualized preview over the whole book
+        self.preview = VirtualTextPreview(preview_frame)
+        self.preview.pack(fill="both", expand=True)
         
         # Initially disable buttons
         self.toggle_buttons(False)
@@ -197,7 +301,8 @@ class AudiobookGUI:
         self.read_current_button.config(state=state)
         self.read_all_button.config(state=state)
         self.save_audio_button.config(state=state)
-        if not self.audio_converter.is_busy():
+        self.resume_button.config(state=state if self.resume_position else "disabled")
+        if not self.is_reading():
             self.stop_button.config(state="disabled")
     
     def browse_file(self):
@@ -210,46 +315,219 @@ class AudiobookGUI:
         if file_path:
             self.load_pdf(file_path)
     
-    def load_pdf(self, file_path):
-        """Load PDF file and update GUI"""
+    def load_pdf(self, file_path, password=None):
+        """Load PDF file in a background thread and update GUI progressively
+        
+        The PDF is opened in a reader of its own and replaces the open book
+        only once its first page is ready, so a failed or cancelled load
+        leaves the previous book as it was.
+        """
+        # Cancel any load still in progress
+        if self.load_cancel_event is not None:
+            self.load_cancel_event.set()
+        else:
+            self.pre_load_state = (
+                self.selected_file_path.get(),
+                self.page_spinbox.cget("state"),
+                self.read_current_button.cget("state") == "normal"
+            )
+        
         self.speaking_status.set("Loading PDF...")
+        self.selected_file_path.set(os.path.basename(file_path))
+        self.flush_position()
         
-        # Close previous PDF if any
-        self.pdf_reader.close_pdf()
+        self.load_id += 1
+        self.loading = True
+        self.load_cancel_event = threading.Event()
         
-        success, message = self.pdf_reader.open_pdf(file_path)
+        self.toggle_buttons(False)
+        self.page_spinbox.config(state="disabled")
+        self.cancel_load_button.config(state="normal")
+        
+        threading.Thread(
+            target=self._load_pdf_async,
+            args=(file_path, self.load_id, self.load_cancel_event, password),
+            daemon=True
+        ).start()
+    
+    def _load_pdf_async(self, file_path, load_id, cancel_event, password=None):
+        """Open PDF and extract the first page in a worker thread"""
+        reader = PDFReader(self.pdf_reader.engine)
         
-        if success:
-            self.selected_file_path.set(os.path.basename(file_path))
-            self.total_pages.set(self.pdf_reader.total_pages)
+        try:
+            # An unchanged known file is recognized by path, size and time
+            # without hashing it, and with a text cache its page tree is
+            # only read if a page ever has to be extracted
+            document = self.library.find_document(file_path) if self.library is not None else None
+            page_count = None
+            if document is not None and document['text_cache_path'] and document['page_types']:
+                page_count = document['page_count']
+            
+            success, message = reader.open_pdf(file_path, cancel_event, password, page_count=page_count)
             
-            # Update page spinbox
-            self.page_spinbox.config(to=self.pdf_reader.total_pages)
-            self.current_page.set(1)
+            if cancel_event.is_set():
+                reader.close_pdf()
+                return
             
-            # Load first page text
-            self.load_page_text(0)
+            if not success:
+                self.root.after(
+                    0, self._on_pdf_opened, load_id, success, message, file_path, reader.needs_password
+                )
+                return
             
-            # Enable buttons
-            self.toggle_buttons(True)
+            # Known books resume where they left off and skip extraction
+            start_page = 0
+            start_offset = 0
+            if document is not None:
+                file_hash = document['file_hash']
+            else:
+                file_hash = compute_file_hash(file_path)
+                if self.library is not None:
+                    document = self.library.get_document(file_hash)
+                    if document is not None:
+                        # The book was moved or touched since it was recorded
+                        self.library.update_file_location(file_hash, file_path)
             
-            self.speaking_status.set("PDF loaded successfully")
+            if document is not None:
+                start_page = min(document['last_page'], reader.total_pages - 1)
+                start_offset = document['last_offset']
+                
+                # Encrypted books and metadata-only imports may have no text cache
+                page_texts = self.library.load_cached_texts(file_hash, reader.decryption_key)
+                if page_texts is not None:
+                    reader.set_text_cache(page_texts)
+                    reader.set_page_types(document['page_types'])
+                    message += " - restored from library"
+            
+            self.root.after(0, self._on_pdf_opened, load_id, success, message, file_path)
+            
+            # Extract first page so it can be shown as soon as it is ready
+            success, text = reader.get_page_text(start_page)
+            
+            if cancel_event.is_set():
+                reader.close_pdf()
+                return
+            
+            self.root.after(
+                0, self._on_first_page_loaded, load_id, reader, file_path, file_hash,
+                (start_page, start_offset), success, text
+            )
+            
+        except Exception as e:
+            reader.close_pdf()
+            if not cancel_event.is_set():
+                self.root.after(0, self._on_pdf_opened, load_id, False, str(e), file_path)
+    
+    def _on_pdf_opened(self, load_id, success, message, file_path, needs_password=False):
+        """Show page count as soon as the PDF has been parsed"""
+        if load_id != self.load_id:
+            return
+        
+        if success:
+            self.speaking_status.set(f"{message} - loading first page...")
+            
+        elif needs_password:
+            self._restore_pre_load_state()
+            password = simpledialog.askstring(
+                "Password", f"{message}.\nPassword for {os.path.basename(file_path)}:",
+                show="*", parent=self.root
+            )
+            if password:
+                self.load_pdf(file_path, password)
+            else:
+                self.speaking_status.set("PDF not opened")
             
         else:
+            self._restore_pre_load_state()
             messagebox.showerror("Error", message)
             self.speaking_status.set("Failed to load PDF")
     
+    def _on_first_page_loaded(self, load_id, reader, file_path, file_hash, position, success, text):
+        """Replace the open book with the loaded one, display its first page and enable controls"""
+        if load_id != self.load_id:
+            # Cancelled or superseded while this callback was queued
+            reader.close_pdf()
+            return
+        
+        if not success:
+            reader.close_pdf()
+            self._restore_pre_load_state()
+            messagebox.showerror("Error", text)
+            self.speaking_status.set("Failed to load first page")
+            return
+        
+        # Reading and searching the previous book end here
+        if self.is_reading():
+            self.stop_reading()
+        self.cancel_indexing()
+        self.flush_position()
+        self.pdf_reader.take_over(reader)
+        
+        start_page, start_offset = position
+        self.file_path = file_path
+        self.file_hash = file_hash
+        
+        # Resume is offered for any position past the very start
+        self.resume_position = position if start_page or start_offset else None
+        if self.library is not None:
+            self.position_tracker = PositionTracker(self.library, file_hash)
+            self.library.mark_opened(file_hash)
+        
+        self.total_pages.set(self.pdf_reader.total_pages)
+        
+        # Update page spinbox; page changes are ignored until loading finishes
+        self.page_spinbox.config(to=self.pdf_reader.total_pages, state="readonly")
+        self.current_page.set(start_page + 1)
+        
+        self.preview.set_document(self.pdf_reader.get_page_text, self.pdf_reader.total_pages)
+        self._finish_loading()
+        
+        self.preview.set_page_text(start_page, text)
+        self.preview.show_page(start_page)
+        
+        # Enable buttons
+        self.toggle_buttons(True)
+        
+        self.speaking_status.set(
+            f"PDF loaded successfully (parsed in {self.pdf_reader.parse_time:.2f}s)"
+        )
+        
+        self.start_indexing(load_id)
+    
+    def _finish_loading(self):
+        """Reset background loading state"""
+        self.loading = False
+        self.load_cancel_event = None
+        self.cancel_load_button.config(state="disabled")
+    
+    def _restore_pre_load_state(self):
+        """Put the file name, page spinbox and buttons back as they were before loading"""
+        self._finish_loading()
+        
+        selected_file, spinbox_state, buttons_enabled = self.pre_load_state
+        self.selected_file_path.set(selected_file)
+        self.page_spinbox.config(state=spinbox_state)
+        self.toggle_buttons(buttons_enabled)
+    
+    def cancel_loading(self):
+        """Cancel the PDF load in progress, keeping the book that was open before"""
+        if not self.loading:
+            return
+        
+        self.load_cancel_event.set()
+        
+        # Results still on their way from the worker are ignored, and the
+        # reader they carry is closed
+        self.load_id += 1
+        self._restore_pre_load_state()
+        self.speaking_status.set("PDF loading cancelled")
+    
     def load_page_text(self, page_number):
         """Load and display text from specific page"""
-        success, text = self.pdf_reader.get_page_text(page_number)
+        success, text = self.preview.get_page_text(page_number)
         
         if success:
-            # Update text widget
-            self.text_widget.config(state="normal")
-            self.text_widget.delete(1.0, tk.END)
-            self.text_widget.insert(1.0, text)
-            self.text_widget.config(state="disabled")
-            
+            self.preview.show_page(page_number)
             return text
         else:
             messagebox.showerror("Error", text)
@@ -257,16 +535,22 @@ class AudiobookGUI:
     
     def on_page_change(self, *args):
         """Handle page number change"""
+        if self.loading:
+            return
+        
         try:
             page_num = self.current_page.get() - 1  # Convert to 0-based index
             if 0 <= page_num < self.pdf_reader.total_pages:
                 self.load_page_text(page_num)
+                
+                if self.position_tracker is not None:
+                    self.position_tracker.update(page_num, 0)
         except:
             pass
     
     def read_current_page(self):
         """Read current page aloud"""
-        if self.audio_converter.is_busy():
+        if self.is_reading():
             messagebox.showwarning("Warning", "Already reading. Please stop current reading first.")
             return
         
@@ -274,50 +558,157 @@ class AudiobookGUI:
         text = self.load_page_text(page_num)
         
         if text:
-            self.speaking_status.set("Reading current page...")
+            self.speaking_status.set(f"Reading current page... ({self.describe_duration(text)})")
             self.stop_button.config(state="normal")
-            
-            # Start reading in separate thread
-            threading.Thread(
-                target=self._read_text_async,
-                args=(text, "current page"),
-                daemon=True
-            ).start()
+            self._start_reading(text, "current page", [0], [page_num])
     
     def read_all_pages(self):
         """Read all pages aloud"""
-        if self.audio_converter.is_busy():
-            messagebox.showwarning("Warning", "Already reading. Please stop current reading first.")
-            return
+        self.read_from_position(0, 0, "all pages")
+    
+    def resume_reading(self):
+        """Continue reading from the saved position to the end of the book"""
+        position = self.resume_position
+        if self.position_tracker is not None:
+            position = self.position_tracker.get_position() or position
         
-        success, text = self.pdf_reader.get_all_text()
+        if position is None:
+            return
         
-        if success:
-            self.speaking_status.set("Reading all pages...")
-            self.stop_button.config(state="normal")
-            
-            # Start reading in separate thread
-            threading.Thread(
-                target=self._read_text_async,
-                args=(text, "all pages"),
-                daemon=True
-            ).start()
-        else:
+        page_num, offset = position
+        success, text = self.preview.get_page_text(page_num)
+        if not success:
             messagebox.showerror("Error", text)
+            return
+        
+        # Restart at the beginning of the interrupted sentence
+        offset = sentence_start(text, offset)
+        self.current_page.set(page_num + 1)
+        self.read_from_position(page_num, offset, f"from page {page_num + 1}")
+    
+    def is_reading(self):
+        """Whether a reading is being spoken or its text is being collected"""
+        return self.audio_converter.is_busy() or self.reading_cancel_event is not None
     
-    def _read_text_async(self, text, description):
-        """Read text asynchronously"""
+    def read_from_position(self, first_page, first_offset, description):
+        """Read from a page and character offset to the end of the book"""
+        if self.is_reading():
+            messagebox.showwarning("Warning", "Already reading. Please stop current reading first.")
+            return
+        
+        # Pages are extracted in the background through a shared reader
+        self.reading_cancel_event = threading.Event()
+        self.speaking_status.set(f"Preparing to read {description}...")
+        self.stop_button.config(state="normal")
+        
+        threading.Thread(
+            target=self._prepare_reading_async,
+            args=(self.pdf_reader.share(), first_page, first_offset, description,
+                  self.load_id, self.reading_cancel_event),
+            daemon=True
+        ).start()
+    
+    def _prepare_reading_async(self, reader, first_page, first_offset, description, load_id, cancel_event):
+        """Collect the text to read in a worker thread"""
         try:
-            success, message = self.audio_converter.speak_text(text, blocking=True)
+            success, result = build_reading_text(reader, first_page, first_offset)
+        except Exception as e:
+            success, result = False, f"Error collecting text: {str(e)}"
+        finally:
+            reader.close_pdf()
+        
+        if not cancel_event.is_set():
+            self.root.after(0, self._on_reading_text_ready, load_id, cancel_event, description,
+                            success, result)
+    
+    def _on_reading_text_ready(self, load_id, cancel_event, description, success, result):
+        """Start speaking the collected text unless reading was stopped meanwhile"""
+        if cancel_event is not self.reading_cancel_event:
+            return
+        self.reading_cancel_event = None
+        
+        if load_id != self.load_id:
+            return
+        
+        if not success:
+            self.stop_button.config(state="disabled")
+            self.speaking_status.set("Ready")
+            messagebox.showerror("Error", result)
+            return
+        
+        # Image-only and blank pages are skipped entirely
+        text, page_starts, text_pages, skipped_pages = result
+        if skipped_pages:
+            description += f", {describe_skipped_pages(skipped_pages)}"
+        
+        self.speaking_status.set(f"Reading {description}... ({self.describe_duration(text)})")
+        self._start_reading(text, description, page_starts, text_pages)
+    
+    def describe_duration(self, text):
+        """Estimated speaking time of text at the current rate"""
+        seconds = self.duration_estimator.estimate_audio_seconds(text, self.audio_converter.get_voice_rate())
+        return f"about {format_duration(seconds)}"
+    
+    def _start_reading(self, text, description, page_starts, page_numbers):
+        """Speak text in the background, following progress through job events"""
+        rate = self.audio_converter.get_voice_rate()
+        started_at = time.monotonic()
+        last_sentence = [0, started_at]
+        
+        def to_page_position(offset):
+            # Map an offset in the spoken text back to a page and page offset
+            index = bisect.bisect_right(page_starts, offset) - 1
+            return page_numbers[index], offset - page_starts[index]
+        
+        def on_sentence(index, start, end):
+            last_sentence[:] = [start, time.monotonic()]
+            page_num, page_offset = to_page_position(start)
+            self.root.after(
+                0, self.preview.highlight,
+                page_num, page_offset, page_offset + end - start
+            )
+            
+            remaining = self.duration_estimator.estimate_audio_seconds(text[start:], rate)
+            self.root.after(
+                0, self.speaking_status.set,
+                f"Reading {description}... ({format_duration(remaining)} left)"
+            )
+            on_word(start)
+        
+        def on_word(offset):
+            if self.position_tracker is not None:
+                self.position_tracker.update(*to_page_position(offset))
+        
+        def on_done(job):
+            success, message = job.result()
             
-            # Update status on main thread
-            self.root.after(0, self._update_status_after_reading, success, message, description)
+            # Calibrate with the text spoken up to the last sentence start
+            spoken_until, spoken_at = last_sentence
+            if (success or job.stop_requested) and spoken_until > 0:
+                self.duration_estimator.record(text[:spoken_until], rate, spoken_at - started_at)
+                self.duration_estimator.save()
             
-        except Exception as e:
-            self.root.after(0, self._update_status_after_reading, False, str(e), description)
+            # Update status on main thread; stop_reading already did after a stop
+            if job.stop_requested:
+                self.root.after(0, self._clear_stopped_reading, job)
+            else:
+                self.root.after(0, self._update_status_after_reading, success, message, description)
+        
+        job = self.audio_converter.speak(text, {EVENT_CHUNK_STARTED: on_sentence, EVENT_WORD: on_word})
+        self.reading_job = job
+        job.add_done_callback(on_done)
+    
+    def _clear_stopped_reading(self, job):
+        """Clear the highlight of a stopped reading unless another one has started since"""
+        if self.reading_job is job:
+            self.reading_job = None
+            self.preview.clear_highlight()
     
     def _update_status_after_reading(self, success, message, description):
         """Update status after reading completion"""
+        self.reading_job = None
+        self.preview.clear_highlight()
+        
         if success:
             self.speaking_status.set(f"Finished reading {description}")
         else:
@@ -325,8 +716,26 @@ class AudiobookGUI:
         
         self.stop_button.config(state="disabled")
     
+    def flush_position(self):
+        """Write the latest reading position to the library immediately"""
+        if self.position_tracker is not None:
+            position = self.position_tracker.get_position()
+            self.position_tracker.flush()
+            if position is not None:
+                self.resume_position = position
+    
     def stop_reading(self):
         """Stop current reading"""
+        self.flush_position()
+        self.resume_button.config(state="normal" if self.resume_position else "disabled")
+        
+        if self.reading_cancel_event is not None:
+            # The text was still being collected; nothing is spoken
+            self.reading_cancel_event.set()
+            self.reading_cancel_event = None
+            self.speaking_status.set("Reading stopped")
+            self.stop_button.config(state="disabled")
+        
         if self.audio_converter.stop_speech():
             self.speaking_status.set("Reading stopped")
             self.stop_button.config(state="disabled")
@@ -347,12 +756,18 @@ class AudiobookGUI:
             return
         
         # Get text to save
+        skipped_pages = []
         if choice:  # Yes - current page
             page_num = self.current_page.get() - 1
             success, text = self.pdf_reader.get_page_text(page_num)
             default_name = f"page_{self.current_page.get()}"
-        else:  # No - all pages
-            success, text = self.pdf_reader.get_all_text()
+        else:  # No - all pages, leaving out image-only and blank pages
+            text_pages, skipped_pages = self.pdf_reader.get_text_pages()
+            success, text = self.pdf_reader.get_text_store(text_pages)
+            
+            # Pages are rendered in parallel and joined in order
+            if success:
+                text = [(page_num, text[i]) for i, page_num in enumerate(text_pages)]
             default_name = "audiobook"
         
         if not success:
@@ -370,16 +785,54 @@ class AudiobookGUI:
         if filename:
             self.speaking_status.set("Saving audio file...")
             
-            # Save in separate thread
+            if isinstance(text, str):
+                # A single page is saved by the engine in the background
+                job = self.audio_converter.save(text, filename)
+                job.add_done_callback(
+                    lambda job: self.root.after(0, self._update_status_after_saving, *job.result())
+                )
+                return
+            
+            # Whole books are exported in a separate thread
             threading.Thread(
                 target=self._save_audio_async,
-                args=(text, filename),
+                args=(text, filename, self.file_hash if not choice else None, skipped_pages),
                 daemon=True
             ).start()
     
-    def _save_audio_async(self, text, filename):
-        """Save audio file asynchronously"""
-        success, message = self.audio_converter.save_to_audio_file(text, filename)
+    def _save_audio_async(self, text, filename, file_hash=None, skipped_pages=()):
+        """Save audio file asynchronously
+        
+        text is a list of (page, text) chunks, which are rendered on
+        worker processes the autoscaler adds as long as they pay off and
+        memory allows. Re-exporting a revised book to the same
+        file only re-renders the pages that changed.
+        """
+        def on_progress(remaining):
+            self.root.after(
+                0, self.speaking_status.set,
+                f"Saving audio file... (about {format_duration(remaining)} left)"
+            )
+        
+        engine = self.audio_converter.engine
+        success, message = export_parallel(
+            text, filename,
+            backend=self.audio_converter.backend,
+            rate=self.audio_converter.get_voice_rate(),
+            voice_id=engine.getProperty('voice') if engine is not None else None,
+            estimator=self.duration_estimator,
+            progress_callback=on_progress,
+            incremental=True,
+            sync_map=True,
+            autoscaler=Autoscaler()
+        )
+        
+        if success and skipped_pages:
+            message += f" ({describe_skipped_pages(skipped_pages)})"
+        
+        # Whole-book exports are recorded in the library
+        if self.library is not None and file_hash is not None:
+            self.library.set_export_status(file_hash, "exported" if success else "failed")
         
         # Update status on main thread
         self.root.after(0, self._update_status_after_saving, success, message)
@@ -393,6 +846,137 @@ class AudiobookGUI:
             self.speaking_status.set("Failed to save audio")
             messagebox.showerror("Error", message)
     
+    def start_indexing(self, load_id):
+        """Build or load the search index for the open PDF in the background"""
+        self.index_cancel_event = threading.Event()
+        
+        # The worker reads the already parsed document through its own reader
+        reader = self.pdf_reader.share()
+        
+        threading.Thread(
+            target=self._build_index_async,
+            args=(self.file_path, self.file_hash, reader, load_id, self.index_cancel_event),
+            daemon=True
+        ).start()
+    
+    def cancel_indexing(self):
+        """Stop any index build and forget the current index"""
+        if self.index_cancel_event is not None:
+            self.index_cancel_event.set()
+            self.index_cancel_event = None
+        
+        self.search_index = None
+        self.search_hits = []
+        self.last_search = None
+        self.search_button.config(state="disabled")
+    
+    def _build_index_async(self, file_path, file_hash, reader, load_id, cancel_event):
+        """Add the PDF to the library and build its search index in a worker thread"""
+        # A store restored when the PDF was opened is shared with this reader
+        page_texts = reader.page_text_cache
+        # A store loaded here is handed to the GUI's reader or closed
+        loaded_texts = None
+        
+        try:
+            # Cheap pass so image-only and blank pages are never extracted,
+            # done once the first page is shown
+            success, page_types = reader.classify_pages()
+            if not success:
+                page_types = None
+            
+            if self.library is not None and page_texts is None:
+                page_texts = loaded_texts = self.library.load_cached_texts(file_hash, reader.decryption_key)
+                
+                if page_texts is None:
+                    success, record = preprocess_document(
+                        file_path, file_hash, reader,
+                        cache_decrypted_text=self.library.cache_decrypted_text
+                    )
+                    if success:
+                        self.library.add_document(record)
+                        page_texts = loaded_texts = self.library.load_cached_texts(
+                            file_hash, reader.decryption_key
+                        )
+                    else:
+                        print(f"Could not add document to library: {record}")
+            
+            # Index the text the preview shows: the same document, engine,
+            # page types and text cache, read through the shared reader
+            if loaded_texts is not None:
+                reader.set_text_cache(loaded_texts, owned=False)
+            
+            success, message = load_or_build_index(
+                file_path, reader.get_page_text, reader.total_pages, cancel_event, file_hash=file_hash,
+                persist=reader.decryption_key is None
+            )
+            
+        finally:
+            reader.close_pdf()
+        
+        if not cancel_event.is_set():
+            self.root.after(0, self._on_index_ready, load_id, success, message, loaded_texts,
+                            page_types)
+        elif loaded_texts is not None:
+            loaded_texts.close()
+    
+    def _on_index_ready(self, load_id, success, index, page_texts, page_types):
+        """Enable searching once the index is available"""
+        # Later page reads come from the library's text cache
+        if page_texts is not None:
+            if load_id == self.load_id and self.pdf_reader.page_text_cache is None:
+                self.pdf_reader.set_text_cache(page_texts)
+            else:
+                page_texts.close()
+        
+        if load_id != self.load_id:
+            return
+        
+        if self.pdf_reader.page_types is None:
+            self.pdf_reader.set_page_types(page_types)
+        
+        # A position saved before a new book was added to the library is written now
+        if self.position_tracker is not None:
+            self.position_tracker.flush()
+        
+        if success:
+            self.search_index = index
+            self.search_button.config(state="normal")
+        else:
+            print(f"Search index unavailable: {index}")
+    
+    def search_text(self):
+        """Jump to the next hit of the search query and read from there"""
+        if self.search_index is None:
+            self.speaking_status.set("Search index is still being built...")
+            return
+        
+        query = self.search_query.get().strip()
+        if not query:
+            return
+        
+        # Repeating a search steps through its hits
+        if query == self.last_search and self.search_hits:
+            self.search_hit_index = (self.search_hit_index + 1) % len(self.search_hits)
+        else:
+            self.search_hits = self.search_index.search(query)
+            self.search_hit_index = 0
+            self.last_search = query
+        
+        if not self.search_hits:
+            self.speaking_status.set(f"No matches for '{query}'")
+            return
+        
+        if self.is_reading():
+            self.stop_reading()
+        
+        page_num, start, end = self.search_hits[self.search_hit_index]
+        description = (f"from match {self.search_hit_index + 1} of {len(self.search_hits)} "
+                       f"on page {page_num + 1}")
+        
+        self.current_page.set(page_num + 1)
+        self.preview.highlight(page_num, start, end)
+        self.read_from_position(page_num, start, description)
+    
     def open_settings(self):
         """Open voice settings dialog"""
         SettingsDialog(self.root, self.audio_converter)
@@ -402,11 +986,23 @@ class AudiobookGUI:
         # Bind page change event
         self.current_page.trace("w", self.on_page_change)
         
+        # Reopen the last book so reading can resume where it stopped
+        if self.library is not None:
+            documents = self.library.list_documents()
+            if documents and documents[0]['opened_at'] and os.path.exists(documents[0]['file_path']):
+                self.root.after(100, self.load_pdf, documents[0]['file_path'])
+        
         # Start main loop
         self.root.mainloop()
     
     def cleanup(self):
         """Cleanup resources"""
+        if self.load_cancel_event is not None:
+            self.load_cancel_event.set()
+        if self.index_cancel_event is not None:
+            self.index_cancel_event.set()
+        
+        self.flush_position()
         self.audio_converter.cleanup()
         self.pdf_reader.close_pdf()
 
@@ -564,4 +1160,4 @@ class SettingsDialog:
         self.apply_settings()
         
         test_text = "This is a test of the current voice settings."
-        self.audio_converter.speak_text(test_text, blocking=False)
+        self.audio_converter.speak(test_text)
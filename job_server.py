@@ -0,0 +1,536 @@
+"""
+Job Server Module
+HTTP service that accepts PDF conversion jobs and runs them on a pool of
+worker processes
+
+Endpoints:
+    POST   /jobs?voice=0&rate=150&format=wav&start_page=1&end_page=10
+                               application/pdf body; queues a conversion job
+    GET    /jobs               all jobs
+    GET    /jobs/<id>          job status, progress and metrics
+    GET    /jobs/<id>/result   the rendered audio
+    GET    /jobs/<id>/profile  profiling report of a job run with profile=cprofile|sample
+    DELETE /jobs/<id>          cancel a job that has not started
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from audio_converter import AudioConverter, TTS_BACKENDS
+from cache_utils import get_cache_dir
+from pdf_probe import probe_pdf
+from pdf_reader import PDFReader
+from pipeline import convert_pages
+from profiling import profile_run, PROFILE_MODES, REPORT_FILE
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8766
+
+# Admission control: jobs running or waiting beyond the workers, and upload size
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_QUEUE = 8
+MAX_UPLOAD_BYTES = 200 * 1024 * 1024
+
+# Seconds a client is asked to wait before retrying when the queue is full
+RETRY_AFTER = 30
+
+SUPPORTED_FORMATS = ("wav",)
+
+UPLOAD_BLOCK_SIZE = 64 * 1024
+
+JOB_PATH_PATTERN = re.compile(r"/jobs/([0-9a-f]+)$")
+RESULT_PATH_PATTERN = re.compile(r"/jobs/([0-9a-f]+)/result$")
+PROFILE_PATH_PATTERN = re.compile(r"/jobs/([0-9a-f]+)/profile$")
+
+# Job states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+PROGRESS_FILE = "progress.json"
+PROFILE_DIR = "profile"
+
+# The AudioConverter owned by each worker process
+_worker_converter = None
+
+
+def parse_job_options(query):
+    """Validate conversion options from a query string; returns (success, options or message)"""
+    params = {key: values[-1] for key, values in parse_qs(query).items()}
+    
+    try:
+        options = {
+            'voice': int(params.get('voice', 0)),
+            'rate': int(params.get('rate', 150)),
+            'format': params.get('format', "wav").lower(),
+            'start_page': int(params.get('start_page', 1)),
+            'end_page': int(params['end_page']) if params.get('end_page') else None,
+            # Unset means the server's AUDIOBOOK_PROFILE setting applies
+            'profile': params.get('profile')
+        }
+    except ValueError as e:
+        return False, f"Invalid option: {str(e)}"
+    
+    if options['format'] not in SUPPORTED_FORMATS:
+        return False, f"Unsupported format: {options['format']}"
+    if options['start_page'] < 1:
+        return False, "start_page must be at least 1"
+    if options['end_page'] is not None and options['end_page'] < options['start_page']:
+        return False, "end_page must not be before start_page"
+    if options['profile'] not in (None, "0", "1") + PROFILE_MODES:
+        return False, f"Unknown profiling mode: {options['profile']}"
+    
+    return True, options
+
+
+def _init_worker(backend):
+    """Create the worker process's TTS engine once"""
+    global _worker_converter
+    _worker_converter = AudioConverter(backend)
+
+
+def _write_progress(job_dir, **progress):
+    """Publish a job's progress for the server process to read"""
+    progress_path = os.path.join(job_dir, PROGRESS_FILE)
+    temp_path = progress_path + ".tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(progress, f)
+    os.replace(temp_path, progress_path)
+
+
+def _run_job(job_dir, pdf_path, options):
+    """Convert one PDF in a worker process; returns (success, result or message)"""
+    started_at = time.time()
+    _write_progress(job_dir, started_at=started_at, pages_done=0, pages_total=None)
+    
+    converter = _worker_converter
+    if converter is None or converter.engine is None:
+        return False, "TTS engine not initialized"
+    
+    converter.set_voice(options['voice'])
+    converter.set_voice_rate(options['rate'])
+    
+    reader = PDFReader()
+    try:
+        success, message = reader.open_pdf(pdf_path)
+        if not success:
+            return False, message
+        
+        end_page = options['end_page'] or reader.total_pages
+        if end_page > reader.total_pages:
+            return False, f"end_page exceeds page count ({reader.total_pages})"
+        
+        reader.classify_pages()
+        text_pages, skipped_pages = reader.get_text_pages(options['start_page'] - 1, end_page - 1)
+        
+        def on_progress(pages_done, pages_total):
+            _write_progress(job_dir, started_at=started_at, pages_done=pages_done,
+                            pages_total=pages_total)
+        
+        # Pages stream through bounded queues, so memory stays flat for any book length
+        result_path = os.path.join(job_dir, "result." + options['format'])
+        with profile_run(os.path.join(job_dir, PROFILE_DIR), options.get('profile')):
+            success, stats = convert_pages(reader.get_page_text, text_pages, result_path, converter,
+                                           progress_callback=on_progress)
+        if not success:
+            return False, stats
+        
+        channels, sample_width, frame_rate = stats['audio_params']
+        audio_seconds = stats['data_size'] / (channels * sample_width * frame_rate)
+        characters = stats['characters']
+        wall_seconds = time.time() - started_at
+        
+        return True, {
+            'result_path': result_path,
+            'metrics': {
+                'pages': len(text_pages),
+                'skipped_pages': len(skipped_pages),
+                'characters': characters,
+                'words': stats['words'],
+                'extract_seconds': round(stats['extract_seconds'], 3),
+                'synthesis_seconds': round(stats['synthesis_seconds'], 3),
+                'peak_buffered_bytes': stats['peak_bytes'],
+                'wall_seconds': round(wall_seconds, 3),
+                'audio_seconds': round(audio_seconds, 3),
+                'pages_per_second': round(len(text_pages) / wall_seconds, 3) if wall_seconds else None,
+                'characters_per_second': round(characters / wall_seconds, 1) if wall_seconds else None,
+                'realtime_factor': round(audio_seconds / wall_seconds, 2) if wall_seconds else None
+            }
+        }
+        
+    except Exception as e:
+        return False, f"Error converting {os.path.basename(pdf_path)}: {str(e)}"
+        
+    finally:
+        reader.close_pdf()
+
+
+class JobManager:
+    def __init__(self, max_workers=DEFAULT_WORKERS, max_queue=DEFAULT_MAX_QUEUE,
+                 backend=None, max_upload_bytes=MAX_UPLOAD_BYTES):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.max_upload_bytes = max_upload_bytes
+        self.backend = backend
+        self.executor = self._create_executor()
+        
+        self.jobs = {}
+        self.futures = {}
+        # Slots taken by jobs being uploaded, queued or running
+        self.active = 0
+        self.lock = threading.Lock()
+    
+    def _create_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers, initializer=_init_worker, initargs=(self.backend,)
+        )
+    
+    def _replace_broken_executor(self, executor):
+        """Start a new worker pool if executor is the current one; call with lock held
+        
+        A worker that dies (e.g. killed for running out of memory) breaks the
+        whole pool, failing its jobs and refusing new ones.
+        """
+        if self.executor is executor:
+            self.executor = self._create_executor()
+            executor.shutdown(wait=False)
+    
+    def admit(self):
+        """Reserve a slot for a new job; False when the queue is full"""
+        with self.lock:
+            if self.active >= self.max_workers + self.max_queue:
+                return False
+            self.active += 1
+            return True
+    
+    def release(self):
+        """Give back a slot reserved by admit()"""
+        with self.lock:
+            self.active -= 1
+    
+    def submit(self, upload_stream, length, options):
+        """Store an uploaded PDF and queue its conversion in an admitted slot
+        
+        Returns (success, job or message). The slot is released when the job
+        ends, or immediately if it cannot be queued.
+        """
+        job_id = uuid.uuid4().hex
+        job_dir = get_cache_dir("jobs", job_id)
+        
+        try:
+            pdf_path = os.path.join(job_dir, "input.pdf")
+            with open(pdf_path, 'wb') as f:
+                remaining = length
+                while remaining > 0:
+                    block = upload_stream.read(min(UPLOAD_BLOCK_SIZE, remaining))
+                    if not block:
+                        break
+                    f.write(block)
+                    remaining -= len(block)
+            
+            if remaining > 0:
+                raise ValueError("Upload ended early")
+            
+            # Reject uploads that are not PDFs before they take a worker
+            success, info = probe_pdf(pdf_path, compute_hash=False)
+            if not success:
+                raise ValueError(info)
+            
+            job = {
+                'id': job_id,
+                'status': JOB_QUEUED,
+                'options': options,
+                'page_count': info['page_count'],
+                'submitted_at': time.time(),
+                'finished_at': None,
+                'error': None,
+                'metrics': None,
+                'result_path': None,
+                'job_dir': job_dir
+            }
+            
+            with self.lock:
+                executor = self.executor
+                try:
+                    future = executor.submit(_run_job, job_dir, pdf_path, options)
+                except BrokenProcessPool:
+                    self._replace_broken_executor(executor)
+                    executor = self.executor
+                    future = executor.submit(_run_job, job_dir, pdf_path, options)
+                self.jobs[job_id] = job
+                self.futures[job_id] = future
+            
+            future.add_done_callback(lambda future: self._finish(job_id, future, executor))
+            return True, job
+            
+        except Exception as e:
+            self.release()
+            shutil.rmtree(job_dir, ignore_errors=True)
+            return False, f"Error submitting job: {str(e)}"
+    
+    def _finish(self, job_id, future, executor):
+        """Record the outcome of a job and free its slot"""
+        with self.lock:
+            job = self.jobs[job_id]
+            job['finished_at'] = time.time()
+            self.futures.pop(job_id, None)
+            
+            if future.cancelled():
+                job['status'] = JOB_CANCELLED
+            else:
+                try:
+                    success, result = future.result()
+                except BrokenProcessPool:
+                    success, result = False, "Worker process died; the job was not completed"
+                    self._replace_broken_executor(executor)
+                except Exception as e:
+                    success, result = False, f"Worker failed: {str(e)}"
+                
+                if success:
+                    job['status'] = JOB_DONE
+                    job['result_path'] = result['result_path']
+                    job['metrics'] = result['metrics']
+                else:
+                    job['status'] = JOB_FAILED
+                    job['error'] = result
+            
+            self.active -= 1
+    
+    def get_status(self, job_id):
+        """Public view of a job merged with its live progress, or None"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            status = {key: value for key, value in job.items()
+                      if key not in ('result_path', 'job_dir')}
+            job_dir = job['job_dir']
+        
+        try:
+            with open(os.path.join(job_dir, PROGRESS_FILE)) as f:
+                progress = json.load(f)
+        except (OSError, ValueError):
+            progress = None
+        
+        if progress is not None:
+            if status['status'] == JOB_QUEUED:
+                status['status'] = JOB_RUNNING
+            status['progress'] = {
+                'pages_done': progress['pages_done'],
+                'pages_total': progress['pages_total']
+            }
+            status['queued_seconds'] = round(progress['started_at'] - status['submitted_at'], 3)
+        
+        return status
+    
+    def list_jobs(self):
+        """Status of every job, oldest first"""
+        with self.lock:
+            job_ids = list(self.jobs)
+        return [self.get_status(job_id) for job_id in job_ids]
+    
+    def get_result_path(self, job_id):
+        """Path of a finished job's audio, or None"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job['result_path'] if job is not None else None
+    
+    def get_profile_path(self, job_id):
+        """Path of a finished job's profiling report, or None"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job['finished_at'] is None:
+                return None
+            report_path = os.path.join(job['job_dir'], PROFILE_DIR, REPORT_FILE)
+        
+        return report_path if os.path.exists(report_path) else None
+    
+    def cancel(self, job_id):
+        """Cancel a job that has not started; returns (success, message)"""
+        with self.lock:
+            future = self.futures.get(job_id)
+        
+        if future is None:
+            return False, "Job is not queued"
+        if not future.cancel():
+            return False, "Job is already running"
+        
+        return True, "Job cancelled"
+    
+    def shutdown(self):
+        """Cancel queued jobs and stop the worker processes"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    
+    @property
+    def manager(self):
+        return self.server.manager
+    
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+    
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            self.send_json(404, {'error': "Not found"})
+            return
+        
+        # Requests are rejected before their body is read
+        self.close_connection = True
+        
+        success, options = parse_job_options(url.query)
+        if not success:
+            self.send_json(400, {'error': options})
+            return
+        
+        length = int(self.headers.get("Content-Length", 0))
+        if not self.headers.get("Content-Type", "").startswith("application/pdf") or length <= 0:
+            self.send_json(400, {'error': "Expected an application/pdf body"})
+            return
+        if length > self.manager.max_upload_bytes:
+            self.send_json(413, {'error': "PDF is too large"})
+            return
+        
+        if not self.manager.admit():
+            self.send_json(503, {'error': "Job queue is full"}, {"Retry-After": str(RETRY_AFTER)})
+            return
+        
+        success, job = self.manager.submit(self.rfile, length, options)
+        if not success:
+            self.send_json(500, {'error': job})
+            return
+        
+        self.send_json(202, self.manager.get_status(job['id']),
+                       {"Location": f"/jobs/{job['id']}"})
+    
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        
+        if path.rstrip("/") == "/jobs":
+            self.send_json(200, self.manager.list_jobs())
+            return
+        
+        match = JOB_PATH_PATTERN.match(path)
+        if match:
+            status = self.manager.get_status(match.group(1))
+            if status is None:
+                self.send_json(404, {'error': "Unknown job"})
+            else:
+                self.send_json(200, status)
+            return
+        
+        match = RESULT_PATH_PATTERN.match(path)
+        if match:
+            self.send_result(match.group(1))
+            return
+        
+        match = PROFILE_PATH_PATTERN.match(path)
+        if match:
+            self.send_profile(match.group(1))
+            return
+        
+        self.send_json(404, {'error': "Not found"})
+    
+    def do_DELETE(self):
+        match = JOB_PATH_PATTERN.match(urlsplit(self.path).path)
+        if not match:
+            self.send_json(404, {'error': "Not found"})
+            return
+        
+        success, message = self.manager.cancel(match.group(1))
+        self.send_json(200 if success else 409, {'message': message})
+    
+    def send_result(self, job_id):
+        """Send a finished job's audio file"""
+        result_path = self.manager.get_result_path(job_id)
+        if result_path is None:
+            self.send_json(404, {'error': "No result for this job"})
+            return
+        
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/wav")
+            self.send_header("Content-Length", str(os.path.getsize(result_path)))
+            self.end_headers()
+            
+            with open(result_path, 'rb') as f:
+                shutil.copyfileobj(f, self.wfile)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+    
+    def send_profile(self, job_id):
+        """Send the profiling report of a job"""
+        report_path = self.manager.get_profile_path(job_id)
+        if report_path is None:
+            self.send_json(404, {'error': "No profile for this job"})
+            return
+        
+        with open(report_path, 'rb') as f:
+            report = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(report)))
+        self.end_headers()
+        self.wfile.write(report)
+
+
+class JobServer(ThreadingHTTPServer):
+    daemon_threads = True
+    
+    def __init__(self, address, manager, verbose=False):
+        super().__init__(address, JobRequestHandler)
+        self.manager = manager
+        self.verbose = verbose
+
+
+def main():
+    """Run the job server from the command line"""
+    parser = argparse.ArgumentParser(description="PDF to audiobook conversion service")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE)
+    parser.add_argument("--backend", choices=TTS_BACKENDS, default=None,
+                        help="TTS backend for the workers (default: pyttsx3)")
+    args = parser.parse_args()
+    
+    manager = JobManager(args.workers, args.max_queue, args.backend)
+    server = JobServer((args.host, args.port), manager, verbose=True)
+    print(f"Accepting conversion jobs on http://{args.host}:{args.port}/jobs")
+    
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        manager.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
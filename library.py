@@ -0,0 +1,451 @@
+"""
+Library Module
+Persistent metadata store for every document the application has processed
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from cache_utils import get_cache_dir, compute_file_hash
+from pdf_probe import probe_pdf
+from pdf_reader import PDFReader, PAGE_TYPE_CODES
+from text_store import BookTextStore, STORE_EXTENSION, ENCRYPTION_AVAILABLE, derive_store_key
+
+LIBRARY_DB_NAME = "library.db"
+
+# Set to "1" to keep the text of password-protected PDFs in the text cache,
+# encrypted under a key derived from the PDF's own key (needs cryptography)
+CACHE_DECRYPTED_TEXT_ENV = "AUDIOBOOK_CACHE_DECRYPTED_TEXT"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    file_hash TEXT PRIMARY KEY,
+    file_path TEXT NOT NULL,
+    title TEXT,
+    author TEXT,
+    page_count INTEGER NOT NULL,
+    text_cache_path TEXT,
+    outline TEXT,
+    last_page INTEGER NOT NULL DEFAULT 0,
+    last_offset INTEGER NOT NULL DEFAULT 0,
+    export_status TEXT NOT NULL DEFAULT 'none',
+    added_at REAL NOT NULL,
+    opened_at REAL
+)
+"""
+
+# Columns added after the first release, created on existing databases
+ADDED_COLUMNS = {
+    'page_types': "TEXT",
+    'file_size': "INTEGER",
+    'file_mtime_ns': "INTEGER"
+}
+
+
+def encode_page_types(page_types):
+    """Pack page labels into one character per page"""
+    if page_types is None:
+        return None
+    return "".join(PAGE_TYPE_CODES[page_type] for page_type in page_types)
+
+
+def decode_page_types(codes):
+    """Unpack page labels stored by encode_page_types"""
+    if codes is None:
+        return None
+    labels = {code: page_type for page_type, code in PAGE_TYPE_CODES.items()}
+    return [labels[code] for code in codes]
+
+
+def get_file_stat(file_path):
+    """Get (size, modification time in ns) of a file, to recognize it unchanged"""
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def get_text_cache_path(file_hash):
+    """Get the cache path of the extracted page texts for a document"""
+    return os.path.join(get_cache_dir("text"), file_hash + STORE_EXTENSION)
+
+
+def save_page_texts(cache_path, page_texts, key=None):
+    """Write extracted page texts to the text cache, encrypted if a key is given"""
+    success, message = BookTextStore.from_pages(page_texts).save(cache_path, key)
+    if not success:
+        raise OSError(message)
+
+
+def load_page_texts(cache_path, key=None):
+    """Memory-map extracted page texts from the text cache as a BookTextStore"""
+    return BookTextStore.load(cache_path, key)
+
+
+def preprocess_document(file_path, file_hash=None, reader=None, password=None,
+                        cache_decrypted_text=False):
+    """Extract everything the library records about a PDF
+    
+    Runs in worker processes during bulk import, so it opens its own reader
+    and returns a plain dict. An already open reader (e.g. one shared from
+    the GUI's document) can be passed instead; it is left open.
+    
+    The text of encrypted PDFs is only cached with cache_decrypted_text,
+    and then encrypted at rest; otherwise, or if the cryptography package
+    is missing, no text cache is written.
+    """
+    if file_hash is None:
+        file_hash = compute_file_hash(file_path)
+    
+    owns_reader = reader is None
+    if owns_reader:
+        reader = PDFReader()
+    
+    try:
+        if owns_reader:
+            success, message = reader.open_pdf(file_path, password=password)
+            if not success:
+                return False, message
+        
+        # Image-only and blank pages are recorded but never extracted
+        success, page_types = reader.classify_pages()
+        if not success:
+            page_types = None
+        
+        decryption_key = reader.decryption_key
+        text_cache_path = None
+        if decryption_key is None or (cache_decrypted_text and ENCRYPTION_AVAILABLE):
+            page_texts = []
+            for page_num in range(reader.total_pages):
+                success, text = reader.get_page_text(page_num)
+                if not success:
+                    return False, text
+                page_texts.append(text)
+            
+            text_cache_path = get_text_cache_path(file_hash)
+            store_key = derive_store_key(decryption_key) if decryption_key is not None else None
+            save_page_texts(text_cache_path, page_texts, store_key)
+        
+        metadata = reader.get_metadata() or {}
+        file_size, file_mtime_ns = get_file_stat(file_path)
+        
+        return True, {
+            'file_hash': file_hash,
+            'file_path': os.path.abspath(file_path),
+            'file_size': file_size,
+            'file_mtime_ns': file_mtime_ns,
+            'title': metadata.get('title') or os.path.splitext(os.path.basename(file_path))[0],
+            'author': metadata.get('author', ''),
+            'page_count': reader.total_pages,
+            'text_cache_path': text_cache_path,
+            'outline': reader.get_outline(),
+            'page_types': page_types
+        }
+        
+    except Exception as e:
+        return False, f"Error preprocessing {file_path}: {str(e)}"
+        
+    finally:
+        if owns_reader:
+            reader.close_pdf()
+
+
+def _import_worker(file_path, known_hashes):
+    """Bulk import task: hash a file and preprocess it if it is new"""
+    try:
+        file_hash = compute_file_hash(file_path)
+        if file_hash in known_hashes:
+            return True, None
+        
+        return preprocess_document(file_path, file_hash)
+        
+    except Exception as e:
+        return False, f"Error importing {file_path}: {str(e)}"
+
+
+def _probe_worker(file_path, known_hashes):
+    """Quick import task: hash a file and read only its metadata if it is new
+    
+    Page texts and the outline are left out; they are filled in by
+    preprocess_document the first time the document is opened.
+    """
+    try:
+        file_hash = compute_file_hash(file_path)
+        if file_hash in known_hashes:
+            return True, None
+        
+        success, info = probe_pdf(file_path, compute_hash=False)
+        if not success:
+            return False, info
+        if info['page_count'] is None:
+            return False, f"Cannot read {file_path}: the file is encrypted"
+        
+        file_size, file_mtime_ns = get_file_stat(file_path)
+        return True, {
+            'file_hash': file_hash,
+            'file_path': info['file_path'],
+            'file_size': file_size,
+            'file_mtime_ns': file_mtime_ns,
+            'title': info['title'] or os.path.splitext(os.path.basename(file_path))[0],
+            'author': info['author'] or '',
+            'page_count': info['page_count'],
+            'text_cache_path': None,
+            'outline': [],
+            'page_types': None
+        }
+        
+    except Exception as e:
+        return False, f"Error importing {file_path}: {str(e)}"
+
+
+class Library:
+    def __init__(self, db_path=None, cache_decrypted_text=None):
+        if db_path is None:
+            db_path = os.path.join(get_cache_dir(), LIBRARY_DB_NAME)
+        if cache_decrypted_text is None:
+            cache_decrypted_text = os.environ.get(CACHE_DECRYPTED_TEXT_ENV) == "1"
+        
+        self.db_path = db_path
+        # Whether preprocessing may cache (encrypted) text of encrypted PDFs
+        self.cache_decrypted_text = cache_decrypted_text
+        self.lock = threading.Lock()
+        
+        # Shared between the Tk thread and background workers, guarded by lock
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        
+        with self.lock, self.connection:
+            self.connection.execute(SCHEMA)
+            
+            columns = {row['name'] for row in self.connection.execute("PRAGMA table_info(documents)")}
+            for column, column_type in ADDED_COLUMNS.items():
+                if column not in columns:
+                    self.connection.execute(f"ALTER TABLE documents ADD COLUMN {column} {column_type}")
+    
+    def _row_to_document(self, row):
+        """Convert a database row to a document dict"""
+        if row is None:
+            return None
+        
+        document = dict(row)
+        document['outline'] = json.loads(document['outline'] or '[]')
+        document['page_types'] = decode_page_types(document.get('page_types'))
+        return document
+    
+    def get_document(self, file_hash):
+        """Get the record of a document by content hash"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT * FROM documents WHERE file_hash = ?", (file_hash,)
+            ).fetchone()
+        
+        return self._row_to_document(row)
+    
+    def find_document(self, file_path):
+        """Get the record of the document at file_path if the file is unchanged
+        
+        The path, size and modification time must match what was recorded,
+        so a known file is recognized without hashing its contents.
+        """
+        try:
+            file_size, file_mtime_ns = get_file_stat(file_path)
+        except OSError:
+            return None
+        
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT * FROM documents WHERE file_path = ? AND file_size = ? AND file_mtime_ns = ?",
+                (os.path.abspath(file_path), file_size, file_mtime_ns)
+            ).fetchone()
+        
+        return self._row_to_document(row)
+    
+    def update_file_location(self, file_hash, file_path):
+        """Record where a known document now is, e.g. after it was moved or touched"""
+        file_size, file_mtime_ns = get_file_stat(file_path)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE documents SET file_path = ?, file_size = ?, file_mtime_ns = ? WHERE file_hash = ?",
+                (os.path.abspath(file_path), file_size, file_mtime_ns, file_hash)
+            )
+    
+    def list_documents(self):
+        """Get all documents, most recently opened first"""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM documents ORDER BY COALESCE(opened_at, added_at) DESC"
+            ).fetchall()
+        
+        return [self._row_to_document(row) for row in rows]
+    
+    def get_known_hashes(self):
+        """Get the content hashes of all documents in the library"""
+        with self.lock:
+            rows = self.connection.execute("SELECT file_hash FROM documents").fetchall()
+        
+        return {row['file_hash'] for row in rows}
+    
+    def add_document(self, record):
+        """Insert or refresh a document record produced by preprocess_document"""
+        try:
+            with self.lock, self.connection:
+                self.connection.execute(
+                    """
+                    INSERT INTO documents
+                        (file_hash, file_path, file_size, file_mtime_ns, title, author,
+                         page_count, text_cache_path, outline, page_types, added_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(file_hash) DO UPDATE SET
+                        file_path = excluded.file_path,
+                        file_size = excluded.file_size,
+                        file_mtime_ns = excluded.file_mtime_ns,
+                        title = excluded.title,
+                        author = excluded.author,
+                        page_count = excluded.page_count,
+                        text_cache_path = excluded.text_cache_path,
+                        outline = excluded.outline,
+                        page_types = excluded.page_types
+                    """,
+                    (
+                        record['file_hash'], record['file_path'], record.get('file_size'),
+                        record.get('file_mtime_ns'), record['title'], record['author'],
+                        record['page_count'], record['text_cache_path'],
+                        json.dumps(record['outline']),
+                        encode_page_types(record.get('page_types')), time.time()
+                    )
+                )
+            
+            return True, f"Added {record['title']} to library"
+            
+        except Exception as e:
+            return False, f"Error adding document: {str(e)}"
+    
+    def load_cached_texts(self, file_hash, decryption_key=None):
+        """Get the cached page texts of a known document as a BookTextStore, or None
+        
+        The cached text of an encrypted PDF is read with the PDF's
+        decryption_key (see PDFReader.decryption_key).
+        """
+        document = self.get_document(file_hash)
+        if document is None or not document['text_cache_path']:
+            return None
+        
+        store_key = derive_store_key(decryption_key) if decryption_key is not None else None
+        page_texts = load_page_texts(document['text_cache_path'], store_key)
+        if page_texts is None:
+            return None
+        if len(page_texts) != document['page_count']:
+            page_texts.close()
+            return None
+        
+        return page_texts
+    
+    def update_position(self, file_hash, page, offset=0):
+        """Record the last read position of a document
+        
+        Returns False if the document is not in the library (yet).
+        """
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "UPDATE documents SET last_page = ?, last_offset = ? WHERE file_hash = ?",
+                (page, offset, file_hash)
+            )
+        return cursor.rowcount > 0
+    
+    def mark_opened(self, file_hash):
+        """Record that a document was opened now"""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE documents SET opened_at = ? WHERE file_hash = ?",
+                (time.time(), file_hash)
+            )
+    
+    def set_export_status(self, file_hash, status):
+        """Record the audio export status of a document"""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE documents SET export_status = ? WHERE file_hash = ?",
+                (status, file_hash)
+            )
+    
+    def import_directory(self, directory, max_workers=None, progress_callback=None,
+                         metadata_only=False):
+        """Import every PDF below a directory using a pool of worker processes
+        
+        Files already in the library (by content hash) are skipped. With
+        metadata_only, only the page count, title and author are read and
+        text extraction is left until a document is first opened. Returns
+        (success, summary) where summary counts added, skipped and failed files.
+        """
+        try:
+            pdf_paths = []
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    if name.lower().endswith('.pdf'):
+                        pdf_paths.append(os.path.join(root, name))
+            
+            known_hashes = self.get_known_hashes()
+            worker_hashes = frozenset(known_hashes)
+            summary = {'added': 0, 'skipped': 0, 'failed': 0, 'errors': []}
+            worker = _probe_worker if metadata_only else _import_worker
+            
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(worker, path, worker_hashes) for path in pdf_paths]
+                
+                for done, future in enumerate(as_completed(futures), start=1):
+                    success, record = future.result()
+                    
+                    if not success:
+                        summary['failed'] += 1
+                        summary['errors'].append(record)
+                    elif record is None or record['file_hash'] in known_hashes:
+                        summary['skipped'] += 1
+                    else:
+                        # Identical copies within this import are added once
+                        known_hashes.add(record['file_hash'])
+                        self.add_document(record)
+                        summary['added'] += 1
+                    
+                    if progress_callback is not None:
+                        progress_callback(done, len(pdf_paths))
+            
+            return True, summary
+            
+        except Exception as e:
+            return False, f"Error importing directory: {str(e)}"
+    
+    def close(self):
+        """Close the database connection"""
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+def main():
+    """Bulk import PDFs from the command line"""
+    arguments = [argument for argument in sys.argv[1:] if argument != "--quick"]
+    if len(arguments) != 1:
+        print("Usage: python library.py [--quick] <directory>")
+        print("  --quick  read metadata only; texts are extracted on first open")
+        sys.exit(1)
+    
+    library = Library()
+    success, summary = library.import_directory(arguments[0], metadata_only="--quick" in sys.argv)
+    
+    if success:
+        print(f"Added: {summary['added']}, already known: {summary['skipped']}, "
+              f"failed: {summary['failed']}")
+        for error in summary['errors']:
+            print(f"  {error}")
+    else:
+        print(summary)
+        sys.exit(1)
+    
+    library.close()
+
+
+if __name__ == "__main__":
+    main()
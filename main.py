@@ -23,6 +23,7 @@ try:
     from pdf_reader import PDFReader
     from audio_converter import AudioConverter
     from gui import AudiobookGUI
+    from library import Library
 except ImportError as e:
     print(f"Error importing modules: {e}")
     print("Make sure all required files are in the same directory:")
@@ -39,6 +40,7 @@ class AudiobookApp:
         """Initialize the application"""
         self.pdf_reader = None
         self.audio_converter = None
+        self.library = None
         self.gui = None
         
         # Check dependencies
@@ -98,8 +100,15 @@ pip install -r requirements.txt
             self.audio_converter = AudioConverter()
             print("Audio converter initialized")
             
+            # Initialize library (optional - the app works without it)
+            try:
+                self.library = Library()
+                print(f"Library opened: {self.library.db_path}")
+            except Exception as e:
+                print(f"Library unavailable: {str(e)}")
+            
             # Initialize GUI
-            self.gui = AudiobookGUI(self.pdf_reader, self.audio_converter)
+            self.gui = AudiobookGUI(self.pdf_reader, self.audio_converter, self.library)
             print("GUI initialized")
             
         except Exception as e:
@@ -172,6 +181,9 @@ pip install -r requirements.txt
         if self.pdf_reader:
             self.pdf_reader.close_pdf()
         
+        if self.library:
+            self.library.close()
+        
         print("Cleanup complete")
 
 
@@ -0,0 +1,605 @@
+"""
+PDF Probe Module
+Metadata-only PDF reader for bulk scans: page count, title, author,
+encryption status, outline size and content hash from the trailer, the
+cross-reference data and the few objects they point to
+
+Only the end of the file, the xref sections and the catalog, page tree root,
+info and outline dictionaries are read, so probing costs a few small reads
+per file instead of a full PyPDF2 parse. Files the probe cannot follow (e.g.
+damaged xref tables or unusual stream filters) fall back to PyPDF2.
+
+Usage:
+    python pdf_probe.py <directory> [--workers N]
+"""
+import json
+import mmap
+import os
+import re
+import sys
+import time
+import zlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import PyPDF2
+
+from cache_utils import compute_file_hash
+
+# Bytes at the end of the file searched for startxref
+TAIL_BYTES = 4096
+
+# Outline entries counted when the outline root has no /Count
+MAX_OUTLINE_WALK = 10000
+
+# Files handed to each worker process at a time when probing a directory
+PROBE_CHUNK_SIZE = 16
+
+WHITESPACE = b"\x00\t\n\x0c\r "
+NUMBER_PATTERN = re.compile(rb"[+-]?(?:\d+\.?\d*|\.\d+)")
+REGULAR_PATTERN = re.compile(rb"[^\x00\t\n\x0c\r ()<>\[\]{}/%]+")
+STARTXREF_PATTERN = re.compile(rb"startxref\s+(\d+)")
+VERSION_PATTERN = re.compile(rb"%PDF-(\d\.\d)")
+
+LITERAL_ESCAPES = {
+    ord('n'): b"\n", ord('r'): b"\r", ord('t'): b"\t",
+    ord('b'): b"\b", ord('f'): b"\f"
+}
+
+# PDFDocEncoding bytes that differ from Latin-1
+PDFDOC_CHARACTERS = dict(zip(
+    range(0x80, 0xA1),
+    "\u2022\u2020\u2021\u2026\u2014\u2013\u0192\u2044\u2039\u203a\u2212\u2030\u201e\u201c\u201d"
+    "\u2018\u2019\u201a\u2122\ufb01\ufb02\u0141\u0152\u0160\u0178\u017d\u0131\u0142\u0153"
+    "\u0161\u017e\ufffd\u20ac"
+))
+
+Ref = namedtuple('Ref', 'number generation')
+Stream = namedtuple('Stream', 'dictionary data')
+
+
+class Name(str):
+    """A PDF name, kept apart from strings"""
+
+
+class ProbeError(Exception):
+    """The file uses structure the probe does not follow"""
+
+
+class Parser:
+    def __init__(self, data, position=0):
+        """Tokenizer and object parser over PDF bytes"""
+        self.data = data
+        self.position = position
+    
+    def skip_space(self):
+        data = self.data
+        while self.position < len(data):
+            byte = data[self.position]
+            if byte in WHITESPACE:
+                self.position += 1
+            elif byte == ord('%'):
+                end = data.find(b"\n", self.position)
+                self.position = len(data) if end < 0 else end + 1
+            else:
+                break
+    
+    def keyword(self):
+        """Next regular token as bytes, without consuming it"""
+        self.skip_space()
+        match = REGULAR_PATTERN.match(self.data, self.position)
+        return match.group() if match else b""
+    
+    def expect(self, token):
+        self.skip_space()
+        if self.data[self.position:self.position + len(token)] != token:
+            raise ProbeError(f"Expected {token!r} at offset {self.position}")
+        self.position += len(token)
+    
+    def integer(self):
+        self.skip_space()
+        match = NUMBER_PATTERN.match(self.data, self.position)
+        if match is None:
+            raise ProbeError(f"Expected a number at offset {self.position}")
+        self.position = match.end()
+        return int(float(match.group()))
+    
+    def value(self):
+        """Parse one object; references come back as Ref"""
+        self.skip_space()
+        data = self.data
+        if self.position >= len(data):
+            raise ProbeError("Unexpected end of file")
+        
+        start = data[self.position:self.position + 2]
+        if start == b"<<":
+            return self._dictionary()
+        if start[:1] == b"<":
+            return self._hex_string()
+        if start[:1] == b"[":
+            self.position += 1
+            items = []
+            while True:
+                self.skip_space()
+                if data[self.position:self.position + 1] == b"]":
+                    self.position += 1
+                    return items
+                items.append(self.value())
+        if start[:1] == b"(":
+            return self._literal_string()
+        if start[:1] == b"/":
+            return self._name()
+        
+        match = NUMBER_PATTERN.match(data, self.position)
+        if match is not None:
+            return self._number_or_ref(match)
+        
+        token = self.keyword()
+        self.position += len(token)
+        if token == b"true":
+            return True
+        if token == b"false":
+            return False
+        if token == b"null":
+            return None
+        raise ProbeError(f"Unexpected token {token!r} at offset {self.position}")
+    
+    def _number_or_ref(self, match):
+        text = match.group()
+        self.position = match.end()
+        if b"." in text:
+            return float(text)
+        number = int(text)
+        
+        # "12 0 R" is a reference
+        saved = self.position
+        self.skip_space()
+        generation = NUMBER_PATTERN.match(self.data, self.position)
+        if generation is not None and b"." not in generation.group():
+            self.position = generation.end()
+            if self.keyword() == b"R":
+                self.skip_space()
+                self.position += 1
+                return Ref(number, int(generation.group()))
+        self.position = saved
+        return number
+    
+    def _dictionary(self):
+        self.position += 2
+        dictionary = {}
+        while True:
+            self.skip_space()
+            if self.data[self.position:self.position + 2] == b">>":
+                self.position += 2
+                return dictionary
+            key = self.value()
+            if not isinstance(key, Name):
+                raise ProbeError(f"Dictionary key is not a name at offset {self.position}")
+            dictionary[str(key)] = self.value()
+    
+    def _name(self):
+        self.position += 1
+        match = REGULAR_PATTERN.match(self.data, self.position)
+        raw = match.group() if match else b""
+        self.position += len(raw)
+        # #xx escapes
+        name = re.sub(rb"#([0-9A-Fa-f]{2})", lambda m: bytes([int(m.group(1), 16)]), raw)
+        return Name(name.decode('latin-1'))
+    
+    def _hex_string(self):
+        end = self.data.find(b">", self.position)
+        if end < 0:
+            raise ProbeError("Unterminated hex string")
+        digits = re.sub(rb"[^0-9A-Fa-f]", b"", bytes(self.data[self.position + 1:end]))
+        self.position = end + 1
+        if len(digits) % 2:
+            digits += b"0"
+        return bytes.fromhex(digits.decode('ascii'))
+    
+    def _literal_string(self):
+        data = self.data
+        self.position += 1
+        depth = 1
+        result = bytearray()
+        while self.position < len(data):
+            byte = data[self.position]
+            self.position += 1
+            if byte == ord('\\'):
+                escaped = data[self.position]
+                self.position += 1
+                if escaped in LITERAL_ESCAPES:
+                    result += LITERAL_ESCAPES[escaped]
+                elif ord('0') <= escaped <= ord('7'):
+                    digits = bytes([escaped])
+                    while len(digits) < 3 and ord('0') <= data[self.position] <= ord('7'):
+                        digits += bytes([data[self.position]])
+                        self.position += 1
+                    result.append(int(digits, 8) & 0xFF)
+                elif escaped in b"\r\n":
+                    # Line continuation
+                    if escaped == ord('\r') and data[self.position] == ord('\n'):
+                        self.position += 1
+                else:
+                    result.append(escaped)
+            elif byte == ord('('):
+                depth += 1
+                result.append(byte)
+            elif byte == ord(')'):
+                depth -= 1
+                if depth == 0:
+                    return bytes(result)
+                result.append(byte)
+            else:
+                result.append(byte)
+        raise ProbeError("Unterminated string")
+
+
+def decode_text(value):
+    """Decode a PDF text string (UTF-16 with BOM, UTF-8 with BOM or PDFDocEncoding)"""
+    if not isinstance(value, bytes):
+        return None
+    if value.startswith(b"\xfe\xff"):
+        return value[2:].decode('utf-16-be', 'replace')
+    if value.startswith(b"\xef\xbb\xbf"):
+        return value[3:].decode('utf-8', 'replace')
+    return value.decode('latin-1').translate(PDFDOC_CHARACTERS)
+
+
+def _png_unpredict(data, columns):
+    """Undo PNG row predictors, as used by most xref streams"""
+    row_size = columns + 1
+    previous = bytearray(columns)
+    output = bytearray()
+    for start in range(0, len(data) - row_size + 1, row_size):
+        kind = data[start]
+        row = bytearray(data[start + 1:start + row_size])
+        for i in range(columns):
+            left = row[i - 1] if i else 0
+            up = previous[i]
+            if kind == 1:
+                row[i] = (row[i] + left) & 0xFF
+            elif kind == 2:
+                row[i] = (row[i] + up) & 0xFF
+            elif kind == 3:
+                row[i] = (row[i] + (left + up) // 2) & 0xFF
+            elif kind == 4:
+                up_left = previous[i - 1] if i else 0
+                estimate = left + up - up_left
+                distances = (abs(estimate - left), abs(estimate - up), abs(estimate - up_left))
+                row[i] = (row[i] + (left, up, up_left)[distances.index(min(distances))]) & 0xFF
+        output += row
+        previous = row
+    return bytes(output)
+
+
+class PDFProbe:
+    def __init__(self, data):
+        """Follow the cross-reference data of a PDF held in data (bytes or mmap)"""
+        self.data = data
+        # Object number -> (1, offset) or (2, object stream number, index)
+        self.xref = {}
+        self.trailer = {}
+        self.object_streams = {}
+        
+        self._read_xref()
+    
+    def _read_xref(self):
+        tail_start = max(0, len(self.data) - TAIL_BYTES)
+        matches = list(STARTXREF_PATTERN.finditer(self.data, tail_start))
+        if not matches:
+            raise ProbeError("No startxref found")
+        
+        position = int(matches[-1].group(1))
+        visited = set()
+        while position is not None and position not in visited:
+            visited.add(position)
+            parser = Parser(self.data, position)
+            if parser.keyword() == b"xref":
+                trailer = self._read_xref_table(parser)
+                # Hybrid files keep compressed objects in an extra xref stream
+                if isinstance(trailer.get('XRefStm'), int):
+                    self._read_xref_stream(trailer['XRefStm'])
+            else:
+                trailer = self._read_xref_stream(position)
+            
+            # Newer sections come first and win
+            for key, value in trailer.items():
+                self.trailer.setdefault(key, value)
+            position = trailer.get('Prev')
+        
+        if 'Root' not in self.trailer:
+            raise ProbeError("Trailer has no /Root")
+    
+    def _read_xref_table(self, parser):
+        parser.expect(b"xref")
+        while True:
+            if parser.keyword() == b"trailer":
+                parser.expect(b"trailer")
+                return parser.value()
+            
+            first = parser.integer()
+            count = parser.integer()
+            for number in range(first, first + count):
+                offset = parser.integer()
+                parser.integer()
+                kind = parser.keyword()
+                parser.position += len(kind)
+                if kind == b"n":
+                    self.xref.setdefault(number, (1, offset))
+                elif kind == b"f":
+                    self.xref.setdefault(number, (0,))
+                else:
+                    raise ProbeError("Malformed xref table")
+    
+    def _read_xref_stream(self, position):
+        stream = self._parse_indirect(position)
+        if not isinstance(stream, Stream) or stream.dictionary.get('Type') != 'XRef':
+            raise ProbeError("startxref does not point to an xref section")
+        
+        dictionary = stream.dictionary
+        data = self._decode(stream)
+        widths = dictionary['W']
+        index = dictionary.get('Index', [0, dictionary['Size']])
+        
+        offset = 0
+        for first, count in zip(index[::2], index[1::2]):
+            for number in range(first, first + count):
+                fields = []
+                for width in widths:
+                    fields.append(int.from_bytes(data[offset:offset + width], 'big') if width else None)
+                    offset += width
+                kind = fields[0] if fields[0] is not None else 1
+                
+                if kind == 1:
+                    self.xref.setdefault(number, (1, fields[1]))
+                elif kind == 2:
+                    self.xref.setdefault(number, (2, fields[1], fields[2]))
+                else:
+                    self.xref.setdefault(number, (0,))
+        if offset > len(data):
+            raise ProbeError("Truncated xref stream")
+        
+        return dictionary
+    
+    def _parse_indirect(self, position):
+        """Parse "n g obj ... endobj" at position; streams come back as Stream"""
+        parser = Parser(self.data, position)
+        parser.integer()
+        parser.integer()
+        parser.expect(b"obj")
+        value = parser.value()
+        
+        if isinstance(value, dict) and parser.keyword() == b"stream":
+            parser.expect(b"stream")
+            if self.data[parser.position:parser.position + 2] == b"\r\n":
+                parser.position += 2
+            elif self.data[parser.position:parser.position + 1] in (b"\n", b"\r"):
+                parser.position += 1
+            
+            length = value.get('Length')
+            if isinstance(length, Ref):
+                length = self.resolve(length)
+            if not isinstance(length, int):
+                end = self.data.find(b"endstream", parser.position)
+                if end < 0:
+                    raise ProbeError("Unterminated stream")
+                length = end - parser.position
+            return Stream(value, bytes(self.data[parser.position:parser.position + length]))
+        
+        return value
+    
+    def _decode(self, stream):
+        """Decompress a stream's data"""
+        filters = stream.dictionary.get('Filter')
+        if filters is None:
+            return stream.data
+        if isinstance(filters, list):
+            if len(filters) != 1:
+                raise ProbeError("Chained stream filters are not supported")
+            filters = filters[0]
+        if filters != 'FlateDecode':
+            raise ProbeError(f"Unsupported stream filter {filters}")
+        
+        data = zlib.decompress(stream.data)
+        parameters = stream.dictionary.get('DecodeParms') or {}
+        if isinstance(parameters, list):
+            parameters = parameters[0] or {}
+        if parameters.get('Predictor', 1) >= 10:
+            data = _png_unpredict(data, parameters.get('Columns', 1))
+        elif parameters.get('Predictor', 1) != 1:
+            raise ProbeError("Unsupported predictor")
+        return data
+    
+    def _object_from_stream(self, stream_number, index):
+        if stream_number not in self.object_streams:
+            stream = self.get_object(stream_number)
+            if not isinstance(stream, Stream):
+                raise ProbeError("Object stream missing")
+            data = self._decode(stream)
+            header = Parser(data)
+            count = stream.dictionary['N']
+            offsets = [(header.integer(), header.integer()) for _ in range(count)]
+            self.object_streams[stream_number] = (data, stream.dictionary['First'], offsets)
+        
+        data, first, offsets = self.object_streams[stream_number]
+        return Parser(data, first + offsets[index][1]).value()
+    
+    def get_object(self, number):
+        entry = self.xref.get(number)
+        if entry is None or entry[0] == 0:
+            return None
+        if entry[0] == 1:
+            return self._parse_indirect(entry[1])
+        return self._object_from_stream(entry[1], entry[2])
+    
+    def resolve(self, value):
+        """Follow a reference (or chain of references) to its object"""
+        seen = set()
+        while isinstance(value, Ref):
+            if value.number in seen:
+                raise ProbeError("Reference loop")
+            seen.add(value.number)
+            value = self.get_object(value.number)
+        return value
+    
+    def page_count(self):
+        root = self.resolve(self.trailer['Root'])
+        pages = self.resolve(root['Pages'])
+        count = self.resolve(pages.get('Count'))
+        if not isinstance(count, int):
+            raise ProbeError("Page tree has no /Count")
+        return count
+    
+    def info(self):
+        info = self.resolve(self.trailer.get('Info'))
+        return info if isinstance(info, dict) else {}
+    
+    def outline_entries(self):
+        """Number of top-level outline entries"""
+        root = self.resolve(self.trailer['Root'])
+        outline = self.resolve(root.get('Outlines'))
+        if not isinstance(outline, dict):
+            return 0
+        
+        entries = 0
+        item = outline.get('First')
+        seen = set()
+        while isinstance(item, Ref) and item not in seen and entries < MAX_OUTLINE_WALK:
+            seen.add(item)
+            entries += 1
+            node = self.resolve(item)
+            item = node.get('Next') if isinstance(node, dict) else None
+        return entries
+
+
+def _probe_with_pypdf2(file_path):
+    """Fallback for files the probe cannot follow"""
+    reader = PyPDF2.PdfReader(file_path, strict=False)
+    encrypted = reader.is_encrypted
+    if encrypted:
+        # Many encrypted files open with an empty user password
+        try:
+            reader.decrypt("")
+        except Exception:
+            return {'page_count': None, 'title': None, 'author': None,
+                    'encrypted': True, 'outline_entries': None}
+    
+    metadata = reader.metadata or {}
+    try:
+        outline_entries = sum(1 for item in reader.outline if not isinstance(item, list))
+    except Exception:
+        outline_entries = None
+    
+    return {
+        'page_count': len(reader.pages),
+        'title': metadata.get('/Title'),
+        'author': metadata.get('/Author'),
+        'encrypted': encrypted,
+        'outline_entries': outline_entries
+    }
+
+
+def probe_pdf(file_path, compute_hash=True):
+    """Read the metadata of a PDF without parsing its pages
+    
+    Returns (success, info) with info holding file_path, file_size,
+    file_hash (if compute_hash), pdf_version, page_count, title, author,
+    encrypted, outline_entries and the method used ('probe' or 'pypdf2'),
+    or (False, message).
+    """
+    try:
+        file_size = os.path.getsize(file_path)
+        info = {
+            'file_path': os.path.abspath(file_path),
+            'file_size': file_size,
+            'file_hash': compute_file_hash(file_path) if compute_hash else None,
+            'pdf_version': None
+        }
+        if file_size == 0:
+            return False, f"{file_path} is empty"
+        
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            version = VERSION_PATTERN.search(data, 0, min(1024, file_size))
+            if version is None:
+                return False, f"{file_path} is not a PDF"
+            info['pdf_version'] = version.group(1).decode('ascii')
+            
+            try:
+                probe = PDFProbe(data)
+                encrypted = 'Encrypt' in probe.trailer
+                document_info = {} if encrypted else probe.info()
+                info.update({
+                    'page_count': probe.page_count(),
+                    # Strings of encrypted files are encrypted too
+                    'title': decode_text(document_info.get('Title')),
+                    'author': decode_text(document_info.get('Author')),
+                    'encrypted': encrypted,
+                    'outline_entries': probe.outline_entries(),
+                    'method': 'probe'
+                })
+            except (ProbeError, KeyError, IndexError, TypeError, ValueError, AttributeError, zlib.error):
+                info.update(_probe_with_pypdf2(file_path))
+                info['method'] = 'pypdf2'
+        
+        return True, info
+        
+    except Exception as e:
+        return False, f"Error probing {file_path}: {str(e)}"
+
+
+def _probe_worker(file_path):
+    return file_path, probe_pdf(file_path)
+
+
+def probe_directory(directory, max_workers=None, progress_callback=None):
+    """Probe every PDF below a directory on a pool of worker processes
+    
+    Returns (success, results) where results is a list of
+    (file path, (success, info or message)) in directory order.
+    """
+    try:
+        pdf_paths = []
+        for root, _, files in os.walk(directory):
+            for name in sorted(files):
+                if name.lower().endswith('.pdf'):
+                    pdf_paths.append(os.path.join(root, name))
+        
+        results = []
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for done, result in enumerate(executor.map(_probe_worker, pdf_paths,
+                                                       chunksize=PROBE_CHUNK_SIZE), start=1):
+                results.append(result)
+                if progress_callback is not None:
+                    progress_callback(done, len(pdf_paths))
+        
+        return True, results
+        
+    except Exception as e:
+        return False, f"Error probing directory: {str(e)}"
+
+
+def main():
+    """Probe a directory of PDFs and print one JSON line per file"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Read PDF metadata quickly")
+    parser.add_argument("directory")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    
+    started = time.monotonic()
+    success, results = probe_directory(args.directory, args.workers)
+    if not success:
+        print(results)
+        sys.exit(1)
+    
+    for file_path, (success, info) in results:
+        print(json.dumps(info if success else {'file_path': file_path, 'error': info}))
+    
+    elapsed = time.monotonic() - started
+    print(f"Probed {len(results)} files in {elapsed:.1f}s "
+          f"({len(results) / elapsed * 60:.0f} files/minute)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,67 +3,941 @@ PDF Reader Module
 Handles PDF file reading and text extraction
 """
 import PyPDF2
+from PyPDF2.generic import IndirectObject
+import bisect
 import os
+import re
+import struct
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 
-class PDFReader:
+from profiling import profiled
+from text_store import BookTextStore
+
+# Sharing a file key between readers installs it into PyPDF2's private
+# Encryption object, whose layout is only known for PyPDF2 3.x; other
+# versions decrypt every reader with the password instead
+try:
+    from PyPDF2 import PasswordType
+    from PyPDF2._encryption import AlgV4, AlgV5
+    SHARED_KEY_SUPPORTED = PyPDF2.__version__.split(".")[0] == "3"
+except ImportError:
+    SHARED_KEY_SUPPORTED = False
+
+# Files that take longer than this (seconds) to parse are reported as slow
+SLOW_PARSE_THRESHOLD = 2.0
+
+# Text extraction engines selectable with PDFReader.set_engine
+ENGINE_PYPDF2 = "pypdf2"
+ENGINE_FAST = "fast"
+EXTRACTION_ENGINES = (ENGINE_PYPDF2, ENGINE_FAST)
+
+# Content stream tokens; literal strings and inline images are handled by hand
+CONTENT_TOKEN = re.compile(
+    rb"\s*(?:%[^\r\n]*"
+    rb"|(?P<hex><[0-9A-Fa-f\s]*>)"
+    rb"|(?P<dict><<|>>)"
+    rb"|(?P<array>[\[\]])"
+    rb"|(?P<name>/[^\s/\[\]()<>{}%]*)"
+    rb"|(?P<number>[+-]?(?:\d+\.?\d*|\.\d+))"
+    rb"|(?P<op>[A-Za-z'\"*][A-Za-z0-9'\"*]*)"
+    rb"|(?P<string>\()"
+    rb"|(?P<other>.)|$)",
+    re.S
+)
+SIMPLE_STRING = re.compile(rb"\(((?:[^()\\]|\\.)*)\)", re.S)
+STRING_ESCAPE = re.compile(rb"\\([0-7]{1,3}|\r\n|.)", re.S)
+STRING_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f"}
+INLINE_IMAGE_END = re.compile(rb"\sEI(?=[\s]|$)")
+
+# TJ adjustments (thousandths of text space) wider than this become a space
+TJ_SPACE_THRESHOLD = 200
+# Vertical moves smaller than this fraction of the font size stay on the
+# same line (superscripts, icons and bullets shift the baseline slightly)
+LINE_MOVE_THRESHOLD = 0.7
+# Horizontal moves wider than this many font sizes separate words (tab stops,
+# right-aligned columns); narrower ones continue a word (e.g. small caps)
+WORD_GAP_THRESHOLD = 3.0
+
+# Codecs of the named encodings of simple fonts; fonts without one are read as Latin-1
+BASE_ENCODINGS = {
+    "/WinAnsiEncoding": "cp1252",
+    "/MacRomanEncoding": "mac_roman",
+    "/StandardEncoding": "latin-1",
+    "/PDFDocEncoding": "latin-1"
+}
+# Where StandardEncoding differs from Latin-1 in characters worth reading
+STANDARD_ENCODING_CHANGES = {
+    0x27: "\u2019", 0x60: "\u2018", 0xAA: "\u201c", 0xAE: "\ufb01", 0xAF: "\ufb02",
+    0xB1: "\u2013", 0xB7: "\u2022", 0xBA: "\u201d", 0xD0: "\u2014", 0xE1: "\u00c6",
+    0xF1: "\u00e6", 0xF5: "\u0131", 0xF8: "\u0142", 0xFA: "\u0153", 0xFB: "\u00df"
+}
+# Glyph names used in /Differences that are neither one character nor uniXXXX
+GLYPH_NAMES = {
+    "space": " ", "exclam": "!", "quotedbl": '"', "numbersign": "#", "dollar": "$",
+    "percent": "%", "ampersand": "&", "quotesingle": "'", "parenleft": "(",
+    "parenright": ")", "asterisk": "*", "plus": "+", "comma": ",", "hyphen": "-",
+    "period": ".", "slash": "/", "colon": ":", "semicolon": ";", "less": "<",
+    "equal": "=", "greater": ">", "question": "?", "at": "@", "bracketleft": "[",
+    "backslash": "\\", "bracketright": "]", "asciicircum": "^", "underscore": "_",
+    "braceleft": "{", "bar": "|", "braceright": "}", "asciitilde": "~",
+    "zero": "0", "one": "1", "two": "2", "three": "3", "four": "4", "five": "5",
+    "six": "6", "seven": "7", "eight": "8", "nine": "9",
+    "quoteleft": "\u2018", "quoteright": "\u2019", "quotedblleft": "\u201c",
+    "quotedblright": "\u201d", "quotesinglbase": "\u201a", "quotedblbase": "\u201e",
+    "guillemotleft": "\u00ab", "guillemotright": "\u00bb", "endash": "\u2013",
+    "emdash": "\u2014", "minus": "\u2212", "bullet": "\u2022", "periodcentered": "\u00b7",
+    "ellipsis": "\u2026", "dagger": "\u2020", "daggerdbl": "\u2021", "section": "\u00a7",
+    "paragraph": "\u00b6", "copyright": "\u00a9", "registered": "\u00ae",
+    "trademark": "\u2122", "degree": "\u00b0", "multiply": "\u00d7", "divide": "\u00f7",
+    "ff": "ff", "fi": "fi", "fl": "fl", "ffi": "ffi", "ffl": "ffl",
+    "dotlessi": "\u0131", "germandbls": "\u00df", "ae": "\u00e6", "AE": "\u00c6",
+    "oe": "\u0153", "OE": "\u0152", "oslash": "\u00f8", "Oslash": "\u00d8",
+    "lslash": "\u0142", "Lslash": "\u0141", "exclamdown": "\u00a1",
+    "questiondown": "\u00bf", "sterling": "\u00a3", "yen": "\u00a5", "Euro": "\u20ac",
+    "cent": "\u00a2", "nbspace": "\u00a0", "acute": "\u00b4", "grave": "`",
+    "circumflex": "\u02c6", "tilde": "\u02dc", "dieresis": "\u00a8"
+}
+# Accented letters named after their base letter and accent, e.g. eacute
+GLYPH_ACCENTS = {
+    "acute": "\u0301", "grave": "\u0300", "circumflex": "\u0302", "dieresis": "\u0308",
+    "tilde": "\u0303", "ring": "\u030a", "cedilla": "\u0327", "caron": "\u030c"
+}
+CMAP_CHARS = re.compile(rb"beginbfchar(.*?)endbfchar", re.S)
+CMAP_RANGES = re.compile(rb"beginbfrange(.*?)endbfrange", re.S)
+CMAP_CHAR_ENTRY = re.compile(rb"<([0-9A-Fa-f]+)>\s*<([0-9A-Fa-f]*)>")
+CMAP_RANGE_ENTRY = re.compile(rb"<([0-9A-Fa-f]+)>\s*<([0-9A-Fa-f]+)>\s*(?:<([0-9A-Fa-f]*)>|\[([^\]]*)\])")
+CMAP_HEX = re.compile(rb"<([0-9A-Fa-f]*)>")
+
+
+# Page classes used to skip pages with nothing to read
+PAGE_TEXT = "text"
+PAGE_IMAGE = "image"
+PAGE_BLANK = "blank"
+PAGE_TYPE_CODES = {PAGE_TEXT: "t", PAGE_IMAGE: "i", PAGE_BLANK: "b"}
+
+# Content streams shorter than this are decoded and checked for text operators
+SMALL_CONTENT_LENGTH = 512
+TEXT_OPERATOR = re.compile(rb"(?:^|[\s\])>])(?:Tj|TJ|'|\")(?=[\s(\[<]|$)")
+
+
+def get_page_resources(obj):
+    """Find /Resources, which pages may inherit from the page tree"""
+    while obj is not None:
+        if "/Resources" in obj:
+            return obj["/Resources"].get_object()
+        parent = obj.get("/Parent")
+        obj = parent.get_object() if parent is not None else None
+    return {}
+
+
+def classify_page(page, object_size=None):
+    """Label a PyPDF2 page as text, image-only or blank without extracting it
+    
+    Only the resource dictionary and the size of the content streams are
+    inspected, except for very short streams which are also scanned.
+    object_size, such as PDFDocument.object_size, bounds the size of a
+    stream in the file before it is read; without it streams are decoded
+    to measure them. Pages that cannot be classified cheaply are labelled
+    as text so they still get read.
+    """
+    contents = page.raw_get("/Contents") if "/Contents" in page else None
+    if contents is None:
+        return PAGE_BLANK
+    
+    references = contents.get_object()
+    if not isinstance(references, list):
+        references = [contents]
+    
+    # PyPDF2 drops /Length once a stream is read, so the stored size comes
+    # from the file layout; streams that may be short are decoded
+    sizes = [object_size(reference) if object_size is not None and isinstance(reference, IndirectObject)
+             else None for reference in references]
+    data = None
+    if None in sizes or sum(sizes) < SMALL_CONTENT_LENGTH:
+        data = b"\n".join(reference.get_object().get_data() for reference in references).strip()
+        if not data:
+            return PAGE_BLANK
+    
+    resources = get_page_resources(page)
+    has_fonts = bool(resources.get("/Font"))
+    
+    images = 0
+    forms = 0
+    xobjects = resources.get("/XObject")
+    if xobjects:
+        for name in xobjects.get_object():
+            subtype = xobjects.get_object()[name].get_object().get("/Subtype")
+            if subtype == "/Image":
+                images += 1
+            elif subtype == "/Form":
+                forms += 1
+    
+    # Form XObjects may carry their own fonts; extract to be safe
+    if forms:
+        return PAGE_TEXT
+    
+    if data is not None and len(data) < SMALL_CONTENT_LENGTH:
+        has_inline_image = re.search(rb"\bBI\b", data) is not None
+        if not has_fonts or not TEXT_OPERATOR.search(data):
+            return PAGE_IMAGE if images or has_inline_image else PAGE_BLANK
+        return PAGE_TEXT
+    
+    if not has_fonts:
+        if images:
+            return PAGE_IMAGE
+        # Rare: large content without fonts or image XObjects, e.g. inline images
+        if data is None:
+            data = b"\n".join(reference.get_object().get_data() for reference in references)
+        return PAGE_IMAGE if re.search(rb"\bBI\b", data) else PAGE_BLANK
+    
+    return PAGE_TEXT
+
+
+def _unescape_string(data):
+    """Resolve backslash escapes in a literal string"""
+    def replace(match):
+        escape = match.group(1)
+        if escape[:1].isdigit():
+            return bytes((int(escape, 8) & 0xFF,))
+        if escape in (b"\r\n", b"\n", b"\r"):
+            return b""
+        return STRING_ESCAPES.get(escape, escape)
+    
+    return STRING_ESCAPE.sub(replace, data)
+
+
+def _read_literal_string(data, pos):
+    """Read a literal string starting at '(' and return (bytes, end position)"""
+    match = SIMPLE_STRING.match(data, pos)
+    if match:
+        raw = match.group(1)
+        return (_unescape_string(raw) if b"\\" in raw else raw), match.end()
+    
+    # Nested parentheses: scan with a depth counter
+    depth = 0
+    i = pos
+    while i < len(data):
+        char = data[i]
+        if char == 0x5C:  # backslash
+            i += 2
+            continue
+        if char == 0x28:
+            depth += 1
+        elif char == 0x29:
+            depth -= 1
+            if depth == 0:
+                return _unescape_string(data[pos + 1:i]), i + 1
+        i += 1
+    
+    return _unescape_string(data[pos + 1:]), len(data)
+
+
+def _glyph_text(name):
+    """Text of a glyph name from a /Differences array, or None if unknown"""
+    if name in GLYPH_NAMES:
+        return GLYPH_NAMES[name]
+    if len(name) == 1:
+        return name
+    if name.startswith("uni") and len(name) >= 7 and (len(name) - 3) % 4 == 0:
+        try:
+            return "".join(chr(int(name[i:i + 4], 16)) for i in range(3, len(name), 4))
+        except ValueError:
+            return None
+    if name.startswith("u") and 5 <= len(name) <= 7:
+        try:
+            return chr(int(name[1:], 16))
+        except ValueError:
+            return None
+    if len(name) > 1 and name[1:] in GLYPH_ACCENTS:
+        return unicodedata.normalize("NFC", name[0] + GLYPH_ACCENTS[name[1:]])
+    
+    # Variants (a.sc) and ligatures (f_f_i) of known glyphs
+    base = name.split(".")[0]
+    if base and base != name:
+        return _glyph_text(base)
+    if "_" in name:
+        parts = [_glyph_text(part) for part in name.split("_")]
+        return "".join(parts) if all(parts) else None
+    return None
+
+
+def _utf16_text(digits):
+    """Decode a UTF-16BE hex string from a CMap"""
+    if len(digits) % 4:
+        digits = digits.rjust(len(digits) + 4 - len(digits) % 4, b"0")
+    return bytes.fromhex(digits.decode("ascii")).decode("utf-16-be", "surrogatepass")
+
+
+def parse_to_unicode(data):
+    """Read a ToUnicode CMap; returns (code width in bytes, {code: text})"""
+    mapping = {}
+    width = None
+    
+    for block in CMAP_CHARS.findall(data):
+        for source, target in CMAP_CHAR_ENTRY.findall(block):
+            width = width or len(source) // 2
+            mapping[int(source, 16)] = _utf16_text(target)
+    
+    for block in CMAP_RANGES.findall(data):
+        for low, high, target, targets in CMAP_RANGE_ENTRY.findall(block):
+            width = width or len(low) // 2
+            low, high = int(low, 16), int(high, 16)
+            if targets:
+                for code, digits in zip(range(low, high + 1), CMAP_HEX.findall(targets)):
+                    mapping[code] = _utf16_text(digits)
+            elif target:
+                # The last UTF-16 unit counts up through the range
+                text = _utf16_text(target)
+                for offset in range(min(high - low, 0xFFFF) + 1):
+                    mapping[low + offset] = text[:-1] + chr(ord(text[-1]) + offset)
+    
+    return width or 1, mapping
+
+
+def _simple_font_table(font):
+    """Character of every byte of a simple font, from its /Encoding"""
+    encoding = font.get("/Encoding")
+    encoding = encoding.get_object() if encoding is not None else None
+    differences = []
+    if isinstance(encoding, dict):
+        differences = encoding.get("/Differences") or []
+        encoding = encoding.get("/BaseEncoding")
+    
+    codec = BASE_ENCODINGS.get(encoding, "latin-1")
+    table = {}
+    for code in range(0x80 if codec == "latin-1" else 0x20, 0x100):
+        try:
+            char = bytes((code,)).decode(codec)
+        except UnicodeDecodeError:
+            continue
+        if char != chr(code):
+            table[code] = char
+    if encoding == "/StandardEncoding":
+        table.update(STANDARD_ENCODING_CHANGES)
+    
+    code = 0
+    for item in differences:
+        item = item.get_object()
+        if isinstance(item, int):
+            code = item
+            continue
+        text = _glyph_text(str(item)[1:])
+        if text is not None and 0 <= code < 0x100:
+            table[code] = text
+        code += 1
+    
+    return table
+
+
+def build_font_table(font):
+    """Decoding table of a font resource: (code width, {code: text}, space threshold)
+    
+    Simple fonts decode one byte per character through their encoding and
+    Type0 fonts two bytes per character; a ToUnicode CMap, where present,
+    takes precedence for the codes it maps. Unmapped codes read as the
+    character with the same number.
+    """
+    width, table = 1, {}
+    if font.get("/Subtype") == "/Type0":
+        width = 2
+    else:
+        table = _simple_font_table(font)
+    
+    to_unicode = font.get("/ToUnicode")
+    if to_unicode is not None:
+        to_unicode = to_unicode.get_object()
+        if hasattr(to_unicode, "get_data"):
+            cmap_width, mapping = parse_to_unicode(to_unicode.get_data())
+            width = cmap_width if font.get("/Subtype") == "/Type0" else 1
+            table.update(mapping)
+    
+    # TJ gaps of half a space or more separate words in wide-spaced fonts
+    threshold = TJ_SPACE_THRESHOLD
+    widths = font.get("/Widths")
+    if width == 1 and widths is not None:
+        widths = widths.get_object()
+        space = 32 - int(font.get("/FirstChar", 0))
+        if 0 <= space < len(widths):
+            threshold = max(threshold, float(widths[space].get_object()) / 2)
+    
+    return width, table, threshold
+
+
+class FastTextExtractor:
+    """Extracts plain text straight from page content streams
+    
+    Only text-showing and text-positioning operators are interpreted, and font
+    decoding tables are built once per font for the whole document.
+    """
+    
     def __init__(self):
+        # Font key -> (font object, decoding table from build_font_table)
+        self.font_cache = {}
+    
+    def extract_page(self, page):
+        """Extract the text of a PyPDF2 page"""
+        resources = get_page_resources(page)
+        contents = page.get("/Contents")
+        if contents is None:
+            return ""
+        
+        return "".join(self._extract_stream(self._stream_data(contents), resources)).strip("\n")
+    
+    def _stream_data(self, contents):
+        """Get decoded content stream bytes (a stream or an array of streams)"""
+        contents = contents.get_object()
+        if isinstance(contents, list):
+            return b"\n".join(part.get_object().get_data() for part in contents)
+        return contents.get_data()
+    
+    def _get_font(self, resources, font_name):
+        """Get the cached decoding table for a font resource"""
+        fonts = resources.get("/Font")
+        if fonts is None:
+            return None
+        
+        fonts = fonts.get_object()
+        reference = fonts.raw_get(font_name) if font_name in fonts else None
+        if reference is None:
+            return None
+        
+        # Indirect fonts are shared by many pages; key them by object number.
+        # Direct ones are keyed by identity and kept alive by the cache, so
+        # their id cannot be reused by another object
+        if isinstance(reference, IndirectObject):
+            key = (reference.idnum, reference.generation)
+        else:
+            key = id(reference)
+        
+        cached = self.font_cache.get(key)
+        if cached is None:
+            try:
+                table = build_font_table(reference.get_object())
+            except Exception:
+                # Broken font dictionaries fall back to Latin-1 decoding
+                table = None
+            cached = self.font_cache[key] = (reference, table)
+        
+        return cached[1]
+    
+    def _decode(self, data, font):
+        """Decode a text-showing operand with the current font"""
+        if font is None:
+            return data.decode("latin-1")
+        
+        width, table, _ = font
+        if width == 1:
+            return data.decode("latin-1").translate(table)
+        
+        codes = struct.unpack(f">{len(data) // 2}H", data[:len(data) // 2 * 2])
+        return "".join([table.get(code) or chr(code) for code in codes])
+    
+    def _extract_stream(self, data, resources, depth=0):
+        """Interpret a content stream and return its text pieces"""
+        output = []
+        operands = []
+        arrays = []
+        font = None
+        font_size = 10.0
+        line_y = None
+        fonts = {}
+        
+        def new_line():
+            if output and not output[-1].endswith("\n"):
+                output.append("\n")
+        
+        def separate():
+            if output and not output[-1].endswith((" ", "\n")):
+                output.append(" ")
+        
+        pos = 0
+        length = len(data)
+        
+        while pos < length:
+            match = CONTENT_TOKEN.match(data, pos)
+            pos = match.end()
+            kind = match.lastgroup
+            
+            if kind is None or kind in ("dict", "other"):
+                continue
+            
+            if kind == "string":
+                value, pos = _read_literal_string(data, match.start(kind))
+            elif kind == "hex":
+                digits = re.sub(rb"\s", b"", match.group(kind)[1:-1])
+                if len(digits) % 2:
+                    digits += b"0"
+                value = bytes.fromhex(digits.decode("ascii"))
+            elif kind == "number":
+                value = float(match.group(kind))
+            elif kind == "name":
+                value = match.group(kind)[1:].decode("latin-1")
+            elif kind == "array":
+                if match.group(kind) == b"[":
+                    arrays.append(operands)
+                    operands = []
+                elif arrays:
+                    array_value = operands
+                    operands = arrays.pop()
+                    operands.append(array_value)
+                continue
+            else:
+                operator = match.group(kind)
+                
+                if operator == b"Tj" or operator == b"'" or operator == b'"':
+                    if operator != b"Tj":
+                        new_line()
+                    if operands and isinstance(operands[-1], bytes):
+                        output.append(self._decode(operands[-1], font))
+                elif operator == b"TJ":
+                    if operands and isinstance(operands[-1], list):
+                        threshold = font[2] if font is not None else TJ_SPACE_THRESHOLD
+                        for item in operands[-1]:
+                            if isinstance(item, bytes):
+                                output.append(self._decode(item, font))
+                            elif -item >= threshold:
+                                separate()
+                elif operator == b"Td" or operator == b"TD":
+                    # Offsets are in text space, already scaled by the matrix
+                    if len(operands) >= 2 and abs(operands[-1]) > LINE_MOVE_THRESHOLD * font_size:
+                        new_line()
+                    elif len(operands) >= 2 and operands[-2] > WORD_GAP_THRESHOLD * font_size:
+                        separate()
+                elif operator == b"T*":
+                    new_line()
+                elif operator == b"Tm":
+                    if len(operands) >= 6:
+                        y = operands[-1]
+                        line_scale = abs(operands[-3]) or 1.0
+                        threshold = LINE_MOVE_THRESHOLD * font_size * line_scale
+                        if line_y is not None and abs(y - line_y) > threshold:
+                            new_line()
+                        line_y = y
+                elif operator == b"BT":
+                    line_y = None
+                elif operator == b"Tf":
+                    if len(operands) >= 2 and isinstance(operands[-2], str):
+                        font_name = operands[-2]
+                        if font_name not in fonts:
+                            fonts[font_name] = self._get_font(resources, "/" + font_name)
+                        font = fonts[font_name]
+                        font_size = abs(operands[-1]) or font_size
+                elif operator == b"Do":
+                    if operands and isinstance(operands[-1], str) and depth < 5:
+                        output.extend(self._extract_form(resources, "/" + operands[-1], depth))
+                elif operator == b"BI":
+                    # Skip inline image data
+                    end = INLINE_IMAGE_END.search(data, pos)
+                    pos = end.end() if end else length
+                
+                operands = []
+                continue
+            
+            operands.append(value)
+        
+        return output
+    
+    def _extract_form(self, resources, name, depth):
+        """Extract text from a form XObject drawn with Do"""
+        xobjects = resources.get("/XObject")
+        if xobjects is None:
+            return []
+        
+        xobjects = xobjects.get_object()
+        if name not in xobjects:
+            return []
+        
+        xobject = xobjects[name].get_object()
+        if xobject.get("/Subtype") != "/Form":
+            return []
+        
+        form_resources = xobject.get("/Resources")
+        form_resources = form_resources.get_object() if form_resources is not None else resources
+        
+        pieces = self._extract_stream(xobject.get_data(), form_resources, depth + 1)
+        return ["\n"] + pieces + ["\n"] if pieces else []
+
+
+class PasswordError(Exception):
+    """A PDF is encrypted and the password given does not open it"""
+
+
+def _key_matches(encryption, key):
+    """Whether key is the file key of a PDF, checked against its /U or /Perms entry"""
+    entry = encryption.entry
+    permissions = (int(entry["/P"]) + 0x100000000) % 0x100000000
+    
+    try:
+        if encryption.algV <= 4:
+            # /U holds the padding string encrypted with the file key
+            revision = int(entry["/R"])
+            length = 16 if revision >= 3 else 32
+            u_entry = entry["/U"].get_object().original_bytes
+            return AlgV4.compute_U_value(key, revision, encryption.id1_entry)[:length] == u_entry[:length]
+        
+        # /Perms holds the permissions encrypted with the file key
+        metadata = entry.get("/EncryptMetadata")
+        perms = entry["/Perms"].get_object().original_bytes
+        return AlgV5.verify_perms(key, perms, permissions, metadata.value if metadata is not None else True)
+    except Exception:
+        return False
+
+
+class PasswordKey(bytes):
+    """Decryption key that is the UTF-8 password itself
+    
+    Stands in for the file key where PyPDF2 cannot share one, so other
+    readers decrypt with the password and the text cache is still keyed.
+    """
+
+
+def unlock_reader(reader, password=None, decryption_key=None):
+    """Decrypt an encrypted PdfReader
+    
+    With a decryption_key returned by an earlier call for the same file, the
+    reader is unlocked directly and the key derivation from the password is
+    skipped where PyPDF2 allows it. Returns the file key, or a PasswordKey.
+    Raises PasswordError if the password (empty when not given) or the key
+    does not open the file.
+    """
+    if isinstance(decryption_key, PasswordKey):
+        password, decryption_key = decryption_key.decode('utf-8'), None
+    
+    encryption = getattr(reader, "_encryption", None) if SHARED_KEY_SUPPORTED else None
+    if encryption is None:
+        if decryption_key is not None:
+            raise PasswordError(f"Decryption keys cannot be installed with PyPDF2 {PyPDF2.__version__}")
+        if not reader.decrypt(password or ""):
+            raise PasswordError("Incorrect password" if password else "This PDF is protected by a password")
+        return PasswordKey((password or "").encode('utf-8'))
+    
+    if decryption_key is not None:
+        if not _key_matches(encryption, decryption_key):
+            raise PasswordError("Incorrect decryption key")
+        # PyPDF2 has no public way to install a known key
+        encryption._key = decryption_key
+        encryption._password_type = PasswordType.USER_PASSWORD
+        return decryption_key
+    
+    # PdfReader already tried the empty password when it was created
+    if not encryption.is_decrypted() and password:
+        reader.decrypt(password)
+    if not encryption.is_decrypted():
+        raise PasswordError("Incorrect password" if password else "This PDF is protected by a password")
+    
+    return encryption._key
+
+
+class _SharedPdfReader(PyPDF2.PdfReader):
+    """PdfReader whose object resolution is serialized
+    
+    Resolving an indirect object seeks and reads the shared file and fills
+    the resolved object cache, so only one thread may do it at a time.
+    Everything else (content stream decoding, text extraction) runs
+    concurrently on the resolved objects.
+    """
+    
+    def __init__(self, stream):
+        self._resolve_lock = threading.RLock()
+        super().__init__(stream)
+    
+    def get_object(self, indirect_reference):
+        with self._resolve_lock:
+            return super().get_object(indirect_reference)
+
+
+class PDFDocument:
+    """A PDF parsed once and shared by any number of PDFReader instances
+    
+    The page tree is read on open, or on first use when page_count is known.
+    Readers share it through acquire()/release(); the last release closes it.
+    """
+    
+    def __init__(self, file_path, password=None, decryption_key=None, page_count=None):
+        start_time = time.perf_counter()
+        
+        self.file_path = file_path
+        self.pdf_file = open(file_path, 'rb')
+        self.pages_lock = threading.Lock()
+        self._pages = None
+        # Sorted file offsets of the objects in the xref table, read on first use
+        self._object_offsets = None
+        self.recorded_page_count = page_count
+        try:
+            self.reader = _SharedPdfReader(self.pdf_file)
+            self.decryption_key = None
+            if self.reader.is_encrypted:
+                self.decryption_key = unlock_reader(self.reader, password, decryption_key)
+            if page_count is None:
+                page_count = len(self.pages)
+        except Exception:
+            self.pdf_file.close()
+            raise
+        
+        self.total_pages = page_count
+        self.fast_extractor = FastTextExtractor()
+        self.parse_time = time.perf_counter() - start_time
+        
+        self.lock = threading.Lock()
+        self.ref_count = 1
+    
+    def object_size(self, reference):
+        """Upper bound in bytes of an indirect object stored uncompressed in the file, or None
+        
+        The bound is the distance to the next object in the xref table, so
+        it is known without reading the object.
+        """
+        offset = self.reader.xref.get(reference.generation, {}).get(reference.idnum)
+        if offset is None:
+            return None
+        
+        with self.pages_lock:
+            if self._object_offsets is None:
+                self._object_offsets = sorted(
+                    offset for objects in self.reader.xref.values() for offset in objects.values()
+                )
+        
+        index = bisect.bisect_right(self._object_offsets, offset)
+        if index < len(self._object_offsets):
+            return self._object_offsets[index] - offset
+        return os.path.getsize(self.file_path) - offset
+    
+    @property
+    def pages(self):
+        """Page objects, with the page tree flattened on first use"""
+        # One thread flattens the page tree; the others wait for it
+        with self.pages_lock:
+            if self._pages is None:
+                pages = list(self.reader.pages)
+                if self.recorded_page_count not in (None, len(pages)):
+                    raise ValueError("PDF page count differs from the recorded one")
+                self._pages = pages
+            return self._pages
+    
+    def acquire(self):
+        """Register another reader of this document"""
+        with self.lock:
+            if self.ref_count == 0:
+                raise ValueError("PDF document is closed")
+            self.ref_count += 1
+        return self
+    
+    def release(self):
+        """Unregister a reader; closes the file after the last one"""
+        with self.lock:
+            self.ref_count -= 1
+            if self.ref_count == 0:
+                self.pdf_file.close()
+    
+    def extract_text(self, page_number, engine=ENGINE_PYPDF2):
+        """Extract the text of a page; safe to call from several threads"""
+        page = self.pages[page_number]
+        if engine == ENGINE_FAST:
+            return self.fast_extractor.extract_page(page)
+        return page.extract_text()
+
+
+class PDFReader:
+    def __init__(self, engine=ENGINE_PYPDF2):
+        self.document = None
         self.pdf_file = None
         self.pdf_reader = None
+        self.engine = engine
         self.total_pages = 0
         self.current_page = 0
+        self.parse_time = 0.0
+        self.page_text_cache = None
+        # Whether page_text_cache was handed to this reader, which closes it
+        self.owns_text_cache = False
+        self.page_types = None
+        # Set when the last open_pdf failed for want of the right password
+        self.needs_password = False
+        self.lock = threading.RLock()
+    
+    def open_pdf(self, file_path, cancel_event=None, password=None, decryption_key=None,
+                 page_count=None):
+        """Open and initialize PDF file for reading
         
-    def open_pdf(self, file_path):
-        """Open and initialize PDF file for reading"""
+        If cancel_event (a threading.Event) is set while the file is being
+        parsed, the partially opened file is discarded. Encrypted files are
+        opened with the password, or with the decryption_key of another
+        reader of the same file (e.g. in worker processes), which skips
+        deriving the key again. Passing the page_count recorded for the
+        unchanged file defers reading the page tree until a page is needed,
+        e.g. never for books served from a text cache.
+        """
+        self.needs_password = False
         try:
             if not os.path.exists(file_path):
                 raise FileNotFoundError("PDF file not found")
             
-            self.pdf_file = open(file_path, 'rb')
-            self.pdf_reader = PyPDF2.PdfReader(self.pdf_file)
-            self.total_pages = len(self.pdf_reader.pages)
-            self.current_page = 0
+            document = PDFDocument(file_path, password, decryption_key, page_count)
+            
+            if cancel_event is not None and cancel_event.is_set():
+                document.release()
+                return False, "PDF loading cancelled"
+            
+            with self.lock:
+                self.close_pdf()
+                self._attach(document)
             
-            return True, f"PDF opened successfully. Total pages: {self.total_pages}"
+            if self.parse_time > SLOW_PARSE_THRESHOLD:
+                print(f"Slow PDF parse: {file_path} took {self.parse_time:.2f}s")
+            
+            return True, (f"PDF opened successfully. Total pages: {self.total_pages} "
+                          f"(parsed in {self.parse_time:.2f}s)")
+            
+        except PasswordError as e:
+            self.close_pdf()
+            self.needs_password = True
+            return False, str(e)
             
         except Exception as e:
+            self.close_pdf()
             return False, f"Error opening PDF: {str(e)}"
     
+    def _attach(self, document):
+        """Point this reader at an open document"""
+        self.document = document
+        self.pdf_file = document.pdf_file
+        self.pdf_reader = document.reader
+        self.total_pages = document.total_pages
+        self.current_page = 0
+        self.parse_time = document.parse_time
+    
+    @property
+    def decryption_key(self):
+        """File key of the open document if it is encrypted, else None
+        
+        Pass it to open_pdf of other readers of the same file so they
+        skip the password and key derivation.
+        """
+        document = self.document
+        return document.decryption_key if document is not None else None
+    
+    def share(self):
+        """Create another reader of the same parsed document
+        
+        The new reader has its own position and engine setting and can be
+        used from another thread without reopening or re-parsing the file.
+        Close it with close_pdf() when done.
+        """
+        reader = PDFReader(self.engine)
+        
+        with self.lock:
+            if self.document is not None:
+                reader._attach(self.document.acquire())
+                reader.current_page = self.current_page
+                reader.page_text_cache = self.page_text_cache
+                reader.page_types = self.page_types
+        
+        return reader
+    
+    @profiled("pdf.get_page_text")
     def get_page_text(self, page_number=None):
         """Extract text from a specific page"""
         try:
-            if self.pdf_reader is None:
+            with self.lock:
+                document = self.document
+                page_text_cache = self.page_text_cache
+                page_types = self.page_types
+            
+            if document is None:
                 return False, "No PDF file opened"
             
             if page_number is None:
                 page_number = self.current_page              
             if page_number < 0 or page_number >= self.total_pages:
                 return False, "Invalid page number"         
-            page = self.pdf_reader.pages[page_number]
-            text = page.extract_text()
+            if page_text_cache is not None:
+                return True, page_text_cache[page_number]
+            if page_types is not None and page_types[page_number] != PAGE_TEXT:
+                return True, ""
+            text = document.extract_text(page_number, self.engine)
             
             return True, text
             
         except Exception as e:
             return False, f"Error extracting text: {str(e)}"
     
+    def get_pages_text(self, page_numbers, max_workers=4):
+        """Extract several pages concurrently from the shared document
+        
+        Returns (success, texts) with texts in the order of page_numbers.
+        """
+        local = threading.local()
+        readers = []
+        readers_lock = threading.Lock()
+        
+        def extract(page_number):
+            # Each worker thread gets its own reader of the shared document
+            if not hasattr(local, 'reader'):
+                local.reader = self.share()
+                with readers_lock:
+                    readers.append(local.reader)
+            return local.reader.get_page_text(page_number)
+        
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(extract, page_numbers))
+            
+            texts = []
+            for success, text in results:
+                if not success:
+                    return False, text
+                texts.append(text)
+            
+            return True, texts
+            
+        except Exception as e:
+            return False, f"Error extracting pages: {str(e)}"
+            
+        finally:
+            for reader in readers:
+                reader.close_pdf()
+    
     def get_all_text(self):
         """Extract text from all pages"""
         try:
             if self.pdf_reader is None:
                 return False, "No PDF file```ened"
             
-            full_text = ""
-            for page_num in range(self.total_pages):
+            success, store = self.get_text_store()
+            if not success:
+                return False, store
+            
+            return True, store.get_text()
+            
+        except Exception as e:
+            return False, f"Error extracting all text: {str(e)}"
+    
+    def get_text_store(self, page_numbers=None):
+        """Collect the text of several pages (default: all) into one BookTextStore"""
+        try:
+            if self.pdf_reader is None:
+                return False, "No PDF file opened"
+            
+            # A cached store already holds every page
+            if page_numbers is None and isinstance(self.page_text_cache, BookTextStore):
+                return True, self.page_text_cache
+            
+            if page_numbers is None:
+                page_numbers = range(self.total_pages)
+            
+            page_texts = []
+            for page_num in page_numbers:
                 success, text = self.get_page_text(page_num)
-                if success:
-                    full_text += text + "\n"
-                else:
+                if not success:
                     return False, text
+                page_texts.append(text)
             
-            return True, full_text
+            return True, BookTextStore.from_pages(page_texts)
             
         except Exception as e:
-            return False, f"Error extracting all text: {str(e)}"
+            return False, f"Error collecting text: {str(e)}"
     
     def get_page_range_text(self, start_page, end_page):
         """Extract text from a range of pages"""  
@@ -87,14 +961,167 @@ class PDFReader:
         except Exception as e:
             return False, f"Error extracting text from```ge range: {str(e)}"
     
+    def set_engine(self, engine):
+        """Select the text extraction engine ("pypdf2" or "fast")"""
+        if engine not in EXTRACTION_ENGINES:
+            return False, f"Unknown extraction engine: {engine}"
+        
+        self.engine = engine
+        return True, f"Extraction engine set to {engine}"
+    
+    def classify_pages(self):
+        """Label every page as text, image-only or blank (cached per document)"""
+        try:
+            if self.pdf_reader is None:
+                return False, "No PDF file opened"
+            
+            if self.page_types is None:
+                page_types = []
+                for page in self.document.pages:
+                    try:
+                        page_types.append(classify_page(page, self.document.object_size))
+                    except Exception:
+                        page_types.append(PAGE_TEXT)
+                self.page_types = page_types
+            
+            return True, self.page_types
+            
+        except Exception as e:
+            return False, f"Error classifying pages: {str(e)}"
+    
+    def set_page_types(self, page_types):
+        """Use page labels stored from an earlier classification"""
+        if page_types is not None and len(page_types) != self.total_pages:
+            return False, "Page types do not match page count"
+        
+        self.page_types = page_types
+        return True, "Page types loaded"
+    
+    def get_text_pages(self, start_page=0, end_page=None):
+        """Split a page range into pages with text and skipped pages
+        
+        Returns (text_pages, skipped_pages) where skipped_pages lists
+        (page_number, page_type) for image-only and blank pages. Pages
+        are classified on first use if they have not been yet.
+        """
+        if self.page_types is None:
+            self.classify_pages()
+        if end_page is None:
+            end_page = self.total_pages - 1
+        
+        text_pages = []
+        skipped_pages = []
+        
+        for page_number in range(start_page, end_page + 1):
+            page_type = self.page_types[page_number] if self.page_types else PAGE_TEXT
+            if page_type == PAGE_TEXT:
+                text_pages.append(page_number)
+            else:
+                skipped_pages.append((page_number, page_type))
+        
+        return text_pages, skipped_pages
+    
+    def set_text_cache(self, page_texts, owned=True):
+        """Serve page text from previously extracted texts instead of the PDF
+        
+        The reader takes over a BookTextStore and closes it when it is
+        replaced or the PDF is closed, unless owned is False; shared readers
+        only borrow it.
+        """
+        if page_texts is not None and len(page_texts) != self.total_pages:
+            return False, "Cached text does not match page count"
+        
+        with self.lock:
+            previous = self.page_text_cache if self.owns_text_cache else None
+            self.page_text_cache = page_texts
+            self.owns_text_cache = owned and page_texts is not None
+        
+        if isinstance(previous, BookTextStore) and previous is not page_texts:
+            previous.close()
+        return True, "Text cache loaded"
+    
+    def get_metadata(self):
+        """Get document title and author"""
+        try:
+            if self.pdf_reader is None:
+                return None
+            
+            info = self.pdf_reader.metadata or {}
+            
+            return {
+                'title': str(info.get('/Title', '') or ''),
+                'author': str(info.get('/Author', '') or ''),
+                'page_count': self.total_pages
+            }
+            
+        except Exception as e:
+            print(f"Error reading metadata: {str(e)}")
+            return None
+    
+    def get_outline(self):
+        """Get the document outline as a flat list of (level, title, page) entries"""
+        try:
+            if self.pdf_reader is None:
+                return []
+            
+            entries = []
+            
+            def walk(items, level):
+                for item in items:
+                    if isinstance(item, list):
+                        walk(item, level + 1)
+                        continue
+                    try:
+                        page = self.pdf_reader.get_destination_page_number(item)
+                    except Exception:
+                        page = None
+                    entries.append((level, str(item.title), page))
+            
+            walk(self.pdf_reader.outline, 0)
+            return entries
+            
+        except Exception as e:
+            print(f"Error reading outline: {str(e)}")
+            return []
+    
+    def take_over(self, reader):
+        """Replace this reader's document with the one open in another reader
+        
+        The other reader's document, text cache and page types move here and
+        it is left closed, so a PDF can be opened in the background and
+        swapped in without disturbing this reader until then.
+        """
+        with reader.lock:
+            document = reader.document
+            state = (reader.page_text_cache, reader.owns_text_cache, reader.page_types)
+            reader._detach()
+        
+        with self.lock:
+            self.close_pdf()
+            if document is not None:
+                self._attach(document)
+                self.page_text_cache, self.owns_text_cache, self.page_types = state
+    
     def close_pdf(self):
-        """Close the PDF file"""
-        if self.pdf_file:
-            self.pdf_file.close()
-            self.pdf_file = None
-            self.pdf_reader = None
-            self.total_pages = 0
-            self.current_page = 0
+        """Close the PDF file (once no other reader shares it)"""
+        with self.lock:
+            if self.document:
+                self.document.release()
+                if self.owns_text_cache and isinstance(self.page_text_cache, BookTextStore):
+                    self.page_text_cache.close()
+                self._detach()
+    
+    def _detach(self):
+        """Forget the open document without releasing it"""
+        self.document = None
+        self.pdf_file = None
+        self.pdf_reader = None
+        self.total_pages = 0
+        self.current_page = 0
+        self.parse_time = 0.0
+        self.page_text_cache = None
+        self.owns_text_cache = False
+        self.page_types = None
     
     def __del__(self):
         """Cleanup when object is destroyed"""
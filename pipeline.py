@@ -0,0 +1,397 @@
+"""
+Pipeline Module
+Bounded-memory conversion pipeline: extract -> normalize -> synthesize ->
+encode -> write, each stage on its own thread
+
+Stages are connected by queues limited in bytes, so a producer blocks as
+soon as its consumer falls behind, and every piece of text or audio held in
+memory is charged to one MemoryBudget shared by the whole pipeline. Only the
+extraction stage waits for the budget; later stages always make progress,
+which keeps the pipeline free of deadlocks, and their queues are limited to
+shares of the budget so that memory stays within it. Converting a book of any length
+therefore runs in flat memory.
+"""
+import os
+import re
+import sys
+import threading
+import time
+import wave
+from collections import deque
+
+from profiling import profile_stage, page_boundary
+from renderer import wav_header, WAV_HEADER_SIZE, STREAMING_DATA_SIZE, COPY_BLOCK_SIZE
+
+# Memory the text and audio held by a pipeline may use
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+
+# Share of the budget each text queue and the audio queue may hold, leaving
+# room for the items stages are working on
+TEXT_QUEUE_SHARE = 1 / 8
+AUDIO_QUEUE_SHARE = 1 / 4
+# Rendered pages wait on disk; this limits the disk backlog
+RENDERED_QUEUE_BYTES = 64 * 1024 * 1024
+
+# Joins words hyphenated across a line break, and collapses runs of spaces
+HYPHENATION_PATTERN = re.compile(r'(\w)-\n(\w)')
+SPACE_PATTERN = re.compile(r'[ \t\f\v]+')
+
+
+def normalize_text(text):
+    """Tidy extracted text for speech, keeping line and paragraph breaks"""
+    text = HYPHENATION_PATTERN.sub(r'\1\2', text)
+    return SPACE_PATTERN.sub(" ", text).strip()
+
+
+class MemoryBudget:
+    def __init__(self, limit):
+        """Bytes of memory shared by all stages of a pipeline
+        
+        A single item larger than the whole budget is still admitted when
+        nothing else is held, so oversized pages slow the pipeline down
+        instead of stopping it.
+        """
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self.closed = False
+        self.condition = threading.Condition()
+    
+    def acquire(self, size, wait=True):
+        """Charge size bytes, first waiting for room if wait is set
+        
+        Returns False if the budget was closed.
+        """
+        with self.condition:
+            if wait:
+                self.condition.wait_for(
+                    lambda: self.closed or self.used == 0 or self.used + size <= self.limit
+                )
+            if self.closed:
+                return False
+            
+            self.used += size
+            self.peak = max(self.peak, self.used)
+            return True
+    
+    def release(self, size):
+        with self.condition:
+            self.used -= size
+            self.condition.notify_all()
+    
+    def close(self):
+        """Wake up and refuse everyone waiting, e.g. when the pipeline fails"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class ByteQueue:
+    def __init__(self, max_bytes, budget=None):
+        """FIFO queue holding at most max_bytes of items
+        
+        Items are put with their size in bytes; put blocks while the queue
+        is full. A single item larger than max_bytes fits into an empty
+        queue. With a budget, the size of every item is charged to it when
+        put; the consumer releases the charge once it is done with the item.
+        """
+        self.max_bytes = max_bytes
+        self.budget = budget
+        self.items = deque()
+        self.size = 0
+        self.closed = False
+        self.condition = threading.Condition()
+    
+    def put(self, item, size, wait_for_budget=False):
+        """Append an item, blocking while the queue is full
+        
+        Returns False if the queue was closed.
+        """
+        if self.budget is not None and not self.budget.acquire(size, wait_for_budget):
+            return False
+        
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.closed or not self.items or self.size + size <= self.max_bytes
+            )
+            if self.closed:
+                if self.budget is not None:
+                    self.budget.release(size)
+                return False
+            
+            self.items.append((item, size))
+            self.size += size
+            self.condition.notify_all()
+            return True
+    
+    def get(self):
+        """Remove and return (item, size), or None once the queue is closed"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.closed or self.items)
+            if self.closed:
+                return None
+            
+            item, size = self.items.popleft()
+            self.size -= size
+            self.condition.notify_all()
+            return item, size
+    
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class ConversionPipeline:
+    def __init__(self, page_source, page_numbers, output_path, audio_converter,
+                 memory_budget=DEFAULT_MEMORY_BUDGET, progress_callback=None, cancel_event=None):
+        """Convert pages to one WAV file with bounded memory
+        
+        page_source is a callable taking a page number and returning
+        (success, text), such as PDFReader.get_page_text. The TTS engine of
+        audio_converter is used only by the synthesis stage.
+        progress_callback, if given, is called with (pages done, total pages)
+        from the writing stage.
+        """
+        self.page_source = page_source
+        self.page_numbers = list(page_numbers)
+        self.output_path = output_path
+        self.audio_converter = audio_converter
+        self.progress_callback = progress_callback
+        self.cancel_event = cancel_event
+        
+        self.budget = MemoryBudget(memory_budget)
+        self.extracted = ByteQueue(int(memory_budget * TEXT_QUEUE_SHARE), self.budget)
+        self.normalized = ByteQueue(int(memory_budget * TEXT_QUEUE_SHARE), self.budget)
+        # Holds paths of rendered page files, sized by their length on disk
+        self.rendered = ByteQueue(RENDERED_QUEUE_BYTES)
+        self.encoded = ByteQueue(int(memory_budget * AUDIO_QUEUE_SHARE), self.budget)
+        self.queues = (self.extracted, self.normalized, self.rendered, self.encoded)
+        
+        self.error = None
+        self.error_lock = threading.Lock()
+        self.stats = {
+            'pages': 0,
+            'characters': 0,
+            'words': 0,
+            'extract_seconds': 0.0,
+            'synthesis_seconds': 0.0
+        }
+    
+    def fail(self, message):
+        """Record the first error and unblock every stage"""
+        with self.error_lock:
+            if self.error is None:
+                self.error = message
+        self.budget.close()
+        for stage_queue in self.queues:
+            stage_queue.close()
+    
+    def _cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            self.fail("Conversion cancelled")
+            return True
+        return False
+    
+    def _run_stage(self, name, stage):
+        try:
+            with profile_stage(name):
+                stage()
+        except Exception as e:
+            self.fail(f"Error in {name} stage: {str(e)}")
+    
+    def _extract(self):
+        """Read page texts, waiting for the memory budget before each one"""
+        for page_number in self.page_numbers:
+            if self._cancelled():
+                return
+            
+            start = time.perf_counter()
+            success, text = self.page_source(page_number)
+            self.stats['extract_seconds'] += time.perf_counter() - start
+            if not success:
+                self.fail(text)
+                return
+            
+            if not self.extracted.put((page_number, text), sys.getsizeof(text), wait_for_budget=True):
+                return
+        self.extracted.put(None, 0)
+    
+    def _normalize(self):
+        while True:
+            entry = self.extracted.get()
+            if entry is None:
+                return
+            item, size = entry
+            if item is None:
+                self.normalized.put(None, 0)
+                return
+            
+            page_number, text = item
+            text = normalize_text(text)
+            self.budget.release(size)
+            if not self.normalized.put((page_number, text), sys.getsizeof(text)):
+                return
+    
+    def _synthesize(self):
+        """Render each page to a file next to the output"""
+        while True:
+            entry = self.normalized.get()
+            if entry is None:
+                return
+            item, size = entry
+            if item is None:
+                self.rendered.put(None, 0)
+                return
+            
+            page_number, text = item
+            page_path = None
+            if text:
+                page_path = f"{self.output_path}.page_{page_number:05d}.part.wav"
+                start = time.perf_counter()
+                success, message = self.audio_converter.save_to_audio_file(text, page_path)
+                self.stats['synthesis_seconds'] += time.perf_counter() - start
+                if not success:
+                    self.budget.release(size)
+                    self.fail(message)
+                    return
+                
+                self.stats['characters'] += len(text)
+                self.stats['words'] += len(text.split())
+            
+            self.budget.release(size)
+            file_size = os.path.getsize(page_path) if page_path else 0
+            if not self.rendered.put((page_number, page_path), file_size):
+                if page_path:
+                    os.remove(page_path)
+                return
+    
+    def _encode(self):
+        """Turn rendered page files into blocks of PCM audio in one format"""
+        params = None
+        while True:
+            entry = self.rendered.get()
+            if entry is None:
+                return
+            item, _ = entry
+            if item is None:
+                self.encoded.put(None, 0)
+                return
+            
+            page_number, page_path = item
+            if page_path is None:
+                # A page without speakable text is done right away
+                if not self.encoded.put(('page', page_number), 0):
+                    return
+                continue
+            
+            try:
+                with wave.open(page_path, 'rb') as page:
+                    page_params = (page.getnchannels(), page.getsampwidth(), page.getframerate())
+                    if params is None:
+                        params = page_params
+                        if not self.encoded.put(('params', params), 0):
+                            return
+                    elif page_params != params:
+                        raise ValueError("Pages were rendered in different audio formats")
+                    
+                    block_size = min(COPY_BLOCK_SIZE, self.encoded.max_bytes // 4)
+                    frames_per_block = max(1, block_size // (params[0] * params[1]))
+                    while True:
+                        block = page.readframes(frames_per_block)
+                        if not block:
+                            break
+                        if not self.encoded.put(('audio', block), len(block)):
+                            return
+            finally:
+                os.remove(page_path)
+            
+            if not self.encoded.put(('page', page_number), 0):
+                return
+    
+    def _write(self, output):
+        """Append audio blocks to the output; returns (params, data size)"""
+        params = None
+        data_size = 0
+        pages_done = 0
+        
+        while True:
+            entry = self.encoded.get()
+            if entry is None or self._cancelled():
+                return None, 0
+            item, size = entry
+            if item is None:
+                return params, data_size
+            
+            kind, value = item
+            if kind == 'params':
+                params = value
+            elif kind == 'audio':
+                # The largest size a WAV header can describe
+                if data_size + size > STREAMING_DATA_SIZE:
+                    self.fail("Audio exceeds the 4 GB size limit of WAV files")
+                    return None, 0
+                output.write(value)
+                data_size += size
+                self.budget.release(size)
+            else:
+                pages_done += 1
+                page_boundary(f"page {value + 1}")
+                if self.progress_callback is not None:
+                    self.progress_callback(pages_done, len(self.page_numbers))
+    
+    def run(self):
+        """Run all stages; returns (success, stats or message)"""
+        stages = [
+            threading.Thread(target=self._run_stage, args=(name, stage), daemon=True)
+            for name, stage in (("extract", self._extract), ("normalize", self._normalize),
+                                ("synthesize", self._synthesize), ("encode", self._encode))
+        ]
+        for stage in stages:
+            stage.start()
+        
+        temp_path = self.output_path + ".tmp"
+        try:
+            with open(temp_path, 'wb') as output:
+                # The header is written once the sizes are known
+                output.write(b"\0" * WAV_HEADER_SIZE)
+                with profile_stage("write"):
+                    params, data_size = self._write(output)
+                if params is not None:
+                    output.seek(0)
+                    output.write(wav_header(*params, data_size))
+            
+            if self.error is None and params is None:
+                self.fail("No text to convert")
+            if self.error is not None:
+                return False, self.error
+            
+            os.replace(temp_path, self.output_path)
+            self.stats['pages'] = len(self.page_numbers)
+            self.stats['audio_params'] = params
+            self.stats['data_size'] = data_size
+            self.stats['peak_bytes'] = self.budget.peak
+            return True, self.stats
+            
+        except Exception as e:
+            self.fail(f"Error writing audio: {str(e)}")
+            return False, self.error
+            
+        finally:
+            for stage in stages:
+                stage.join()
+            
+            # Pages rendered but never encoded after a failure
+            for item, _ in self.rendered.items:
+                if item is not None and item[1] is not None and os.path.exists(item[1]):
+                    os.remove(item[1])
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def convert_pages(page_source, page_numbers, output_path, audio_converter,
+                  memory_budget=DEFAULT_MEMORY_BUDGET, progress_callback=None, cancel_event=None):
+    """Convert pages to one WAV file with bounded memory; returns (success, stats or message)"""
+    pipeline = ConversionPipeline(page_source, page_numbers, output_path, audio_converter,
+                                  memory_budget, progress_callback, cancel_event)
+    return pipeline.run()
@@ -0,0 +1,35 @@
+"""
+Process Utilities Module
+Measures memory of the machine and of individual processes, preferring
+/proc and sysconf and falling back to psutil when it is installed
+"""
+import os
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def get_physical_memory():
+    """Total physical memory in bytes, or None if unknown"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return psutil.virtual_memory().total if psutil is not None else None
+
+
+def get_rss(pid):
+    """Resident memory of a process in bytes, or None if unavailable"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            pass
+    return None
@@ -0,0 +1,359 @@
+"""
+Profiling Module
+Opt-in profiling of conversion runs: per-stage cProfile or statistical
+sampling, tracemalloc snapshots at page boundaries and timers around hot
+functions, written as a report per job
+
+Hot functions are decorated with @profiled(name). While no Profiler is
+running the decorator costs one global lookup per call, so profiling can
+stay compiled in. One profiled run per process at a time.
+"""
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+# Set to "cprofile" (or "1") or "sample" to profile runs that do not ask for it
+PROFILE_ENV = "AUDIOBOOK_PROFILE"
+MODE_CPROFILE = "cprofile"
+MODE_SAMPLE = "sample"
+PROFILE_MODES = (MODE_CPROFILE, MODE_SAMPLE)
+
+# Seconds between stack samples in sampling mode
+SAMPLE_INTERVAL = 0.005
+
+# Entries listed per section of the report
+REPORT_LIMIT = 25
+
+# Frames kept per tracemalloc allocation
+TRACE_FRAMES = 5
+
+REPORT_FILE = "report.txt"
+SUMMARY_FILE = "summary.json"
+
+# Reports of runs writing an output file go next to it, in a directory with this suffix
+PROFILE_DIR_SUFFIX = ".profile"
+
+# The running Profiler, if any
+_active_profiler = None
+
+
+def get_profile_mode(requested=None):
+    """Profiling mode to use: the requested one, else the environment's, else None"""
+    mode = requested if requested is not None else os.environ.get(PROFILE_ENV)
+    if not mode or mode == "0":
+        return None
+    if mode in ("1", "true", "yes"):
+        return MODE_CPROFILE
+    return mode if mode in PROFILE_MODES else None
+
+
+def get_profile_dir(output_path):
+    """Report directory of a profiled run writing output_path"""
+    return output_path + PROFILE_DIR_SUFFIX
+
+
+@contextmanager
+def profile_run(report_dir, requested=None):
+    """Profile the enclosed run if asked to or enabled by the environment
+    
+    Yields the running Profiler, or None when the run is not profiled. The
+    report is written to report_dir when the run ends. A run started while
+    another is being profiled goes unprofiled.
+    """
+    mode = get_profile_mode(requested)
+    if mode is None:
+        yield None
+        return
+    
+    profiler = Profiler(report_dir, mode)
+    try:
+        profiler.start()
+    except RuntimeError as e:
+        print(f"Run not profiled: {str(e)}")
+        yield None
+        return
+    
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        profiler.write_report()
+
+
+def profiled(name):
+    """Decorator timing every call of a function while a Profiler is running"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profiler = _active_profiler
+            if profiler is None:
+                return function(*args, **kwargs)
+            
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.add_time(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def profile_stage(name):
+    """Profile the calling thread as a pipeline stage if a Profiler is running"""
+    profiler = _active_profiler
+    if profiler is None:
+        yield
+        return
+    
+    with profiler.stage(name):
+        yield
+
+
+def record_time(name, seconds):
+    """Add a call measured elsewhere, e.g. in a worker process, to a hot-path timer"""
+    profiler = _active_profiler
+    if profiler is not None:
+        profiler.add_time(name, seconds)
+
+
+def page_boundary(label):
+    """Record memory use at a page boundary if a Profiler is running"""
+    profiler = _active_profiler
+    if profiler is not None:
+        profiler.snapshot(label)
+
+
+class Profiler:
+    def __init__(self, report_dir, mode=MODE_CPROFILE, trace_memory=True):
+        """Collect profiling data for one run and write it to report_dir"""
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        
+        self.report_dir = report_dir
+        self.mode = mode
+        self.trace_memory = trace_memory
+        self.lock = threading.Lock()
+        
+        # name -> [calls, total seconds, longest call]
+        self.timers = {}
+        # stage -> pstats.Stats (cProfile mode)
+        self.stage_stats = {}
+        # stage -> Counter of functions on the sampled stacks (sampling mode)
+        self.stage_samples = {}
+        self.stage_threads = {}
+        # (label, traced bytes, peak traced bytes) per page boundary
+        self.memory_marks = []
+        self.first_snapshot = None
+        self.last_snapshot = None
+        self.notes = []
+        
+        self.started_tracing = False
+        self.sampler = None
+        self.stop_event = threading.Event()
+        self.started_at = None
+        self.wall_seconds = None
+    
+    def start(self):
+        global _active_profiler
+        if _active_profiler is not None:
+            raise RuntimeError("Another run is already being profiled")
+        
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+            self.started_tracing = True
+        
+        if self.mode == MODE_SAMPLE:
+            self.sampler = threading.Thread(target=self._sample, daemon=True)
+            self.sampler.start()
+        
+        self.started_at = time.perf_counter()
+        _active_profiler = self
+    
+    def stop(self):
+        global _active_profiler
+        if _active_profiler is self:
+            _active_profiler = None
+        self.wall_seconds = time.perf_counter() - self.started_at
+        
+        self.stop_event.set()
+        if self.sampler is not None:
+            self.sampler.join()
+        
+        if self.trace_memory and tracemalloc.is_tracing():
+            self.snapshot("end")
+            self.last_snapshot = tracemalloc.take_snapshot()
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+    
+    def __enter__(self):
+        self.start()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+    
+    def add_time(self, name, seconds):
+        with self.lock:
+            timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+    
+    @contextmanager
+    def stage(self, name):
+        """Profile the calling thread under a stage name"""
+        if self.mode == MODE_SAMPLE:
+            thread_id = threading.get_ident()
+            with self.lock:
+                self.stage_threads[thread_id] = name
+            try:
+                yield
+            finally:
+                with self.lock:
+                    self.stage_threads.pop(thread_id, None)
+            return
+        
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Only one cProfile can be active at a time on some Python versions
+            self.notes.append(f"Stage {name} not profiled: {str(e)}")
+            profile = None
+        
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                with self.lock:
+                    if name in self.stage_stats:
+                        self.stage_stats[name].add(profile)
+                    else:
+                        self.stage_stats[name] = pstats.Stats(profile)
+    
+    def _sample(self):
+        """Sampling thread: count the functions on each stage's stack"""
+        while not self.stop_event.wait(SAMPLE_INTERVAL):
+            frames = sys._current_frames()
+            with self.lock:
+                stages = list(self.stage_threads.items())
+            
+            for thread_id, name in stages:
+                frame = frames.get(thread_id)
+                seen = set()
+                counter = self.stage_samples.setdefault(name, Counter())
+                while frame is not None:
+                    code = frame.f_code
+                    key = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                    # Count each function once per sample, even when recursive
+                    if key not in seen:
+                        counter[key] += 1
+                        seen.add(key)
+                    frame = frame.f_back
+                counter["<samples>"] += 1
+    
+    def snapshot(self, label):
+        """Record traced memory at a page boundary
+        
+        Only the first boundary takes a full snapshot, to compare with the
+        one taken when the run stops; later boundaries just read the totals.
+        """
+        if not tracemalloc.is_tracing():
+            return
+        
+        current, peak = tracemalloc.get_traced_memory()
+        with self.lock:
+            self.memory_marks.append((label, current, peak))
+            first = self.first_snapshot is None
+        
+        if first:
+            snapshot = tracemalloc.take_snapshot()
+            with self.lock:
+                if self.first_snapshot is None:
+                    self.first_snapshot = snapshot
+    
+    def summary(self):
+        """Timers and memory figures as a JSON-serializable dict"""
+        with self.lock:
+            timers = {
+                name: {'calls': calls, 'total_seconds': round(total, 6),
+                       'mean_seconds': round(total / calls, 6), 'max_seconds': round(longest, 6)}
+                for name, (calls, total, longest) in self.timers.items()
+            }
+            peaks = [peak for _, _, peak in self.memory_marks]
+        
+        return {
+            'mode': self.mode,
+            'wall_seconds': round(self.wall_seconds, 3) if self.wall_seconds is not None else None,
+            'timers': timers,
+            'stages': sorted(set(self.stage_stats) | set(self.stage_samples)),
+            'peak_traced_bytes': max(peaks) if peaks else None,
+            'page_boundaries': len(self.memory_marks),
+            'notes': self.notes
+        }
+    
+    def write_report(self):
+        """Write report.txt, summary.json and one .prof file per stage
+        
+        Returns (success, path of the report or message).
+        """
+        try:
+            os.makedirs(self.report_dir, exist_ok=True)
+            summary = self.summary()
+            lines = [f"Profile ({self.mode}), {summary['wall_seconds']}s wall time", ""]
+            
+            lines.append("Hot-path timers")
+            for name, timer in sorted(summary['timers'].items(), key=lambda item: -item[1]['total_seconds']):
+                lines.append(f"  {name}: {timer['calls']} calls, {timer['total_seconds']:.3f}s total, "
+                             f"{timer['mean_seconds'] * 1000:.2f}ms mean, {timer['max_seconds'] * 1000:.2f}ms max")
+            
+            for name, stats in sorted(self.stage_stats.items()):
+                stats.dump_stats(os.path.join(self.report_dir, f"{name}.prof"))
+                stream = io.StringIO()
+                stats.stream = stream
+                stats.sort_stats("cumulative").print_stats(REPORT_LIMIT)
+                lines += ["", f"Stage {name} (cProfile, by cumulative time)", stream.getvalue().strip()]
+            
+            for name, counter in sorted(self.stage_samples.items()):
+                total = counter.pop("<samples>", 0) or 1
+                lines += ["", f"Stage {name} ({total} samples, share of samples on the stack)"]
+                for key, count in counter.most_common(REPORT_LIMIT):
+                    lines.append(f"  {count / total:6.1%}  {key}")
+            
+            if self.memory_marks:
+                lines += ["", "Traced memory at page boundaries"]
+                step = max(1, len(self.memory_marks) // REPORT_LIMIT)
+                for label, current, peak in self.memory_marks[::step]:
+                    lines.append(f"  {label}: {current / 1024:.0f} KB, peak {peak / 1024:.0f} KB")
+            
+            if self.first_snapshot is not None and self.last_snapshot is not None:
+                lines += ["", "Largest memory growth between the first boundary and the end"]
+                for stat in self.last_snapshot.compare_to(self.first_snapshot, "lineno")[:REPORT_LIMIT]:
+                    lines.append(f"  {stat}")
+            
+            for note in self.notes:
+                lines.append(f"Note: {note}")
+            
+            report_path = os.path.join(self.report_dir, REPORT_FILE)
+            with open(report_path, 'w') as f:
+                f.write("\n".join(lines) + "\n")
+            with open(os.path.join(self.report_dir, SUMMARY_FILE), 'w') as f:
+                json.dump(summary, f, indent=2)
+            
+            return True, report_path
+            
+        except Exception as e:
+            return False, f"Error writing profile report: {str(e)}"
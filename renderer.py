@@ -0,0 +1,636 @@
+"""
+Renderer Module
+Chunked synthesis pipeline that renders a book page by page into cached WAV
+chunks and exposes them as one progressively growing WAV stream
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import wave
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from audio_converter import AudioConverter, get_default_backend
+from cache_utils import get_cache_dir
+from duration_estimator import DurationEstimator, plan_work
+from profiling import profile_run, profile_stage, page_boundary, record_time, get_profile_dir
+from sync_map import SyncMap, get_sync_map_path, write_webvtt, write_srt
+
+# Size of the canonical RIFF/WAVE header written in front of the stream
+WAV_HEADER_SIZE = 44
+
+# Data size announced while the length of the stream is still unknown
+STREAMING_DATA_SIZE = 0xFFFFFFFF - 36
+
+COPY_BLOCK_SIZE = 1024 * 1024
+
+# Export manifests record which text each stretch of an exported file holds
+MANIFEST_SUFFIX = ".manifest.json"
+
+# Subtitle formats export_parallel can write next to the audio
+SUBTITLE_WRITERS = {'vtt': write_webvtt, 'srt': write_srt}
+
+# Worker processes used by export_parallel unless told otherwise
+DEFAULT_EXPORT_WORKERS = min(4, os.cpu_count() or 1)
+
+# The AudioConverter owned by each export worker process
+_export_converter = None
+
+
+def wav_header(channels, sample_width, frame_rate, data_size=STREAMING_DATA_SIZE):
+    """Build a PCM WAV header for data_size bytes of audio"""
+    block_align = channels * sample_width
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', data_size + 36, b'WAVE',
+        b'fmt ', 16, 1, channels, frame_rate, frame_rate * block_align,
+        block_align, sample_width * 8,
+        b'data', data_size
+    )
+
+
+def read_wav_layout(path):
+    """Get ((channels, sample width, frame rate), data offset, data size) of a WAV file"""
+    with open(path, 'rb') as f:
+        with wave.open(f) as wav:
+            params = (wav.getnchannels(), wav.getsampwidth(), wav.getframerate())
+            # wave stops right after the data chunk header
+            data_offset = f.tell()
+            data_size = wav.getnframes() * wav.getnchannels() * wav.getsampwidth()
+    
+    return params, data_offset, data_size
+
+
+def assemble_wav(segments, params, output_path):
+    """Write a WAV file from (path, offset, size) ranges of PCM data in other files
+    
+    The output may replace one of the source files; it is written to a
+    temporary file first.
+    """
+    temp_path = output_path + ".tmp"
+    with open(temp_path, 'wb') as output:
+        output.write(wav_header(*params, sum(size for _, _, size in segments)))
+        
+        for path, offset, size in segments:
+            with open(path, 'rb') as source:
+                source.seek(offset)
+                remaining = size
+                while remaining > 0:
+                    block = source.read(min(COPY_BLOCK_SIZE, remaining))
+                    if not block:
+                        raise ValueError(f"Audio segment in {path} is truncated")
+                    output.write(block)
+                    remaining -= len(block)
+    
+    os.replace(temp_path, output_path)
+
+
+def concatenate_wav(chunk_paths, output_path):
+    """Join WAV chunks of the same audio format into one WAV file"""
+    layouts = [read_wav_layout(path) for path in chunk_paths]
+    if not layouts:
+        raise ValueError("No audio chunks to join")
+    
+    params = layouts[0][0]
+    if any(layout[0] != params for layout in layouts):
+        raise ValueError("Audio chunks use different formats")
+    
+    assemble_wav([(path, data_offset, data_size)
+                  for path, (_, data_offset, data_size) in zip(chunk_paths, layouts)],
+                 params, output_path)
+
+
+def text_hash(text):
+    """Content hash identifying the text of a chunk"""
+    return hashlib.sha256(text.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def render_id(document_id, settings):
+    """Id of a document rendered with settings, so audio in other voices or rates is kept apart"""
+    key = document_id + json.dumps(settings, sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+def get_manifest_path(output_path):
+    """Path of the export manifest kept next to an exported audio file"""
+    return output_path + MANIFEST_SUFFIX
+
+
+def export_settings(backend, rate, voice_id, marked):
+    """Everything besides the text that decides a chunk's audio and marks
+    
+    Marked exports synthesize sentence by sentence, so their audio differs
+    from chunk by chunk synthesis as well as carrying marks.
+    """
+    return {'backend': backend, 'rate': rate, 'voice': voice_id,
+            'segmentation': "sentences" if marked else "chunks"}
+
+
+def load_reusable_segments(output_path, settings):
+    """Map chunk text hashes to (offset, size, marks) audio in a previous export
+    
+    marks are the chunk's sentence marks, or None if the export had none.
+    
+    Returns ({}, None) unless the file was exported with the same settings
+    (see export_settings) and is unchanged since its manifest was written.
+    """
+    try:
+        with open(get_manifest_path(output_path)) as f:
+            manifest = json.load(f)
+        
+        if manifest.get('settings') != settings:
+            return {}, None
+        if os.path.getsize(output_path) != manifest['file_size']:
+            return {}, None
+        
+        segments = {chunk['hash']: (chunk['offset'], chunk['size'], chunk.get('marks'))
+                    for chunk in manifest['chunks']}
+        return segments, tuple(manifest['audio_params'])
+        
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}, None
+
+
+def init_export_worker(backend, rate, voice_id):
+    """Create the export worker's TTS engine with the exporting voice settings"""
+    global _export_converter
+    _export_converter = AudioConverter(backend)
+    _export_converter.set_voice_rate(rate)
+    if voice_id is not None and _export_converter.engine is not None:
+        _export_converter.engine.setProperty('voice', voice_id)
+
+
+def render_part(text, chunk_path):
+    """Render one piece of text in an export worker; returns (success, message, seconds)"""
+    start = time.perf_counter()
+    success, message = _export_converter.save_to_audio_file(text, chunk_path)
+    return success, message, time.perf_counter() - start
+
+
+def render_marked_part(text, chunk_path):
+    """Render one piece of text with sentence marks; returns (success, message, seconds, marks)"""
+    start = time.perf_counter()
+    success, message, marks = _export_converter.save_with_sentence_marks(text, chunk_path)
+    return success, message, time.perf_counter() - start, marks
+
+
+def _render_fixed(render, items, work_dir, workers, initargs):
+    """Render planned items on a fixed pool; yields (item, result, workers) as they finish"""
+    # Workers are spawned, not forked: exports start from GUI threads, and a
+    # child forked while other threads hold locks can deadlock
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_export_worker, initargs=initargs,
+                             mp_context=multiprocessing.get_context("spawn")) as executor:
+        # The executor hands out work in submission order: longest first
+        futures = {}
+        for number, (index, part, text, seconds) in enumerate(items):
+            part_path = os.path.join(work_dir, f"part_{number:05d}.wav")
+            future = executor.submit(render, text, part_path)
+            futures[future] = (index, part, text, seconds, part_path)
+        
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result(), workers
+        finally:
+            for other in futures:
+                other.cancel()
+
+
+def _render_autoscaled(render, items, work_dir, max_workers, initargs, autoscaler):
+    """Render planned items on a pool the autoscaler sizes; yields like _render_fixed"""
+    # autoscale builds on this module, so it is imported on first use
+    from autoscale import ScalablePool
+    
+    pool = ScalablePool("synthesize", render, init_export_worker, initargs,
+                        max_workers=max_workers)
+    autoscaler.add(pool)
+    try:
+        planned = {}
+        for number, (index, part, text, seconds) in enumerate(items):
+            part_path = os.path.join(work_dir, f"part_{number:05d}.wav")
+            planned[number] = (index, part, text, seconds, part_path)
+            pool.submit(number, text, part_path)
+        
+        while pool.pending:
+            result = pool.get_result(timeout=0.05)
+            autoscaler.maybe_scale()
+            if result is None:
+                continue
+            
+            number, success, value = result
+            if not success:
+                raise RuntimeError(value)
+            yield planned[number], value, pool.size
+        
+    finally:
+        autoscaler.remove(pool)
+        pool.shutdown()
+
+
+def export_parallel(chunks, output_path, max_workers=DEFAULT_EXPORT_WORKERS, backend=None,
+                    rate=150, voice_id=None, estimator=None, progress_callback=None,
+                    cancel_event=None, incremental=False, sync_map=False, subtitles=None,
+                    autoscaler=None, profile=None):
+    """Render text chunks on several worker processes and join them in order
+    
+    chunks is a list of (key, text) in reading order, e.g. (page, text).
+    Work is scheduled longest-first, with oversized chunks split, and
+    every measured render calibrates the duration estimator. If given,
+    progress_callback is called with the estimated seconds remaining.
+    
+    A manifest of per-chunk text hashes and audio locations is written
+    next to the output. With incremental=True, chunks whose text is
+    unchanged since the previous export to the same file are copied from
+    it and only changed or new chunks are synthesized.
+    
+    With sync_map=True a SyncMap of where each page, paragraph and sentence
+    starts is saved next to the output; chunk keys must then be page
+    numbers. subtitles may be 'vtt' or 'srt' to also write sentence
+    subtitles with the output's name. Both come from the same rendering
+    pass, which then synthesizes sentence by sentence.
+    
+    Given an autoscale.Autoscaler, the synthesis pool starts with one
+    worker and the autoscaler grows or shrinks it up to max_workers.
+    
+    profile may be a profiling mode to profile the export, which the
+    AUDIOBOOK_PROFILE environment variable otherwise decides, or False
+    to not start a profiled run; the report is written next to the output.
+    """
+    if backend is None:
+        backend = get_default_backend()
+    if estimator is None:
+        estimator = DurationEstimator(backend)
+    
+    chunks = [(key, text) for key, text in chunks if text.strip()]
+    if not chunks:
+        return False, "No text to export"
+    
+    if subtitles is not None and subtitles not in SUBTITLE_WRITERS:
+        return False, f"Unknown subtitle format: {subtitles}"
+    marked = sync_map or subtitles is not None
+    
+    settings = export_settings(backend, rate, voice_id, marked)
+    hashes = [text_hash(text) for _, text in chunks]
+    
+    reusable, params = {}, None
+    if incremental:
+        reusable, params = load_reusable_segments(output_path, settings)
+    
+    # The parent process only plans, waits and assembles; workers report their render times
+    with profile_run(get_profile_dir(output_path), profile), profile_stage("export"):
+        work_dir = tempfile.mkdtemp(dir=get_cache_dir("export"))
+        try:
+            pending = [(index, text) for index, (chunk_hash, (_, text)) in enumerate(zip(hashes, chunks))
+                       if chunk_hash not in reusable]
+            # Parts rendered for each chunk index, as (part, segment, marks, text length)
+            rendered = {index: [] for index, _ in pending}
+            
+            if pending:
+                items = plan_work(pending, max_workers, lambda text: estimator.estimate_synthesis_seconds(text, rate))
+                remaining = sum(item[3] for item in items)
+                workers = min(max_workers, len(items))
+                
+                render = render_marked_part if marked else render_part
+                initargs = (backend, rate, voice_id)
+                if autoscaler is None:
+                    results = _render_fixed(render, items, work_dir, workers, initargs)
+                else:
+                    results = _render_autoscaled(render, items, work_dir, max_workers, initargs, autoscaler)
+                
+                try:
+                    for (index, part, text, seconds, part_path), result, workers in results:
+                        success, message, synthesis_seconds, *marks = result
+                        
+                        if not success or (cancel_event is not None and cancel_event.is_set()):
+                            return False, message if not success else "Export cancelled"
+                        
+                        part_params, data_offset, data_size = read_wav_layout(part_path)
+                        if params is None:
+                            params = part_params
+                        elif part_params != params:
+                            raise ValueError("Rendered audio does not match the format of the previous export")
+                        
+                        audio_seconds = data_size / (params[0] * params[1] * params[2])
+                        estimator.record(text, rate, audio_seconds, synthesis_seconds)
+                        
+                        rendered[index].append((part, (part_path, data_offset, data_size),
+                                                marks[0] if marks else None, len(text)))
+                        record_time("tts.save_to_audio_file", synthesis_seconds)
+                        page_boundary(f"part of chunk {index + 1}")
+                        remaining -= seconds
+                        if progress_callback is not None:
+                            progress_callback(max(0.0, remaining) / workers)
+                finally:
+                    results.close()
+            
+            # Reassemble in reading order from reused and new segments
+            segments = []
+            manifest_chunks = []
+            position = WAV_HEADER_SIZE
+            block_align = params[0] * params[1]
+            text_map = SyncMap(params) if marked else None
+            
+            for index, ((key, text), chunk_hash) in enumerate(zip(chunks, hashes)):
+                chunk_marks = [] if marked else None
+                if index in rendered:
+                    chunk_segments = []
+                    char_base = frame_base = 0
+                    for _, segment, marks, length in sorted(rendered[index]):
+                        chunk_segments.append(segment)
+                        if marked:
+                            # Part marks are relative to the part; make them relative to the chunk
+                            chunk_marks.extend((char_base + char, frame_base + frame) for char, frame in marks)
+                        char_base += length
+                        frame_base += segment[2] // block_align
+                else:
+                    # The previous export stays in place until the new one replaces it
+                    offset, size, chunk_marks = reusable[chunk_hash]
+                    chunk_segments = [(output_path, offset, size)]
+                
+                size = sum(segment[2] for segment in chunk_segments)
+                segments.extend(chunk_segments)
+                manifest_chunk = {'key': key, 'hash': chunk_hash, 'offset': position, 'size': size}
+                if chunk_marks is not None:
+                    manifest_chunk['marks'] = chunk_marks
+                manifest_chunks.append(manifest_chunk)
+                
+                if marked:
+                    text_map.add_page(key, text, chunk_marks, (position - WAV_HEADER_SIZE) // block_align)
+                position += size
+            
+            assemble_wav(segments, params, output_path)
+            
+            if sync_map:
+                success, message = text_map.save(get_sync_map_path(output_path))
+                if not success:
+                    return False, message
+            if subtitles is not None:
+                cues = text_map.cues(dict(chunks), (position - WAV_HEADER_SIZE) // block_align)
+                SUBTITLE_WRITERS[subtitles](cues, os.path.splitext(output_path)[0] + "." + subtitles)
+            
+            manifest_path = get_manifest_path(output_path)
+            with open(manifest_path + ".tmp", 'w') as f:
+                json.dump({
+                    'settings': settings,
+                    'audio_params': list(params),
+                    'file_size': position,
+                    'chunks': manifest_chunks
+                }, f)
+            os.replace(manifest_path + ".tmp", manifest_path)
+            estimator.save()
+            
+            message = f"Audio saved to {output_path}"
+            if incremental:
+                message += f" (re-rendered {len(pending)} of {len(chunks)} pages)"
+            return True, message
+            
+        except Exception as e:
+            return False, f"Error exporting audio: {str(e)}"
+            
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+class RenderJob:
+    def __init__(self, job_id, page_source, page_numbers, synthesize, chunk_dir,
+                 synthesis_lock=None, on_finished=None):
+        """Render pages of a book into WAV chunks on a background thread
+        
+        page_source is a callable taking a 0-based page number and returning
+        (success, text), such as PDFReader.get_page_text. page_numbers may
+        also be a callable returning them, called on the render thread
+        when finding the pages is itself slow. synthesize is a
+        callable (text, filename) -> (success, message), such as
+        AudioConverter.save_to_audio_file; calls are serialized with
+        synthesis_lock when one is given.
+        """
+        self.job_id = job_id
+        self.page_source = page_source
+        # Known once the render thread has listed the pages
+        self.page_numbers = None if callable(page_numbers) else list(page_numbers)
+        self.find_page_numbers = page_numbers if callable(page_numbers) else None
+        self.synthesize = synthesize
+        self.chunk_dir = chunk_dir
+        self.synthesis_lock = synthesis_lock
+        self.on_finished = on_finished
+        
+        # (page number, path, data offset in file, data size) per rendered chunk
+        self.chunks = []
+        # Stream offset where each chunk's audio starts
+        self.chunk_starts = []
+        self.audio_params = None
+        self.data_size = 0
+        self.done = False
+        self.error = None
+        
+        self.condition = threading.Condition()
+        self.cancel_event = threading.Event()
+        self.thread = None
+    
+    def start(self):
+        """Start rendering in a background thread"""
+        self.thread = threading.Thread(target=self._render, daemon=True)
+        self.thread.start()
+    
+    def cancel(self):
+        """Stop rendering after the current chunk"""
+        self.cancel_event.set()
+    
+    def _chunk_path(self, page_number):
+        return os.path.join(self.chunk_dir, f"page_{page_number:05d}.wav")
+    
+    def _render(self):
+        """Render every page, reusing chunks already in the cache"""
+        try:
+            if self.page_numbers is None:
+                page_numbers = list(self.find_page_numbers())
+                with self.condition:
+                    self.page_numbers = page_numbers
+            
+            for page_number in self.page_numbers:
+                if self.cancel_event.is_set():
+                    self.error = "Rendering cancelled"
+                    break
+                
+                chunk_path = self._chunk_path(page_number)
+                if not os.path.exists(chunk_path):
+                    success, text = self.page_source(page_number)
+                    if not success:
+                        self.error = text
+                        break
+                    if not text.strip():
+                        continue
+                    
+                    # Render to a temporary file so a partial chunk is never served
+                    temp_path = chunk_path + ".part.wav"
+                    if self.synthesis_lock is not None:
+                        with self.synthesis_lock:
+                            success, message = self.synthesize(text, temp_path)
+                    else:
+                        success, message = self.synthesize(text, temp_path)
+                    if not success:
+                        self.error = message
+                        break
+                    os.replace(temp_path, chunk_path)
+                
+                self._add_chunk(page_number, chunk_path)
+            
+        except Exception as e:
+            self.error = f"Error rendering audio: {str(e)}"
+            
+        finally:
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+            
+            if self.on_finished is not None:
+                self.on_finished(self)
+    
+    def _add_chunk(self, page_number, chunk_path):
+        """Append a rendered chunk to the stream and wake up listeners"""
+        params, data_offset, data_size = read_wav_layout(chunk_path)
+        
+        with self.condition:
+            if self.audio_params is None:
+                self.audio_params = params
+            elif params != self.audio_params:
+                raise ValueError(f"Page {page_number + 1} was rendered in a different audio format")
+            
+            self.chunk_starts.append(WAV_HEADER_SIZE + self.data_size)
+            self.chunks.append((page_number, chunk_path, data_offset, data_size))
+            self.data_size += data_size
+            self.condition.notify_all()
+    
+    @property
+    def stream_length(self):
+        """Number of stream bytes (header included) available so far"""
+        with self.condition:
+            if self.audio_params is None:
+                return 0
+            return WAV_HEADER_SIZE + self.data_size
+    
+    @property
+    def total_length(self):
+        """Length of the finished stream, or None while rendering"""
+        with self.condition:
+            if not self.done:
+                return None
+            return WAV_HEADER_SIZE + self.data_size if self.audio_params else 0
+    
+    def wait_for(self, offset, timeout=None):
+        """Block until the byte at offset is rendered or rendering ends
+        
+        Returns True if the byte is available.
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.done or (self.audio_params is not None
+                                      and offset < WAV_HEADER_SIZE + self.data_size),
+                timeout
+            )
+            return self.audio_params is not None and offset < WAV_HEADER_SIZE + self.data_size
+    
+    def wait_done(self, timeout=None):
+        """Block until rendering ends; returns True if it has"""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.done, timeout)
+    
+    def header(self):
+        """WAV header of the stream, with exact sizes once rendering is done"""
+        with self.condition:
+            if self.done:
+                return wav_header(*self.audio_params, self.data_size)
+            return wav_header(*self.audio_params)
+    
+    def read(self, start, length):
+        """Read up to length rendered stream bytes starting at start"""
+        with self.condition:
+            end = min(start + length, WAV_HEADER_SIZE + self.data_size)
+            chunks = list(self.chunks)
+            chunk_starts = list(self.chunk_starts)
+        
+        parts = []
+        position = start
+        
+        if position < WAV_HEADER_SIZE:
+            parts.append(self.header()[position:end])
+            position = WAV_HEADER_SIZE
+        
+        index = bisect_right(chunk_starts, position) - 1
+        while position < end and 0 <= index < len(chunks):
+            _, chunk_path, data_offset, data_size = chunks[index]
+            within = position - chunk_starts[index]
+            count = min(data_size - within, end - position)
+            
+            with open(chunk_path, 'rb') as f:
+                f.seek(data_offset + within)
+                data = f.read(count)
+            
+            parts.append(data)
+            position += len(data)
+            index += 1
+        
+        return b"".join(parts)
+    
+    def get_status(self):
+        """Progress summary of the job"""
+        with self.condition:
+            return {
+                'id': self.job_id,
+                'rendered_pages': [chunk[0] for chunk in self.chunks],
+                # Stream offset where each rendered page starts, for Range seeks
+                'page_offsets': [[chunk[0], start] for chunk, start in zip(self.chunks, self.chunk_starts)],
+                'total_pages': len(self.page_numbers) if self.page_numbers is not None else None,
+                'stream_length': WAV_HEADER_SIZE + self.data_size if self.audio_params else 0,
+                'done': self.done,
+                'error': self.error
+            }
+
+
+class RenderCache:
+    def __init__(self, synthesize):
+        """Shared registry of render jobs, one per document
+        
+        All jobs share one synthesize callable and a lock serializing it,
+        since TTS engines are not thread safe.
+        """
+        self.synthesize = synthesize
+        self.synthesis_lock = threading.Lock()
+        self.jobs = {}
+        self.lock = threading.Lock()
+    
+    def get_job(self, job_id):
+        """Get the render job of a document, or None"""
+        with self.lock:
+            return self.jobs.get(job_id)
+    
+    def get_or_start(self, job_id, page_source, page_numbers, on_finished=None):
+        """Get the job of a document, starting it if it is not rendering yet
+        
+        A job that ended with an error is restarted; chunks it already
+        rendered are reused from the cache.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None and not (job.done and job.error):
+                return job, False
+            
+            job = RenderJob(
+                job_id, page_source, page_numbers, self.synthesize,
+                get_cache_dir("audio", job_id), self.synthesis_lock, on_finished
+            )
+            self.jobs[job_id] = job
+        
+        job.start()
+        return job, True
+    
+    def cancel_all(self):
+        """Stop every running job"""
+        with self.lock:
+            for job in self.jobs.values():
+                job.cancel()
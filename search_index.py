@@ -0,0 +1,198 @@
+"""
+Search Index Module
+Positional inverted index over page text for term and phrase search
+"""
+import json
+import os
+import re
+import struct
+import zlib
+from array import array
+
+from cache_utils import get_cache_dir, compute_file_hash
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# On-disk format: magic, header length, zlib(JSON header), zlib(postings)
+INDEX_MAGIC = b"ABIDX2\n"
+INDEX_EXTENSION = ".idx"
+
+# Postings are flat (page, token position, start offset, end offset) entries
+ENTRY_SIZE = 4
+
+
+def tokenize(text):
+    """Split text into lowercase tokens with their (start, end) offsets"""
+    return [(match.group().lower(), match.start(), match.end())
+            for match in TOKEN_PATTERN.finditer(text)]
+
+
+class SearchIndex:
+    def __init__(self):
+        # term -> (start, count) into postings, counted in entries
+        self.terms = {}
+        # Flat entries of ENTRY_SIZE values; offsets are in characters
+        self.postings = array('I')
+        self.page_count = 0
+    
+    def build(self, page_source, total_pages, cancel_event=None, progress_callback=None):
+        """Build the index from a page source
+        
+        page_source is a callable taking a 0-based page number and returning
+        (success, text), such as PDFReader.get_page_text.
+        """
+        try:
+            term_postings = {}
+            
+            for page_num in range(total_pages):
+                if cancel_event is not None and cancel_event.is_set():
+                    return False, "Indexing cancelled"
+                
+                success, text = page_source(page_num)
+                if not success:
+                    return False, text
+                
+                for position, (term, start, end) in enumerate(tokenize(text)):
+                    entries = term_postings.get(term)
+                    if entries is None:
+                        entries = term_postings[term] = array('I')
+                    entries.extend((page_num, position, start, end))
+                
+                if progress_callback is not None:
+                    progress_callback(page_num + 1, total_pages)
+            
+            # Pack all postings into one contiguous array
+            self.terms = {}
+            self.postings = array('I')
+            for term in sorted(term_postings):
+                entries = term_postings[term]
+                self.terms[term] = (len(self.postings) // ENTRY_SIZE, len(entries) // ENTRY_SIZE)
+                self.postings.extend(entries)
+            
+            self.page_count = total_pages
+            
+            return True, f"Indexed {len(self.terms)} terms on {total_pages} pages"
+            
+        except Exception as e:
+            return False, f"Error building search index: {str(e)}"
+    
+    def _term_entries(self, term):
+        """Get the (page, position, start, end) entries for a term"""
+        if term not in self.terms:
+            return []
+        
+        start, count = self.terms[term]
+        entries = self.postings[start * ENTRY_SIZE:(start + count) * ENTRY_SIZE]
+        return [tuple(entries[i:i + ENTRY_SIZE]) for i in range(0, len(entries), ENTRY_SIZE)]
+    
+    def search(self, query):
+        """Find a term or phrase
+        
+        Returns a list of (page, start, end) hits sorted by position, where
+        start and end are character offsets into the page text.
+        """
+        terms = [term for term, _, _ in tokenize(query)]
+        if not terms:
+            return []
+        
+        hits = self._term_entries(terms[0])
+        if not hits:
+            return []
+        
+        # Each following term must appear at the next token position; a
+        # matched hit ends where its last token ends in the page text
+        for distance, term in enumerate(terms[1:], start=1):
+            following = {(page, position): end
+                         for page, position, _, end in self._term_entries(term)}
+            
+            matched = []
+            for page, position, start, _ in hits:
+                end = following.get((page, position + distance))
+                if end is not None:
+                    matched.append((page, position, start, end))
+            hits = matched
+            
+            if not hits:
+                return []
+        
+        return sorted((page, start, end) for page, _, start, end in hits)
+    
+    def save(self, index_path):
+        """Write the index to disk in its compact format"""
+        try:
+            header = json.dumps({
+                'page_count': self.page_count,
+                'terms': self.terms
+            }, separators=(',', ':')).encode('utf-8')
+            header = zlib.compress(header)
+            postings = zlib.compress(self.postings.tobytes())
+            
+            # Write to a temporary file first so a partial index is never read
+            temp_path = index_path + ".tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(INDEX_MAGIC)
+                f.write(struct.pack('<I', len(header)))
+                f.write(header)
+                f.write(postings)
+            os.replace(temp_path, index_path)
+            
+            return True, f"Search index saved to {index_path}"
+            
+        except Exception as e:
+            return False, f"Error saving search index: {str(e)}"
+    
+    def load(self, index_path):
+        """Read an index written by save()"""
+        try:
+            with open(index_path, 'rb') as f:
+                if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                    return False, "Not a search index file"
+                
+                header_length, = struct.unpack('<I', f.read(4))
+                header = json.loads(zlib.decompress(f.read(header_length)))
+                postings = array('I')
+                postings.frombytes(zlib.decompress(f.read()))
+            
+            self.page_count = header['page_count']
+            self.terms = {term: tuple(span) for term, span in header['terms'].items()}
+            self.postings = postings
+            
+            return True, "Search index loaded"
+            
+        except Exception as e:
+            return False, f"Error loading search index: {str(e)}"
+
+
+def get_index_path(file_path, file_hash=None):
+    """Get the cache path of the search index for a PDF file"""
+    if file_hash is None:
+        file_hash = compute_file_hash(file_path)
+    return os.path.join(get_cache_dir("search"), file_hash + INDEX_EXTENSION)
+
+
+def load_or_build_index(file_path, page_source, total_pages, cancel_event=None,
+                        progress_callback=None, file_hash=None, persist=True):
+    """Load the cached index for a file, building and caching it if needed
+    
+    With persist=False (e.g. for encrypted PDFs, whose words should not be
+    left on disk) the index is only built in memory.
+    """
+    try:
+        index_path = get_index_path(file_path, file_hash)
+        index = SearchIndex()
+        
+        if persist and os.path.exists(index_path):
+            success, message = index.load(index_path)
+            if success and index.page_count == total_pages:
+                return True, index
+        
+        success, message = index.build(page_source, total_pages, cancel_event, progress_callback)
+        if not success:
+            return False, message
+        
+        if persist:
+            index.save(index_path)
+        return True, index
+        
+    except Exception as e:
+        return False, f"Error preparing search index: {str(e)}"
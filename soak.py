@@ -0,0 +1,214 @@
+"""
+Soak Test Module
+Long-running stress harness that repeatedly opens and closes PDFs,
+re-initializes TTS engines and runs short synthesis jobs while sampling
+resident memory, open file descriptors and thread counts
+
+A run fails when any of them grows by more than its threshold between the
+start and the end of the run, which is how leaks in lifecycle code
+(close_pdf, cleanup, engine re-initialization) show up.
+
+Usage:
+    python soak.py [--pdf PyPDF2.pdf] [--iterations 5000] [--backend fake]
+"""
+import argparse
+import gc
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from audio_converter import AudioConverter, BACKEND_FAKE, TTS_BACKENDS
+from pdf_reader import PDFReader
+from pipeline import convert_pages
+from process_utils import get_rss
+
+DEFAULT_ITERATIONS = 5000
+
+# Iterations run before the baseline is taken, so caches and imports settle
+WARMUP_ITERATIONS = 50
+
+# Iterations between resource samples
+SAMPLE_EVERY = 50
+
+# Samples averaged (median) at the start and end of the run
+WINDOW_SAMPLES = 5
+
+# Allowed growth between the start and end of a run
+MAX_RSS_GROWTH = 20 * 1024 * 1024
+MAX_FD_GROWTH = 4
+MAX_THREAD_GROWTH = 2
+
+SOAK_TEXT = "The quick brown fox jumps over the lazy dog. It does so again."
+
+
+def count_open_files():
+    """Number of open file descriptors of this process, or None if unknown"""
+    for fd_dir in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return len(os.listdir(fd_dir))
+        except OSError:
+            continue
+    return None
+
+
+def count_threads():
+    """Native threads of this process, falling back to Python threads"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return threading.active_count()
+
+
+def sample_resources():
+    """(RSS bytes, open files, threads) after a full garbage collection"""
+    gc.collect()
+    return get_rss(os.getpid()), count_open_files(), count_threads()
+
+
+class SoakTest:
+    def __init__(self, pdf_path=None, backend=BACKEND_FAKE, work_dir=None,
+                 max_rss_growth=MAX_RSS_GROWTH, max_fd_growth=MAX_FD_GROWTH,
+                 max_thread_growth=MAX_THREAD_GROWTH):
+        """Stress the converter's lifecycle code against resource growth
+        
+        Every iteration opens and closes the PDF (if one is given),
+        re-initializes a TTS engine, and runs a short synthesis, a short
+        speech job and a two-page pipeline conversion on a long-lived engine.
+        """
+        self.pdf_path = pdf_path
+        self.backend = backend
+        self.work_dir = work_dir
+        self.thresholds = {
+            'rss': max_rss_growth,
+            'open_files': max_fd_growth,
+            'threads': max_thread_growth
+        }
+        # (iteration, rss, open files, threads)
+        self.samples = []
+        self.errors = 0
+    
+    def _open_and_close_pdf(self):
+        reader = PDFReader()
+        success, _ = reader.open_pdf(self.pdf_path)
+        if success:
+            success, _ = reader.get_page_text(0)
+        reader.close_pdf()
+        return success
+    
+    def _reinitialize_engine(self):
+        converter = AudioConverter(self.backend)
+        success = converter.engine is not None
+        converter.cleanup()
+        return success
+    
+    def _synthesize(self, converter, audio_path):
+        success, _ = converter.save_to_audio_file(SOAK_TEXT, audio_path)
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
+        speech_success, _ = converter.speak_text(SOAK_TEXT, blocking=True)
+        return success and speech_success
+    
+    def _convert(self, converter, audio_path):
+        success, _ = convert_pages(lambda page: (True, SOAK_TEXT), range(2), audio_path, converter)
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
+        return success
+    
+    def iterate(self, converter, audio_path):
+        """Run one round of every workload; returns True if all succeeded"""
+        success = True
+        if self.pdf_path is not None:
+            success = self._open_and_close_pdf() and success
+        success = self._reinitialize_engine() and success
+        success = self._synthesize(converter, audio_path) and success
+        return self._convert(converter, audio_path) and success
+    
+    def run(self, iterations=DEFAULT_ITERATIONS, progress_callback=None):
+        """Run the soak test; returns a report dict with 'passed' and 'growth'"""
+        started = time.monotonic()
+        work_dir = tempfile.mkdtemp(dir=self.work_dir)
+        audio_path = os.path.join(work_dir, "soak.wav")
+        converter = AudioConverter(self.backend)
+        
+        try:
+            for iteration in range(WARMUP_ITERATIONS + iterations):
+                if not self.iterate(converter, audio_path):
+                    self.errors += 1
+                
+                measured = iteration - WARMUP_ITERATIONS + 1
+                if measured >= 0 and (measured % SAMPLE_EVERY == 0 or measured == iterations):
+                    self.samples.append((measured,) + sample_resources())
+                    if progress_callback is not None:
+                        progress_callback(self.samples[-1])
+        finally:
+            converter.cleanup()
+            shutil.rmtree(work_dir, ignore_errors=True)
+        
+        return self.report(iterations, time.monotonic() - started)
+    
+    def report(self, iterations, seconds):
+        """Compare the start and end of the run against the thresholds"""
+        growth = {}
+        failures = []
+        window = max(1, min(WINDOW_SAMPLES, len(self.samples) // 2))
+        
+        for index, name in enumerate(('rss', 'open_files', 'threads'), start=1):
+            values = [sample[index] for sample in self.samples if sample[index] is not None]
+            if len(values) < 2:
+                growth[name] = None
+                continue
+            
+            growth[name] = statistics.median(values[-window:]) - statistics.median(values[:window])
+            if growth[name] > self.thresholds[name]:
+                failures.append(f"{name} grew by {growth[name]:g} (limit {self.thresholds[name]:g})")
+        
+        if self.errors:
+            failures.append(f"{self.errors} iteration(s) failed")
+        
+        return {
+            'passed': not failures,
+            'failures': failures,
+            'iterations': iterations,
+            'seconds': round(seconds, 1),
+            'growth': growth,
+            'samples': self.samples
+        }
+
+
+def main():
+    """Run a soak test from the command line; exits non-zero on failure"""
+    parser = argparse.ArgumentParser(description="Soak test for memory and handle leaks")
+    parser.add_argument("--pdf", default=None, help="PDF to open and close every iteration")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--backend", choices=TTS_BACKENDS, default=BACKEND_FAKE)
+    parser.add_argument("--max-rss-growth-mb", type=float, default=MAX_RSS_GROWTH / 2**20)
+    parser.add_argument("--report", default=None, help="write the JSON report here")
+    args = parser.parse_args()
+    
+    def show(sample):
+        iteration, rss, open_files, threads = sample
+        rss_text = f"{rss / 2**20:.1f} MB" if rss is not None else "unknown"
+        print(f"{iteration:>7} iterations: RSS {rss_text}, {open_files} files, {threads} threads")
+    
+    soak_test = SoakTest(args.pdf, args.backend, max_rss_growth=args.max_rss_growth_mb * 2**20)
+    report = soak_test.run(args.iterations, progress_callback=show)
+    
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    
+    print("Passed" if report['passed'] else "Failed: " + "; ".join(report['failures']))
+    sys.exit(0 if report['passed'] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""
+Streaming Server Module
+Local HTTP service that renders a book in the background and streams its
+audio while rendering is still in progress
+
+Endpoints:
+    POST /books                 JSON {"path": ...} or {"file_hash": ...}, or a raw
+                                application/pdf body; starts rendering and returns
+                                the id of the rendering in the current voice and rate
+    GET  /books/<id>            render progress as JSON, with the stream offset of
+                                each rendered page
+    GET  /books/<id>/audio.wav  WAV stream, with HTTP range support
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cache_utils import get_cache_dir, compute_file_hash
+from pdf_reader import PDFReader
+from renderer import RenderCache, render_id
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Bytes sent to a listener per write
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# Seconds a listener waits for the next chunk before checking the connection again
+LISTENER_POLL_INTERVAL = 1.0
+
+# Seconds a range request waits for its first byte to be rendered
+RANGE_WAIT_SECONDS = 10.0
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
+AUDIO_PATH_PATTERN = re.compile(r"/books/([0-9a-f]+)/audio\.wav$")
+STATUS_PATH_PATTERN = re.compile(r"/books/([0-9a-f]+)$")
+
+
+class StreamingService:
+    def __init__(self, audio_converter, library=None):
+        self.audio_converter = audio_converter
+        self.library = library
+        self.render_cache = RenderCache(audio_converter.save_to_audio_file)
+    
+    def get_render_id(self, file_hash):
+        """Id of the rendering of a document in the converter's current voice and rate"""
+        info = self.audio_converter.get_engine_info() or {}
+        return render_id(file_hash, {'rate': info.get('rate'), 'voice': info.get('voice')})
+    
+    def start_book(self, file_path=None, file_hash=None):
+        """Start (or join) rendering a book; returns (success, job or message)"""
+        if file_path is None:
+            if self.library is None or file_hash is None:
+                return False, "A file path or a library document id is required"
+            
+            document = self.library.get_document(file_hash)
+            if document is None:
+                return False, f"Unknown document: {file_hash}"
+            file_path = document['file_path']
+        
+        if not os.path.exists(file_path):
+            return False, f"File not found: {file_path}"
+        
+        if file_hash is None:
+            file_hash = compute_file_hash(file_path)
+        
+        job_id = self.get_render_id(file_hash)
+        job = self.render_cache.get_job(job_id)
+        if job is not None and not (job.done and job.error):
+            return True, job
+        
+        reader = PDFReader()
+        success, message = reader.open_pdf(file_path)
+        if not success:
+            return False, message
+        
+        try:
+            # Reuse the library's extracted text and page labels when
+            # available; the reader takes over the store and closes it
+            document = self.library.get_document(file_hash) if self.library is not None else None
+            if document is not None:
+                page_texts = self.library.load_cached_texts(file_hash)
+                if page_texts is not None:
+                    success, _ = reader.set_text_cache(page_texts)
+                    if success:
+                        reader.set_page_types(document.get('page_types'))
+                    else:
+                        page_texts.close()
+            
+            # Pages are classified on the render thread, not while the request waits
+            job, started = self.render_cache.get_or_start(
+                job_id, reader.get_page_text, lambda: reader.get_text_pages()[0],
+                on_finished=lambda job: reader.close_pdf()
+            )
+        except Exception:
+            reader.close_pdf()
+            raise
+        
+        if not started:
+            # Another request started the same rendering meanwhile
+            reader.close_pdf()
+        return True, job
+    
+    def store_upload(self, stream, length):
+        """Save an uploaded PDF into the cache; returns its path"""
+        upload_dir = get_cache_dir("uploads")
+        fd, temp_path = tempfile.mkstemp(suffix=".pdf", dir=upload_dir)
+        
+        with os.fdopen(fd, 'wb') as f:
+            remaining = length
+            while remaining > 0:
+                block = stream.read(min(STREAM_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                f.write(block)
+                remaining -= len(block)
+        
+        file_path = os.path.join(upload_dir, compute_file_hash(temp_path) + ".pdf")
+        os.replace(temp_path, file_path)
+        return file_path
+    
+    def shutdown(self):
+        """Stop all rendering"""
+        self.render_cache.cancel_all()
+
+
+class StreamingRequestHandler(BaseHTTPRequestHandler):
+    # Needed for chunked transfer encoding and keep-alive
+    protocol_version = "HTTP/1.1"
+    
+    @property
+    def service(self):
+        return self.server.service
+    
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+    
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_POST(self):
+        if self.path.rstrip("/") != "/books":
+            self.send_json(404, {'error': "Not found"})
+            return
+        
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            content_type = self.headers.get("Content-Type", "")
+            
+            if content_type.startswith("application/pdf"):
+                file_path = self.service.store_upload(self.rfile, length)
+                success, job = self.service.start_book(file_path=file_path)
+            else:
+                request = json.loads(self.rfile.read(length) or b"{}")
+                success, job = self.service.start_book(
+                    file_path=request.get('path'), file_hash=request.get('file_hash')
+                )
+            
+            if not success:
+                self.send_json(400, {'error': job})
+                return
+            
+            status = job.get_status()
+            status['stream'] = f"/books/{job.job_id}/audio.wav"
+            self.send_json(202, status)
+            
+        except Exception as e:
+            self.send_json(500, {'error': f"Error starting book: {str(e)}"})
+    
+    def do_GET(self):
+        match = AUDIO_PATH_PATTERN.match(self.path)
+        if match:
+            self.stream_audio(match.group(1))
+            return
+        
+        match = STATUS_PATH_PATTERN.match(self.path)
+        if match:
+            job = self.service.render_cache.get_job(match.group(1))
+            if job is None:
+                self.send_json(404, {'error': "Unknown book"})
+            else:
+                self.send_json(200, job.get_status())
+            return
+        
+        self.send_json(404, {'error': "Not found"})
+    
+    def stream_audio(self, job_id):
+        """Send the WAV stream, whole or as a byte range"""
+        job = self.service.render_cache.get_job(job_id)
+        if job is None:
+            self.send_json(404, {'error': "Unknown book"})
+            return
+        
+        # Nothing can be sent before the first chunk defines the audio format
+        if not job.wait_for(0):
+            self.send_json(500, {'error': job.error or "No audio rendered"})
+            return
+        
+        try:
+            range_header = self.headers.get("Range")
+            if range_header:
+                self.send_range(job, range_header)
+            else:
+                self.send_progressive(job)
+        except (BrokenPipeError, ConnectionResetError):
+            # The listener went away
+            pass
+    
+    def send_range(self, job, range_header):
+        """Serve a byte range from the rendered part of the stream"""
+        match = RANGE_PATTERN.match(range_header.strip())
+        if not match or match.groups() == ("", ""):
+            self.send_json(416, {'error': "Unsupported range"})
+            return
+        
+        first, last = match.groups()
+        if not first and job.total_length is None:
+            # Suffix ranges need the final length; until it is known the
+            # range is ignored and the stream sent as it renders
+            self.send_progressive(job)
+            return
+        
+        if first:
+            start = int(first)
+        else:
+            start = max(0, job.stream_length - int(last))
+            last = ""
+        
+        # Seeking past the rendered audio waits a while for it to be rendered
+        if not job.wait_for(start, RANGE_WAIT_SECONDS):
+            total = job.total_length
+            if total is None:
+                self.send_response(503)
+                self.send_header("Retry-After", str(int(RANGE_WAIT_SECONDS)))
+            else:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{total}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        
+        available = job.stream_length
+        end = min(int(last), available - 1) if last else available - 1
+        data = job.read(start, end - start + 1)
+        total = job.total_length
+        
+        self.send_response(206)
+        self.send_header("Content-Type", "audio/wav")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Range", f"bytes {start}-{start + len(data) - 1}/{total or '*'}")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def send_progressive(self, job):
+        """Send the whole stream, following the renderer as chunks arrive"""
+        total = job.total_length
+        
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/wav")
+        self.send_header("Accept-Ranges", "bytes")
+        if total is not None:
+            self.send_header("Content-Length", str(total))
+        else:
+            self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        
+        position = 0
+        while True:
+            if not job.wait_for(position, LISTENER_POLL_INTERVAL):
+                if job.done:
+                    break
+                continue
+            
+            data = job.read(position, STREAM_BLOCK_SIZE)
+            position += len(data)
+            
+            if total is not None:
+                self.wfile.write(data)
+            else:
+                self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+        
+        if total is None:
+            self.wfile.write(b"0\r\n\r\n")
+
+
+class StreamingServer(ThreadingHTTPServer):
+    daemon_threads = True
+    
+    def __init__(self, address, service, verbose=False):
+        super().__init__(address, StreamingRequestHandler)
+        self.service = service
+        self.verbose = verbose
+
+
+def main():
+    """Run the streaming server from the command line"""
+    parser = argparse.ArgumentParser(description="Stream PDF audiobooks over HTTP")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    
+    from audio_converter import AudioConverter
+    from library import Library
+    
+    audio_converter = AudioConverter()
+    if audio_converter.engine is None:
+        print("TTS engine could not be initialized")
+        sys.exit(1)
+    
+    try:
+        library = Library()
+    except Exception as e:
+        print(f"Library unavailable: {str(e)}")
+        library = None
+    
+    service = StreamingService(audio_converter, library)
+    server = StreamingServer((args.host, args.port), service, verbose=True)
+    print(f"Streaming audiobooks on http://{args.host}:{args.port}/books")
+    
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.shutdown()
+        server.server_close()
+        if library is not None:
+            library.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Sync Map Module
+Index of where each page, paragraph and sentence of a book starts in its
+exported audio, for seeking by text position and for subtitles
+"""
+import os
+import re
+import struct
+from bisect import bisect_right
+
+SYNC_MAP_MAGIC = b"ABSYNC1\n"
+SYNC_MAP_SUFFIX = ".sync"
+
+# Levels of text units, coarsest first
+LEVEL_PAGE = 0
+LEVEL_PARAGRAPH = 1
+LEVEL_SENTENCE = 2
+LEVEL_NAMES = ("page", "paragraph", "sentence")
+
+# A blank line between two sentences starts a new paragraph
+PARAGRAPH_BREAK_PATTERN = re.compile(r'\n[ \t\r\f\v]*\n')
+
+# Header: channels, sample width, frame rate, entry count
+HEADER_FORMAT = '<HHII'
+# Entry: frame offset, level, page, character offset within the page
+ENTRY_FORMAT = '<QBxxxII'
+
+
+def get_sync_map_path(output_path):
+    """Path of the sync map kept next to an exported audio file"""
+    return output_path + SYNC_MAP_SUFFIX
+
+
+def unit_levels(text, marks):
+    """Level of each sentence mark of a page's text
+    
+    marks is a list of (character offset, frame offset) per sentence, as
+    returned by AudioConverter.save_with_sentence_marks. The first sentence
+    starts the page and sentences after a blank line start a paragraph.
+    """
+    levels = []
+    previous_start = 0
+    for index, (char_offset, _) in enumerate(marks):
+        if index == 0:
+            levels.append(LEVEL_PAGE)
+        elif PARAGRAPH_BREAK_PATTERN.search(text, previous_start, char_offset):
+            levels.append(LEVEL_PARAGRAPH)
+        else:
+            levels.append(LEVEL_SENTENCE)
+        previous_start = char_offset
+    return levels
+
+
+class SyncMap:
+    def __init__(self, audio_params):
+        """Sorted index of text units and the audio frame where each starts
+        
+        audio_params is (channels, sample width, frame rate) of the audio.
+        Entries are added in reading order, so they are sorted both by frame
+        and by (page, character offset) and either can be searched with
+        bisect.
+        """
+        self.audio_params = tuple(audio_params)
+        self.frames = []
+        self.levels = []
+        # (page, character offset) of each entry
+        self.positions = []
+    
+    def __len__(self):
+        return len(self.frames)
+    
+    def add(self, frame, level, page, char_offset):
+        """Append a unit; units must be added in reading order"""
+        if self.frames and (frame < self.frames[-1] or (page, char_offset) < self.positions[-1]):
+            raise ValueError("Sync map entries must be added in reading order")
+        self.frames.append(frame)
+        self.levels.append(level)
+        self.positions.append((page, char_offset))
+    
+    def add_page(self, page, text, marks, frame_offset):
+        """Add a page's sentence marks, shifted to where its audio starts"""
+        for level, (char_offset, frame) in zip(unit_levels(text, marks), marks):
+            self.add(frame_offset + frame, level, page, char_offset)
+    
+    def seek(self, page, char_offset=0):
+        """Frame where the unit containing a text position starts, or None"""
+        index = bisect_right(self.positions, (page, char_offset)) - 1
+        if index < 0:
+            return None
+        return self.frames[index]
+    
+    def locate(self, frame):
+        """(level, page, character offset) of the unit playing at a frame, or None"""
+        index = bisect_right(self.frames, frame) - 1
+        if index < 0:
+            return None
+        return (self.levels[index],) + self.positions[index]
+    
+    def byte_offset(self, frame, data_offset):
+        """Offset of a frame in a WAV file whose audio data starts at data_offset"""
+        channels, sample_width, _ = self.audio_params
+        return data_offset + frame * channels * sample_width
+    
+    def seconds(self, frame):
+        return frame / self.audio_params[2]
+    
+    def save(self, path):
+        """Write the map in its compact binary form"""
+        try:
+            temp_path = path + ".tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(SYNC_MAP_MAGIC)
+                f.write(struct.pack(HEADER_FORMAT, *self.audio_params, len(self.frames)))
+                for frame, level, (page, char_offset) in zip(self.frames, self.levels, self.positions):
+                    f.write(struct.pack(ENTRY_FORMAT, frame, level, page, char_offset))
+            os.replace(temp_path, path)
+            
+            return True, f"Sync map saved to {path}"
+            
+        except Exception as e:
+            return False, f"Error saving sync map: {str(e)}"
+    
+    @classmethod
+    def load(cls, path):
+        """Read a map written by save, or return None if it is missing or invalid"""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            
+            if not data.startswith(SYNC_MAP_MAGIC):
+                return None
+            
+            offset = len(SYNC_MAP_MAGIC)
+            channels, sample_width, frame_rate, count = struct.unpack_from(HEADER_FORMAT, data, offset)
+            offset += struct.calcsize(HEADER_FORMAT)
+            
+            sync_map = cls((channels, sample_width, frame_rate))
+            for frame, level, page, char_offset in struct.iter_unpack(ENTRY_FORMAT, data[offset:]):
+                sync_map.frames.append(frame)
+                sync_map.levels.append(level)
+                sync_map.positions.append((page, char_offset))
+            
+            if len(sync_map) != count:
+                return None
+            return sync_map
+            
+        except (OSError, struct.error):
+            return None
+    
+    def cues(self, page_texts, total_frames):
+        """(start seconds, end seconds, text) of every sentence
+        
+        page_texts maps page numbers to the texts the map was built from;
+        each sentence runs until the next one starts.
+        """
+        cues = []
+        for index, (frame, (page, char_offset)) in enumerate(zip(self.frames, self.positions)):
+            end_frame = self.frames[index + 1] if index + 1 < len(self.frames) else total_frames
+            if index + 1 < len(self.positions) and self.positions[index + 1][0] == page:
+                end_offset = self.positions[index + 1][1]
+            else:
+                end_offset = len(page_texts[page])
+            
+            text = " ".join(page_texts[page][char_offset:end_offset].split())
+            if text and end_frame > frame:
+                cues.append((self.seconds(frame), self.seconds(end_frame), text))
+        return cues
+
+
+def _format_timestamp(seconds, separator):
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+
+
+def write_webvtt(cues, path):
+    """Write sentence cues as WebVTT subtitles"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("WEBVTT\n\n")
+        for start, end, text in cues:
+            f.write(f"{_format_timestamp(start, '.')} --> {_format_timestamp(end, '.')}\n{text}\n\n")
+
+
+def write_srt(cues, path):
+    """Write sentence cues as SRT subtitles"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for number, (start, end, text) in enumerate(cues, 1):
+            f.write(f"{number}\n{_format_timestamp(start, ',')} --> {_format_timestamp(end, ',')}\n{text}\n\n")
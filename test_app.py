@@ -6,6 +6,30 @@ Tests basic functionality of all modules
 
 import sys
 import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def cache_dir_override(path):
+    """Point the application cache at path for the duration of a test"""
+    previous = os.environ.get("AUDIOBOOK_CACHE_DIR")
+    os.environ["AUDIOBOOK_CACHE_DIR"] = path
+    try:
+        yield path
+    finally:
+        if previous is None:
+            del os.environ["AUDIOBOOK_CACHE_DIR"]
+        else:
+            os.environ["AUDIOBOOK_CACHE_DIR"] = previous
+
+def passes(test):
+    """Run an assert-based test, reporting a failure like the other tests"""
+    try:
+        test()
+        return True
+    except Exception as e:
+        print(f"✗ {test.__name__} failed: {e}")
+        return False
 
 def test_imports():
     """Test if all required modules can be imported"""
@@ -111,6 +135,1608 @@ def test_pdf_reader():
         print(f"✗ PDFReader test failed: {str(e)}")
         return False
 
+def test_fast_extractor():
+    """Test the fast content stream text extractor"""
+    print("\nTesting fast text extractor...")
+    
+    from PyPDF2.generic import (DictionaryObject, DecodedStreamObject, NameObject,
+                                ArrayObject, NumberObject)
+    from pdf_reader import FastTextExtractor
+    
+    def make_page(content, fonts):
+        stream = DecodedStreamObject()
+        stream.set_data(content)
+        page = DictionaryObject()
+        page[NameObject("/Contents")] = stream
+        page[NameObject("/Resources")] = DictionaryObject({NameObject("/Font"): DictionaryObject(fonts)})
+        return page
+    
+    plain = DictionaryObject({NameObject("/Subtype"): NameObject("/Type1")})
+    differences = DictionaryObject({
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/Encoding"): DictionaryObject({NameObject("/Differences"): ArrayObject(
+            [NumberObject(65), NameObject("/fi"), NameObject("/quoteright")]
+        )})
+    })
+    to_unicode = DecodedStreamObject()
+    to_unicode.set_data(b"beginbfchar <0001> <00E9> endbfchar "
+                        b"beginbfrange <0010> <0012> <0061> endbfrange")
+    composite = DictionaryObject({NameObject("/Subtype"): NameObject("/Type0"),
+                                  NameObject("/ToUnicode"): to_unicode})
+    fonts = {NameObject("/F1"): plain, NameObject("/F2"): differences, NameObject("/F3"): composite}
+    
+    extractor = FastTextExtractor()
+    page = make_page(b"BT /F1 12 Tf (Hello) Tj 0 -14 Td [(Wor) -50 (ld) -400 (again)] TJ "
+                     b"T* (Esc\\(aped\\) \\101) Tj ET", fonts)
+    text = extractor.extract_page(page)
+    
+    assert text == "Hello\nWorld again\nEsc(aped) A", f"Unexpected text: {text!r}"
+    print("✓ Text operators decoded in reading order")
+    
+    text = extractor.extract_page(make_page(b"BT /F2 12 Tf (AB) Tj /F3 12 Tf <0001 0010 0012> Tj ET", fonts))
+    assert text == "fi\u2019\u00e9ac", f"Font encodings not applied: {text!r}"
+    print("✓ Differences and ToUnicode maps decoded")
+    
+    # Direct font dictionaries stay referenced by the cache keyed by their id
+    assert any(font is plain for font, _ in extractor.font_cache.values()), (
+        "Cached direct font not kept alive")
+    print("✓ Font tables cached per font object")
+
+def test_page_classification():
+    """Test cheap detection of image-only and blank pages"""
+    print("\nTesting page classification...")
+    
+    try:
+        from PyPDF2.generic import DictionaryObject, DecodedStreamObject, IndirectObject, NameObject
+        from pdf_reader import PDFReader, classify_page, PAGE_TEXT, PAGE_IMAGE, PAGE_BLANK
+        
+        def make_page(content, resources):
+            stream = DecodedStreamObject()
+            stream.set_data(content)
+            page = DictionaryObject()
+            page[NameObject("/Contents")] = stream
+            page[NameObject("/Resources")] = DictionaryObject(resources)
+            return page
+        
+        image = DecodedStreamObject()
+        image[NameObject("/Subtype")] = NameObject("/Image")
+        font = DictionaryObject({NameObject("/F1"): DictionaryObject()})
+        
+        cases = [
+            (make_page(b"BT /F1 12 Tf (Hi) Tj ET", {NameObject("/Font"): font}), PAGE_TEXT),
+            (make_page(b"q 600 0 0 800 0 0 cm /Im0 Do Q",
+                       {NameObject("/XObject"): DictionaryObject({NameObject("/Im0"): image})}), PAGE_IMAGE),
+            (make_page(b"", {}), PAGE_BLANK),
+            (make_page(b"0 0 m 100 100 l S", {}), PAGE_BLANK)
+        ]
+        
+        for page, expected in cases:
+            if classify_page(page) != expected:
+                print(f"✗ Expected {expected}, got {classify_page(page)}")
+                return False
+        print("✓ Text, image-only and blank pages classified")
+        
+        # A content stream known to be large from the file layout is not decoded
+        class UndecodedStream(DecodedStreamObject):
+            def get_data(self):
+                raise AssertionError("content stream decoded")
+        
+        class Objects:
+            def get_object(self, reference):
+                return UndecodedStream()
+        
+        page = make_page(b"", {NameObject("/Font"): font})
+        page[NameObject("/Contents")] = IndirectObject(1, 0, Objects())
+        if classify_page(page, lambda reference: 100000) != PAGE_TEXT:
+            print("✗ Large page with fonts not classified as text")
+            return False
+        
+        sample_pdf = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyPDF2.pdf")
+        reader = PDFReader()
+        reader.open_pdf(sample_pdf)
+        page = reader.document.pages[0]
+        size = reader.document.object_size(page.raw_get("/Contents"))
+        _, page_types = reader.classify_pages()
+        decoded_type = classify_page(page)
+        reader.close_pdf()
+        if not size or page_types != [decoded_type]:
+            print(f"✗ Stored stream size {size} or page types {page_types} wrong")
+            return False
+        print("✓ Large content streams classified from their stored size without decoding")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Page classification test failed: {str(e)}")
+        return False
+
+def test_sentence_splitting():
+    """Test sentence offsets used for highlighting spoken text"""
+    print("\nTesting sentence splitting...")
+    
+    from audio_converter import split_sentences
+    
+    text = "First sentence.  Second one?\nThird!"
+    sentences = [text[start:end] for start, end in split_sentences(text)]
+    
+    assert sentences == ["First sentence.", "Second one?", "Third!"], f"Unexpected sentences: {sentences}"
+    print("✓ Sentences split at correct offsets")
+
+def test_reading_text():
+    """Test collecting the text read from a position, as the GUI does off the Tk thread"""
+    print("\nTesting reading text...")
+    
+    from gui import build_reading_text
+    from pdf_reader import PDFReader, PAGE_TEXT, PAGE_IMAGE, PAGE_BLANK
+    from text_store import BookTextStore
+    
+    sample_pdf = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyPDF2.pdf")
+    reader = PDFReader()
+    success, message = reader.open_pdf(sample_pdf)
+    assert success, f"Could not open sample PDF: {message}"
+    
+    _, page_text = reader.get_page_text(0)
+    success, result = build_reading_text(reader, 0, 5)
+    reader.close_pdf()
+    assert success, f"Unexpected text from an offset: {result!r:.200}"
+    assert result[0] == page_text[5:] + "\n", f"Unexpected text from an offset: {result!r:.200}"
+    assert result[1] == [-5], f"Unexpected text from an offset: {result!r:.200}"
+    print("✓ Text collected from a page offset")
+    
+    # Skipped pages are reported and page starts follow the remaining pages
+    class BookReader:
+        page_types = [PAGE_TEXT, PAGE_IMAGE, PAGE_TEXT, PAGE_BLANK, PAGE_TEXT]
+        
+        def get_text_pages(self, start_page=0):
+            pages = range(start_page, len(self.page_types))
+            return ([page for page in pages if self.page_types[page] == PAGE_TEXT],
+                    [(page, self.page_types[page]) for page in pages if self.page_types[page] != PAGE_TEXT])
+        
+        def get_text_store(self, page_numbers):
+            return True, BookTextStore.from_pages([f"Page {page}." for page in page_numbers])
+    
+    success, (text, page_starts, text_pages, skipped_pages) = build_reading_text(BookReader(), 1, 3)
+    assert text == "Page 2.\nPage 4.\n", (
+        f"Unexpected reading from a skipped page: {text!r}, {page_starts}, {skipped_pages}")
+    assert page_starts == [0, 8], (
+        f"Unexpected reading from a skipped page: {text!r}, {page_starts}, {skipped_pages}")
+    assert text_pages == [2, 4], (
+        f"Unexpected reading from a skipped page: {text!r}, {page_starts}, {skipped_pages}")
+    assert skipped_pages == [(1, PAGE_IMAGE), (3, PAGE_BLANK)], (
+        f"Unexpected reading from a skipped page: {text!r}, {page_starts}, {skipped_pages}")
+    print("✓ Skipped pages reported, offset dropped when the first page is skipped")
+    
+    success, message = build_reading_text(BookReader(), 5)
+    assert not success, "Reading past the last text page should fail"
+    print("✓ Nothing to read reported")
+
+def test_search_index():
+    """Test term and phrase queries and the on-disk index format"""
+    print("\nTesting search index...")
+    
+    import tempfile
+    from search_index import SearchIndex
+    
+    pages = ["The quick brown fox.", "A quick brown dog jumps over the fox."]
+    index = SearchIndex()
+    success, message = index.build(lambda page: (True, pages[page]), len(pages))
+    assert success, f"Index build failed: {message}"
+    
+    assert index.search("quick brown") == [(0, 4, 15), (1, 2, 13)], (
+        f"Unexpected phrase hits: {index.search('quick brown')}")
+    print("✓ Phrase query returns page/offset hits")
+    
+    assert index.search("brown fox") == [(0, 10, 19)], (
+        f"Unexpected phrase hits: {index.search('brown fox')}")
+    print("✓ Phrase query requires adjacent terms")
+    
+    # Lowercasing can change a word's length; hits end where the word does
+    index.build(lambda page: (True, "Visit İSTANBUL today"), 1)
+    assert index.search("İstanbul") == [(0, 6, 14)], (
+        f"Unexpected hit end: {index.search('İstanbul')}")
+    print("✓ Hits end at the end of the matched text")
+    
+    index.build(lambda page: (True, pages[page]), len(pages))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index_path = os.path.join(temp_dir, "test.idx")
+        index.save(index_path)
+        loaded = SearchIndex()
+        success, message = loaded.load(index_path)
+        assert success, f"Saved index did not round-trip: {message}"
+        assert loaded.search("fox") == index.search("fox"), (
+            f"Saved index did not round-trip: {message}")
+    print("✓ Index saved and reloaded")
+
+def test_library():
+    """Test the persistent document library"""
+    print("\nTesting Library...")
+    
+    try:
+        import tempfile
+        from library import Library, save_page_texts, get_file_stat
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            library = Library(os.path.join(temp_dir, "library.db"))
+            
+            text_cache_path = os.path.join(temp_dir, "book.abtx")
+            save_page_texts(text_cache_path, ["Page one.", "Page two."])
+            
+            book_path = os.path.join(temp_dir, "book.pdf")
+            with open(book_path, 'wb') as f:
+                f.write(b"%PDF-1.4 placeholder")
+            file_size, file_mtime_ns = get_file_stat(book_path)
+            
+            if library.update_position("abc123", 1, 42):
+                print("✗ Position recorded for a document not in the library")
+                return False
+            
+            library.add_document({
+                'file_hash': "abc123",
+                'file_path': book_path,
+                'file_size': file_size,
+                'file_mtime_ns': file_mtime_ns,
+                'title': "Book",
+                'author': "",
+                'page_count': 2,
+                'text_cache_path': text_cache_path,
+                'outline': [[0, "Chapter 1", 0]]
+            })
+            library.update_position("abc123", 1, 42)
+            library.close()
+            
+            # Reopen to check everything was persisted
+            library = Library(os.path.join(temp_dir, "library.db"))
+            document = library.get_document("abc123")
+            
+            if document is None or (document['last_page'], document['last_offset']) != (1, 42):
+                print(f"✗ Position not restored: {document}")
+                return False
+            print("✓ Document record and position persisted")
+            
+            page_texts = library.load_cached_texts("abc123")
+            if page_texts is None or list(page_texts) != ["Page one.", "Page two."]:
+                print("✗ Cached page texts not restored")
+                return False
+            page_texts.close()
+            print("✓ Cached page texts restored")
+            
+            found = library.find_document(book_path)
+            with open(book_path, 'ab') as f:
+                f.write(b" changed")
+            if found is None or found['file_hash'] != "abc123" or library.find_document(book_path):
+                print("✗ Unchanged file not recognized by its path, size and time")
+                return False
+            print("✓ Unchanged files recognized without hashing")
+            
+            library.close()
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Library test failed: {str(e)}")
+        return False
+
+def test_position_tracking():
+    """Test debounced reading position saves and sentence resume points"""
+    print("\nTesting position tracking...")
+    
+    import time
+    from bookmarks import PositionTracker, sentence_start
+    
+    class RecordingLibrary:
+        def __init__(self):
+            self.writes = []
+            self.known = True
+        
+        def update_position(self, file_hash, page, offset):
+            if self.known:
+                self.writes.append((file_hash, page, offset))
+            return self.known
+    
+    library = RecordingLibrary()
+    tracker = PositionTracker(library, "abc123", save_delay=0.1)
+    
+    for offset in range(0, 100, 10):
+        tracker.update(3, offset)
+    
+    time.sleep(0.3)
+    
+    assert library.writes == [("abc123", 3, 90)], (
+        f"Expected a single coalesced write, got {library.writes}")
+    print("✓ Rapid position updates coalesced into one write")
+    
+    tracker.update(4, 5)
+    tracker.flush()
+    assert library.writes[-1] == ("abc123", 4, 5), "Flush did not write the latest position"
+    print("✓ Flush writes the latest position immediately")
+    
+    # A new book is only added to the library after its first positions
+    library = RecordingLibrary()
+    library.known = False
+    tracker = PositionTracker(library, "new456", save_delay=0.1)
+    tracker.update(0, 12)
+    tracker.flush()
+    library.known = True
+    tracker.flush()
+    assert library.writes == [("new456", 0, 12)], (
+        "Position of a book not yet in the library was lost")
+    print("✓ Positions wait until the book is in the library")
+    
+    text = "One sentence. Another sentence here."
+    assert sentence_start(text, text.index("sentence here")) == text.index("Another"), (
+        "Resume point is not the start of the sentence")
+    print("✓ Resume backs up to the start of the sentence")
+
+def test_shared_document():
+    """Test concurrent extraction from one parsed document"""
+    print("\nTesting shared PDF document...")
+    
+    sample_pdf = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyPDF2.pdf")
+    if not os.path.exists(sample_pdf):
+        print("✓ Skipped (sample PDF not found)")
+        return True
+    
+    try:
+        from pdf_reader import PDFReader
+        
+        reader = PDFReader()
+        success, message = reader.open_pdf(sample_pdf)
+        if not success:
+            print(f"✗ {message}")
+            return False
+        
+        success, expected = reader.get_page_text(0)
+        
+        # Many threads read the same page through shared readers
+        success, texts = reader.get_pages_text([0] * 16, max_workers=8)
+        if not success or any(text != expected for text in texts):
+            print("✗ Concurrent extraction differed from sequential extraction")
+            return False
+        print("✓ Concurrent readers extracted identical text")
+        
+        # A shared reader keeps the document open after the original closes
+        shared = reader.share()
+        reader.close_pdf()
+        success, text = shared.get_page_text(0)
+        shared.close_pdf()
+        if not success or text != expected:
+            print(f"✗ Shared reader failed after original closed: {text}")
+            return False
+        print("✓ Shared reader outlives the original reader")
+        
+        # The reader closes a text store handed to it; shared readers only borrow it
+        import tempfile
+        from text_store import BookTextStore
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store_path = os.path.join(temp_dir, "book.abtx")
+            reader.open_pdf(sample_pdf)
+            BookTextStore.from_pages([expected] * reader.total_pages).save(store_path)
+            first, second = BookTextStore.load(store_path), BookTextStore.load(store_path)
+            reader.set_text_cache(first)
+            shared = reader.share()
+            shared.close_pdf()
+            borrowed = first.mapping is not None
+            reader.set_text_cache(second)
+            replaced = first.mapping is None
+            reader.close_pdf()
+            if not borrowed or not replaced or second.mapping is not None:
+                print("✗ Text stores were not closed by the reader that owns them")
+                return False
+        print("✓ Text stores closed when replaced and on close")
+        
+        # A recorded page count defers reading the page tree until a page is extracted
+        reader.open_pdf(sample_pdf, page_count=1)
+        deferred = reader.document._pages is None
+        success, text = reader.get_page_text(0)
+        reader.close_pdf()
+        if not deferred or not success or text != expected:
+            print("✗ Page tree not read on first use")
+            return False
+        print("✓ Page tree of a known book read on first use")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Shared document test failed: {str(e)}")
+        return False
+
+def test_load_cancellation():
+    """Test cancelled loads, slow parse reporting and swapping in a loaded document"""
+    print("\nTesting PDF load cancellation...")
+    
+    sample_pdf = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyPDF2.pdf")
+    if not os.path.exists(sample_pdf):
+        print("✓ Skipped (sample PDF not found)")
+        return True
+    
+    try:
+        import contextlib
+        import io
+        import threading
+        import pdf_reader
+        from pdf_reader import PDFReader
+        
+        reader = PDFReader()
+        reader.open_pdf(sample_pdf)
+        success, expected = reader.get_page_text(0)
+        
+        # A load cancelled while parsing keeps nothing open
+        cancel_event = threading.Event()
+        cancel_event.set()
+        loading = PDFReader()
+        success, message = loading.open_pdf(sample_pdf, cancel_event)
+        if success or loading.document is not None or loading.total_pages:
+            print(f"✗ Cancelled load left a document open: {message}")
+            return False
+        print("✓ Cancelled load discarded the parsed file")
+        
+        threshold = pdf_reader.SLOW_PARSE_THRESHOLD
+        pdf_reader.SLOW_PARSE_THRESHOLD = -1
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                success, message = loading.open_pdf(sample_pdf)
+        finally:
+            pdf_reader.SLOW_PARSE_THRESHOLD = threshold
+        if not success or "Slow PDF parse" not in output.getvalue():
+            print(f"✗ Slow parse not reported: {output.getvalue()!r}")
+            return False
+        print("✓ Parses over SLOW_PARSE_THRESHOLD reported")
+        
+        # The open reader is untouched until the loaded document is taken over
+        reader.take_over(loading)
+        success, text = reader.get_page_text(0)
+        if loading.document is not None or not success or text != expected:
+            print("✗ Loaded document was not moved into the open reader")
+            return False
+        reader.close_pdf()
+        print("✓ Loaded document swapped into the open reader")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Load cancellation test failed: {str(e)}")
+        return False
+
+def test_text_store():
+    """Test the whole-book text buffer and its page offset table"""
+    print("\nTesting text store...")
+    
+    import tempfile
+    from text_store import BookTextStore
+    
+    pages = ["Première page.", "", "Third page."]
+    store = BookTextStore.from_pages(pages)
+    
+    assert store.get_text() == "".join(page + "\n" for page in pages), (
+        f"Unexpected store text: {store.get_text()!r}")
+    assert list(store) == pages, f"Unexpected store text: {store.get_text()!r}"
+    print("✓ Pages stored in one buffer")
+    
+    # Offsets are in characters even though the buffer is UTF-8
+    third_start = store.page_start(2)
+    assert store.offset_to_position(third_start + 6) == (2, 6), (
+        "Character offsets mapped to the wrong page")
+    assert store.page_for_offset(3) == 0, "Character offsets mapped to the wrong page"
+    assert bytes(store.page_slice(0)) == pages[0].encode('utf-8'), (
+        "Page slice does not match the page text")
+    print("✓ Offsets map back to pages")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store_path = os.path.join(temp_dir, "book.abtx")
+        store.save(store_path)
+        loaded = BookTextStore.load(store_path)
+        assert loaded is not None, "Saved store did not round-trip"
+        assert list(loaded) == pages, "Saved store did not round-trip"
+        assert loaded.char_length == store.char_length, "Saved store did not round-trip"
+        assert loaded.get_text(third_start + 6) == "page.\n", (
+            "Text from an offset differs from slicing the whole text")
+        assert loaded.get_text(3) == store.get_text()[3:], (
+            "Text from an offset differs from slicing the whole text")
+        loaded.close()
+    print("✓ Store saved and memory-mapped back")
+
+def test_async_api():
+    """Test awaitable speech, cancellation and async page iteration"""
+    print("\nTesting async API...")
+    
+    try:
+        import asyncio
+        import threading
+        from async_api import AsyncPDFReader, AsyncAudioConverter
+        
+        class BlockingEngine:
+            def __init__(self):
+                self.stopped = threading.Event()
+            
+            def stop(self):
+                self.stopped.set()
+        
+        class BlockingConverter:
+            def __init__(self):
+                self.engine = BlockingEngine()
+            
+            def speak_text(self, text, blocking=False, sentence_callback=None, word_callback=None):
+                if sentence_callback is not None:
+                    sentence_callback(0, len(text))
+                if text == "forever":
+                    self.engine.stopped.wait(5)
+                return True, "Speech completed"
+        
+        async def run():
+            converter = BlockingConverter()
+            async with AsyncAudioConverter(converter) as speaker:
+                sentences = []
+                result = await speaker.speak_text("Hello.", lambda start, end: sentences.append((start, end)))
+                if result != (True, "Speech completed") or sentences != [(0, 6)]:
+                    print(f"✗ Unexpected speech result: {result}, {sentences}")
+                    return False
+                print("✓ Speech awaited with callbacks on the event loop")
+                
+                task = asyncio.ensure_future(speaker.speak_text("forever"))
+                await asyncio.sleep(0.1)
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                if not converter.engine.stopped.is_set():
+                    print("✗ Cancellation did not stop the engine")
+                    return False
+                print("✓ Cancellation stops the engine")
+            
+            sample_pdf = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyPDF2.pdf")
+            if os.path.exists(sample_pdf):
+                async with AsyncPDFReader() as reader:
+                    success, message = await reader.open_pdf(sample_pdf)
+                    pages = [page async for page, _ in reader.pages()]
+                    if not success or pages != list(range(reader.total_pages)):
+                        print(f"✗ Async page iteration failed: {message}")
+                        return False
+                print("✓ Pages iterated with async for")
+            
+            return True
+        
+        return asyncio.run(run())
+        
+    except Exception as e:
+        print(f"✗ Async API test failed: {str(e)}")
+        return False
+
+def test_streaming_server():
+    """Test progressive and ranged streaming of rendered chunks"""
+    print("\nTesting streaming server...")
+    
+    try:
+        import tempfile
+        import threading
+        import urllib.error
+        import urllib.request
+        import wave
+        from renderer import WAV_HEADER_SIZE
+        from streaming_server import StreamingService, StreamingServer
+        
+        class ToneConverter:
+            rate = 150
+            
+            def get_engine_info(self):
+                return {'rate': self.rate, 'voice': None}
+            
+            def save_to_audio_file(self, text, filename):
+                with wave.open(filename, 'wb') as wav:
+                    wav.setnchannels(1)
+                    wav.setsampwidth(2)
+                    wav.setframerate(8000)
+                    wav.writeframes(b"\x01\x00" * (100 * len(text)))
+                return True, f"Audio saved to {filename}"
+        
+        pages = ["One.", "", "Three."]
+        expected_size = WAV_HEADER_SIZE + 2 * 100 * (len("One.") + len("Three."))
+        
+        with tempfile.TemporaryDirectory() as temp_dir, cache_dir_override(temp_dir):
+            service = StreamingService(ToneConverter())
+            server = StreamingServer(("127.0.0.1", 0), service)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            
+            try:
+                job, started = service.render_cache.get_or_start(
+                    "abc123", lambda page: (True, pages[page]), range(len(pages))
+                )
+                url = f"http://127.0.0.1:{server.server_address[1]}/books/abc123/audio.wav"
+                
+                with urllib.request.urlopen(url) as response:
+                    audio = response.read()
+                if len(audio) != expected_size or audio[:4] != b"RIFF":
+                    print(f"✗ Unexpected stream size: {len(audio)}")
+                    return False
+                print("✓ Whole stream served from rendered chunks")
+                
+                request = urllib.request.Request(url, headers={"Range": "bytes=44-1043"})
+                with urllib.request.urlopen(request) as response:
+                    ranged = response.read()
+                    status = response.status
+                if status != 206 or ranged != audio[44:1044]:
+                    print(f"✗ Unexpected range response: {status}, {len(ranged)} bytes")
+                    return False
+                
+                request = urllib.request.Request(url, headers={"Range": "bytes=-100"})
+                with urllib.request.urlopen(request) as response:
+                    suffix = response.read()
+                try:
+                    request = urllib.request.Request(url, headers={"Range": f"bytes={expected_size}-"})
+                    urllib.request.urlopen(request).close()
+                    past_end = 200
+                except urllib.error.HTTPError as e:
+                    past_end = e.code
+                if suffix != audio[-100:] or past_end != 416:
+                    print(f"✗ Unexpected suffix or out of range responses: {len(suffix)}, {past_end}")
+                    return False
+                print("✓ Range requests served")
+                
+                if job.get_status()['rendered_pages'] != [0, 2]:
+                    print(f"✗ Unexpected rendered pages: {job.get_status()}")
+                    return False
+                print("✓ Empty pages are not rendered")
+                
+                # Concurrent requests share one rendering per voice and rate
+                sample_pdf = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyPDF2.pdf")
+                if os.path.exists(sample_pdf):
+                    jobs = []
+                    requests = [
+                        threading.Thread(target=lambda: jobs.append(service.start_book(sample_pdf)[1]))
+                        for _ in range(4)
+                    ]
+                    for request in requests:
+                        request.start()
+                    for request in requests:
+                        request.join()
+                    service.audio_converter.rate = 200
+                    _, faster = service.start_book(sample_pdf)
+                    if any(other is not jobs[0] for other in jobs) or faster is jobs[0]:
+                        print("✗ Renderings not shared per document, voice and rate")
+                        return False
+                    for job in jobs[:1] + [faster]:
+                        job.cancel()
+                        job.wait_done(10)
+                    print("✓ Concurrent requests share a rendering; other rates get their own")
+                    
+                    service.audio_converter.rate = 250
+                    _, job = service.start_book(sample_pdf)
+                    if not job.wait_done(30) or job.error or job.get_status()['total_pages'] != 1:
+                        print(f"✗ Book pages not listed by its rendering: {job.get_status()}")
+                        return False
+                    print("✓ Book pages classified and rendered on the render thread")
+            finally:
+                server.shutdown()
+                server.server_close()
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Streaming server test failed: {str(e)}")
+        return False
+
+def test_job_server():
+    """Test job submission, admission control and results with the fake TTS backend"""
+    print("\nTesting job server...")
+    
+    sample_pdf = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyPDF2.pdf")
+    if not os.path.exists(sample_pdf):
+        print("✓ Skipped (sample PDF not found)")
+        return True
+    
+    try:
+        import json
+        import tempfile
+        import threading
+        import time
+        import urllib.error
+        import urllib.request
+        from job_server import JobManager, JobServer
+        
+        with open(sample_pdf, 'rb') as f:
+            pdf_data = f.read()
+        
+        with tempfile.TemporaryDirectory() as temp_dir, cache_dir_override(temp_dir):
+            manager = JobManager(max_workers=1, max_queue=1, backend="fake")
+            server = JobServer(("127.0.0.1", 0), manager)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = f"http://127.0.0.1:{server.server_address[1]}"
+            
+            def post_job():
+                request = urllib.request.Request(
+                    f"{base_url}/jobs?rate=200", data=pdf_data,
+                    headers={"Content-Type": "application/pdf"}
+                )
+                with urllib.request.urlopen(request) as response:
+                    return json.load(response)
+            
+            def wait_for_job(job_id):
+                for _ in range(300):
+                    with urllib.request.urlopen(f"{base_url}/jobs/{job_id}") as response:
+                        status = json.load(response)
+                    if status['status'] not in ("queued", "running"):
+                        break
+                    time.sleep(0.1)
+                return status
+            
+            try:
+                job = post_job()
+                status = wait_for_job(job['id'])
+                
+                if status['status'] != "done" or not status['metrics']['characters_per_second']:
+                    print(f"✗ Job did not finish: {status}")
+                    return False
+                print("✓ Job converted by a worker process with metrics")
+                
+                with urllib.request.urlopen(f"{base_url}/jobs/{job['id']}/result") as response:
+                    if response.read(4) != b"RIFF":
+                        print("✗ Result is not a WAV file")
+                        return False
+                print("✓ Result downloaded")
+                
+                # Fill every slot, then the next submission is turned away
+                manager.admit()
+                manager.admit()
+                try:
+                    post_job()
+                    print("✗ Job accepted with a full queue")
+                    return False
+                except urllib.error.HTTPError as e:
+                    if e.code != 503:
+                        print(f"✗ Unexpected rejection status: {e.code}")
+                        return False
+                manager.release()
+                manager.release()
+                print("✓ Submissions rejected while the queue is full")
+                
+                # A worker dying breaks the pool; the next job gets a new one
+                try:
+                    manager.executor.submit(os._exit, 1).result()
+                except Exception:
+                    pass
+                status = wait_for_job(post_job()['id'])
+                if status['status'] != "done":
+                    print(f"✗ Job failed after a worker died: {status}")
+                    return False
+                print("✓ Worker pool recreated after a worker died")
+            finally:
+                server.shutdown()
+                server.server_close()
+                manager.shutdown()
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Job server test failed: {str(e)}")
+        return False
+
+def test_duration_planning():
+    """Test duration calibration and longest-first planning with splitting"""
+    print("\nTesting duration estimation...")
+    
+    try:
+        import tempfile
+        from duration_estimator import DurationEstimator, plan_work
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            model_path = os.path.join(temp_dir, "model.json")
+            estimator = DurationEstimator("fake", model_path)
+            text = "This sentence has exactly six words. " * 20
+            
+            nominal = estimator.estimate_audio_seconds(text, 120)
+            estimator.record(text, 120, audio_seconds=nominal * 2)
+            estimator.save()
+            
+            reloaded = DurationEstimator("fake", model_path)
+            if abs(reloaded.estimate_audio_seconds(text, 120) - nominal * 2) > 0.01:
+                print("✗ Calibration was not applied or persisted")
+                return False
+            print("✓ Calibration measured and persisted")
+            
+            chunks = [(0, "Short page."), (1, "A long sentence here. " * 200), (2, "Medium page. " * 20)]
+            items = plan_work(chunks, 4, lambda chunk: len(chunk))
+            
+            seconds = [item[3] for item in items]
+            long_parts = [item for item in items if item[0] == 1]
+            if seconds != sorted(seconds, reverse=True) or len(long_parts) < 2:
+                print(f"✗ Unexpected plan: {[(key, part, secs) for key, part, _, secs in items]}")
+                return False
+            if "".join(item[2] for item in sorted(long_parts, key=lambda item: item[1])) != chunks[1][1]:
+                print("✗ Split parts do not reassemble the chunk")
+                return False
+            print("✓ Oversized chunks split and scheduled longest first")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Duration estimation test failed: {str(e)}")
+        return False
+
+def test_incremental_export():
+    """Test that re-exporting a revised book only renders changed pages"""
+    print("\nTesting incremental export...")
+    
+    try:
+        import tempfile
+        from renderer import export_parallel, read_wav_layout
+        
+        pages = [(page, f"Page {page} says something. " * 20) for page in range(6)]
+        
+        with tempfile.TemporaryDirectory() as temp_dir, cache_dir_override(temp_dir):
+            output_path = os.path.join(temp_dir, "book.wav")
+            
+            success, message = export_parallel(pages, output_path, 2, "fake")
+            if not success:
+                print(f"✗ Export failed: {message}")
+                return False
+            
+            # One page revised, one page added
+            pages[2] = (2, "A corrected page. " * 10)
+            pages.append((6, "An appendix. " * 10))
+            success, message = export_parallel(pages, output_path, 2, "fake", incremental=True)
+            
+            reference_path = os.path.join(temp_dir, "reference.wav")
+            export_parallel(pages, reference_path, 2, "fake")
+            
+            if not success or "re-rendered 2 of 7 pages" not in message:
+                print(f"✗ Unexpected incremental export: {message}")
+                return False
+            print("✓ Only changed and new pages re-rendered")
+            
+            if read_wav_layout(output_path)[2] != read_wav_layout(reference_path)[2]:
+                print("✗ Incremental export differs from a full export")
+                return False
+            print("✓ Output reassembled from reused segments")
+            
+            # Marked audio is synthesized differently, so nothing is reused
+            success, message = export_parallel(pages, output_path, 2, "fake", incremental=True,
+                                               sync_map=True)
+            if not success or "re-rendered 7 of 7 pages" not in message:
+                print(f"✗ Unmarked segments reused for a sync-mapped export: {message}")
+                return False
+            success, message = export_parallel(pages, output_path, 2, "fake", incremental=True,
+                                               sync_map=True)
+            if not success or "re-rendered 0 of 7 pages" not in message:
+                print(f"✗ Marked segments not reused by the same export: {message}")
+                return False
+            print("✓ Segments only reused with the same segmentation")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Incremental export test failed: {str(e)}")
+        return False
+
+def test_distributed_rendering():
+    """Test shared-directory rendering with local worker processes"""
+    print("\nTesting distributed rendering...")
+    
+    import multiprocessing
+    import tempfile
+    from distributed import (submit_book, claim_task, run_worker, wait_and_assemble,
+                             requeue_expired, make_book_id, CLAIMED_DIR, FAILED_DIR)
+    from renderer import read_wav_layout
+    
+    chunks = [(page, f"Page {page} of the book. " * (5 + page)) for page in range(8)]
+    
+    with tempfile.TemporaryDirectory() as temp_dir, cache_dir_override(temp_dir):
+        root = os.path.join(temp_dir, "shared")
+        output_path = os.path.join(temp_dir, "book.wav")
+        
+        count = submit_book(root, "book1", chunks, output_path, {'rate': 150, 'voice': None})
+        
+        # A worker that crashed holding a claim long ago
+        task_name, _ = claim_task(root)
+        os.utime(os.path.join(root, CLAIMED_DIR, task_name), (0, 0))
+        
+        workers = [
+            multiprocessing.Process(target=run_worker, args=(root, "fake"),
+                                    kwargs={'exit_when_idle': True})
+            for _ in range(3)
+        ]
+        for worker in workers:
+            worker.start()
+        success, message = wait_and_assemble(root, "book1", poll_interval=0.1)
+        for worker in workers:
+            worker.join(30)
+        
+        assert success, f"Book not assembled: {message}"
+        assert not os.listdir(os.path.join(root, CLAIMED_DIR)), f"Book not assembled: {message}"
+        print(f"✓ {count} tasks rendered by 3 worker processes, expired claim recovered")
+        
+        assert read_wav_layout(output_path)[2] != 0, "Assembled audio is empty"
+        print("✓ Segments assembled")
+        
+        # A task whose workers keep dying is given up after max_attempts
+        submit_book(root, "book2", chunks[:1], output_path, {'rate': 150, 'voice': None})
+        for _ in range(2):
+            task_name, _ = claim_task(root)
+            os.utime(os.path.join(root, CLAIMED_DIR, task_name), (0, 0))
+            requeue_expired(root, "test", max_attempts=2)
+        success, message = wait_and_assemble(root, "book2", poll_interval=0.1, max_attempts=2)
+        assert not success, f"Failing task was retried without limit: {message}"
+        assert os.listdir(os.path.join(root, FAILED_DIR)) == [task_name], (
+            f"Failing task was retried without limit: {message}")
+        print("✓ Tasks given up after the retry cap")
+    
+    # Rate and voice are part of the book id
+    pdf_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyPDF2.pdf")
+    if os.path.exists(pdf_path):
+        slow, fast = {'rate': 150, 'voice': None}, {'rate': 200, 'voice': None}
+        assert make_book_id(pdf_path, slow) != make_book_id(pdf_path, fast), (
+            "Book id ignores the rendering settings")
+        print("✓ Book id depends on rate and voice")
+
+def _exit_once(marker_path):
+    """Pool task that kills its worker unless marker_path exists, then creates it"""
+    if not os.path.exists(marker_path):
+        try:
+            open(marker_path, 'w').close()
+        finally:
+            os._exit(1)
+    return "done"
+
+def test_autoscaling():
+    """Test scaling decisions and an autoscaled conversion"""
+    print("\nTesting autoscaling...")
+    
+    import tempfile
+    import time
+    from autoscale import scaling_decision, convert_adaptive, ScalablePool
+    from renderer import read_wav_layout
+    
+    mb = 2**20
+    cases = [
+        # (size, backlog, throughput, previous, cpu, rss total, expected size)
+        ((2, 10, 1.0, None, 0.3, 100 * mb), 3),
+        ((2, 10, 1.0, None, 0.95, 100 * mb), 2),
+        ((3, 10, 1.0, (2, 1.0), 0.3, 100 * mb), 2),
+        ((3, 10, 2.0, (2, 1.0), 0.3, 100 * mb), 4),
+        ((3, 10, 1.0, None, 0.3, 600 * mb), 2),
+        ((3, 1, 1.0, None, 0.3, 100 * mb), 1),
+    ]
+    for (size, backlog, throughput, previous, cpu, rss), expected in cases:
+        new_size, reason = scaling_decision(size, 1, 8, backlog, throughput, previous,
+                                            cpu, rss, 50 * mb, 500 * mb)
+        assert new_size == expected, (
+            f"Size {size} went to {new_size} instead of {expected} ({reason})")
+    print("✓ Pools grow with spare CPU, shrink without gain or over the memory ceiling")
+    
+    pool = ScalablePool("test", len, max_workers=2)
+    try:
+        pool.resize(2)
+        removed = pool.workers[-1].process
+        pool.resize(1)
+        assert [worker.process for worker in pool.stopping] == [removed], (
+            "Removed worker was not tracked until it exits")
+        removed.join(timeout=5)
+        pool.rss()
+        assert not removed.is_alive() and not pool.stopping, "Removed worker was not joined"
+    finally:
+        pool.shutdown()
+    print("✓ Removed workers are joined once they exit")
+    
+    # A task whose worker dies is retried once, then reported as failed
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pool = ScalablePool("test", _exit_once, max_workers=2)
+        try:
+            pool.resize(2)
+            pool.submit("retried", os.path.join(temp_dir, "died"))
+            pool.submit("failed", os.path.join(temp_dir, "missing", "died"))
+            results = {}
+            deadline = time.monotonic() + 60
+            while pool.pending and time.monotonic() < deadline:
+                result = pool.get_result(timeout=0.05)
+                if result is not None:
+                    results[result[0]] = result[1:]
+            assert not pool.pending and pool.size == 2, "Pool did not recover from dead workers"
+            assert results["retried"] == (True, "done"), (
+                f"Unexpected results after worker deaths: {results}")
+            assert not results["failed"][0], (
+                f"Unexpected results after worker deaths: {results}")
+        finally:
+            pool.shutdown()
+    print("✓ Tasks of dead workers retried once, then failed")
+    
+    pdf_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyPDF2.pdf")
+    if not os.path.exists(pdf_path):
+        print("! Sample PDF not found, skipping conversion")
+        return
+    
+    with tempfile.TemporaryDirectory() as temp_dir, cache_dir_override(temp_dir):
+        output_path = os.path.join(temp_dir, "book.wav")
+        success, result = convert_adaptive(pdf_path, output_path, "fake",
+                                           max_workers=2, verbose=False)
+        
+        assert success, f"Autoscaled conversion failed: {result}"
+        assert read_wav_layout(output_path)[2] != 0, f"Autoscaled conversion failed: {result}"
+        assert {decision[1] for decision in result['decisions']} == {"extract", "synthesize"}, (
+            "Export did not size its synthesis pool with the autoscaler")
+        print(f"✓ {result['pages']} pages converted with {len(result['decisions'])} scaling decisions")
+
+def test_sync_map():
+    """Test sentence-level sync maps and subtitles written with an export"""
+    print("\nTesting sync map...")
+    
+    try:
+        import tempfile
+        from renderer import export_parallel, read_wav_layout
+        from sync_map import SyncMap, get_sync_map_path, LEVEL_PAGE, LEVEL_PARAGRAPH
+        
+        pages = [
+            (0, "First sentence here. Second one follows.\n\nA new paragraph starts."),
+            (1, "Page two opens. " * 3),
+            (2, "The last page ends the book.")
+        ]
+        
+        with tempfile.TemporaryDirectory() as temp_dir, cache_dir_override(temp_dir):
+            output_path = os.path.join(temp_dir, "book.wav")
+            success, message = export_parallel(pages, output_path, 2, "fake",
+                                               sync_map=True, subtitles="vtt")
+            
+            sync_map = SyncMap.load(get_sync_map_path(output_path)) if success else None
+            if sync_map is None or len(sync_map) != 7:
+                print(f"✗ Sync map not written: {message}")
+                return False
+            
+            _, data_offset, data_size = read_wav_layout(output_path)
+            page_two = sync_map.seek(1)
+            if sync_map.locate(page_two) != (LEVEL_PAGE, 1, 0):
+                print("✗ Page start not found")
+                return False
+            if sync_map.locate(sync_map.seek(0, 45))[0] != LEVEL_PARAGRAPH:
+                print("✗ Paragraph start not marked")
+                return False
+            if not data_offset < sync_map.byte_offset(sync_map.seek(2), data_offset) < data_offset + data_size:
+                print("✗ Seek offset outside the audio")
+                return False
+            print("✓ Pages, paragraphs and sentences located in the exported audio")
+            
+            with open(os.path.join(temp_dir, "book.vtt"), encoding='utf-8') as f:
+                subtitles = f.read()
+            if not subtitles.startswith("WEBVTT") or "A new paragraph starts." not in subtitles:
+                print("✗ Subtitles not written")
+                return False
+            print("✓ WebVTT subtitles written")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Sync map test failed: {str(e)}")
+        return False
+
+def test_bounded_pipeline():
+    """Test that the conversion pipeline stays within its memory budget"""
+    print("\nTesting bounded pipeline...")
+    
+    try:
+        import tempfile
+        import threading
+        from audio_converter import AudioConverter
+        from pipeline import ByteQueue, convert_pages, normalize_text
+        from renderer import read_wav_layout
+        
+        # A full queue blocks its producer until the consumer catches up
+        byte_queue = ByteQueue(10)
+        byte_queue.put("first", 8)
+        producer = threading.Thread(target=byte_queue.put, args=("second", 8))
+        producer.start()
+        producer.join(0.2)
+        if not producer.is_alive():
+            print("✗ Producer not blocked by a full queue")
+            return False
+        byte_queue.get()
+        producer.join(5)
+        if producer.is_alive() or byte_queue.get() != ("second", 8):
+            print("✗ Producer not released")
+            return False
+        print("✓ Producers block while a queue is full")
+        
+        if normalize_text("  hyphen-\nated   words ") != "hyphenated words":
+            print("✗ Text not normalized")
+            return False
+        
+        budget = 256 * 1024
+        pages = {page: (f"Page {page} keeps talking. " * 40) for page in range(200)}
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = os.path.join(temp_dir, "book.wav")
+            progress = []
+            success, stats = convert_pages(lambda page: (True, pages[page]), sorted(pages),
+                                           output_path, AudioConverter("fake"), budget,
+                                           progress_callback=lambda done, total: progress.append(done))
+            if not success:
+                print(f"✗ Conversion failed: {stats}")
+                return False
+            
+            if read_wav_layout(output_path)[2] != stats['data_size'] or progress[-1] != 200:
+                print("✗ Output incomplete")
+                return False
+            if stats['peak_bytes'] > budget * 1.1:
+                print(f"✗ Held {stats['peak_bytes']} bytes with a budget of {budget}")
+                return False
+            print(f"✓ 200 pages converted holding at most {stats['peak_bytes'] // 1024} KB")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Bounded pipeline test failed: {str(e)}")
+        return False
+
+def test_profiling():
+    """Test opt-in profiling of a conversion run"""
+    print("\nTesting profiling...")
+    
+    try:
+        import json
+        import tempfile
+        from audio_converter import AudioConverter
+        from job_server import parse_job_options
+        from pipeline import convert_pages
+        from profiling import Profiler, MODE_CPROFILE, MODE_SAMPLE, SUMMARY_FILE, get_profile_dir
+        from renderer import export_parallel
+        
+        converter = AudioConverter("fake")
+        pages = {page: f"Page {page} is profiled. " * 30 for page in range(20)}
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for mode in (MODE_CPROFILE, MODE_SAMPLE):
+                report_dir = os.path.join(temp_dir, mode)
+                with Profiler(report_dir, mode) as profiler:
+                    success, _ = convert_pages(lambda page: (True, pages[page]), sorted(pages),
+                                               os.path.join(temp_dir, "book.wav"), converter)
+                success, report_path = profiler.write_report()
+                
+                if not success:
+                    print(f"✗ Report not written: {report_path}")
+                    return False
+                with open(os.path.join(report_dir, SUMMARY_FILE)) as f:
+                    summary = json.load(f)
+                if summary['timers'].get('tts.save_to_audio_file', {}).get('calls') != 20:
+                    print(f"✗ Hot-path timers missing in {mode} mode")
+                    return False
+                if summary['page_boundaries'] < 20 or profiler.last_snapshot is None:
+                    print("✗ Memory not traced at page boundaries")
+                    return False
+                print(f"✓ {mode} report written with stages {', '.join(summary['stages'])}")
+            
+            if not os.path.exists(os.path.join(temp_dir, MODE_CPROFILE, "synthesize.prof")):
+                print("✗ Stage profile not saved")
+                return False
+            
+            output_path = os.path.join(temp_dir, "export.wav")
+            with cache_dir_override(temp_dir):
+                success, message = export_parallel(sorted(pages.items()), output_path, 2, "fake",
+                                                   profile=MODE_CPROFILE)
+            with open(os.path.join(get_profile_dir(output_path), SUMMARY_FILE)) as f:
+                summary = json.load(f)
+            if not success or summary['timers']['tts.save_to_audio_file']['calls'] != 20:
+                print(f"✗ Export not profiled: {message}")
+                return False
+            print("✓ Export profiled with the render times of its workers")
+        
+        # Timers stay idle without a running profiler
+        if converter.save_to_audio_file("", "unused.wav")[0] or profiler.timers['tts.save_to_audio_file'][0] != 20:
+            print("✗ Timer recorded outside a profiled run")
+            return False
+        
+        if parse_job_options("profile=bogus")[0] or not parse_job_options("profile=sample")[0]:
+            print("✗ Profiling option not validated")
+            return False
+        print("✓ Profiling is off outside profiled runs")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Profiling test failed: {str(e)}")
+        return False
+
+def test_soak_harness():
+    """Test the soak harness on a short run and against a deliberate leak"""
+    print("\nTesting soak harness...")
+    
+    try:
+        import tempfile
+        from soak import SoakTest
+        
+        pdf_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyPDF2.pdf")
+        if not os.path.exists(pdf_path):
+            pdf_path = None
+        report = SoakTest(pdf_path).run(iterations=100)
+        if not report['passed']:
+            print(f"✗ Resources grew: {'; '.join(report['failures'])}")
+            return False
+        print(f"✓ 100 iterations without growth ({report['seconds']}s)")
+        
+        class LeakingSoakTest(SoakTest):
+            def iterate(self, converter, audio_path):
+                leaked.append(tempfile.TemporaryFile())
+                return super().iterate(converter, audio_path)
+        
+        leaked = []
+        try:
+            report = LeakingSoakTest().run(iterations=100)
+        finally:
+            for leaked_file in leaked:
+                leaked_file.close()
+        
+        if report['passed'] or not report['failures'][0].startswith("open_files"):
+            print("✗ Leaked file handles not detected")
+            return False
+        print("✓ Leaked file handles detected")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Soak harness test failed: {str(e)}")
+        return False
+
+def test_watch_folder():
+    """Test the watch-folder daemon with complete, partial and duplicate files"""
+    print("\nTesting watch folder...")
+    
+    try:
+        import shutil
+        import tempfile
+        import threading
+        import time
+        from library import Library
+        from watch_folder import WatchFolderDaemon, InotifyWatcher
+        
+        pdf_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyPDF2.pdf")
+        if not os.path.exists(pdf_path):
+            print("! Sample PDF not found, skipping watch folder test")
+            return True
+        with open(pdf_path, 'rb') as f:
+            pdf_data = f.read()
+        
+        for force_polling in (False, True):
+            if not force_polling and not InotifyWatcher.available():
+                continue
+            
+            with tempfile.TemporaryDirectory() as temp_dir, cache_dir_override(temp_dir):
+                watch_dir = os.path.join(temp_dir, "inbox")
+                output_dir = os.path.join(temp_dir, "out")
+                os.makedirs(os.path.join(watch_dir, "nested"))
+                library = Library(os.path.join(temp_dir, "library.db"))
+                daemon = WatchFolderDaemon(watch_dir, output_dir, library, max_workers=1,
+                                           backend="fake", debounce_seconds=0.3,
+                                           force_polling=force_polling, verbose=False)
+                stop_event = threading.Event()
+                thread = threading.Thread(target=daemon.run, args=(stop_event,), daemon=True)
+                thread.start()
+                
+                try:
+                    time.sleep(0.3)
+                    
+                    # A file arriving in pieces, then a copy of the same book
+                    partial_path = os.path.join(watch_dir, "nested", "book.pdf")
+                    with open(partial_path, 'wb') as f:
+                        f.write(pdf_data[:len(pdf_data) // 2])
+                    time.sleep(0.5)
+                    with open(partial_path, 'ab') as f:
+                        f.write(pdf_data[len(pdf_data) // 2:])
+                    shutil.copy(pdf_path, os.path.join(watch_dir, "copy.pdf"))
+                    
+                    deadline = time.time() + 30
+                    while daemon.stats['converted'] + daemon.stats['duplicates'] < 2 and time.time() < deadline:
+                        time.sleep(0.1)
+                finally:
+                    stop_event.set()
+                    thread.join(30)
+                    library.close()
+                
+                watcher_name = "polling" if force_polling else "inotify"
+                outputs = [name for _, _, files in os.walk(output_dir) for name in files]
+                if daemon.stats['converted'] != 1 or daemon.stats['duplicates'] != 1 or len(outputs) != 1:
+                    print(f"✗ Unexpected results with {watcher_name}: {daemon.stats}, {outputs}")
+                    return False
+                print(f"✓ {watcher_name}: partial file waited for, duplicate skipped")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Watch folder test failed: {str(e)}")
+        return False
+
+def test_pdf_probe():
+    """Test the metadata probe against a full parse and a quick library import"""
+    print("\nTesting PDF probe...")
+    
+    try:
+        import shutil
+        import tempfile
+        import PyPDF2
+        from cache_utils import compute_file_hash
+        from library import Library
+        from pdf_probe import probe_pdf, probe_directory
+        
+        pdf_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyPDF2.pdf")
+        if not os.path.exists(pdf_path):
+            print("! Sample PDF not found, skipping PDF probe test")
+            return True
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # A classic xref table with a UTF-16 title, next to the sample's xref stream
+            writer = PyPDF2.PdfWriter()
+            for _ in range(3):
+                writer.add_blank_page(100, 100)
+            writer.add_metadata({'/Title': 'Caf\u00e9 \u2014 \u03b1', '/Author': 'Someone'})
+            writer.add_outline_item("One", 0)
+            writer.add_outline_item("Two", 2)
+            titled_path = os.path.join(temp_dir, "titled.pdf")
+            writer.write(titled_path)
+            shutil.copy(pdf_path, os.path.join(temp_dir, "sample.pdf"))
+            with open(os.path.join(temp_dir, "broken.pdf"), 'wb') as f:
+                f.write(b"not a pdf")
+            
+            for path in (pdf_path, titled_path):
+                success, info = probe_pdf(path)
+                reader = PyPDF2.PdfReader(path)
+                metadata = reader.metadata or {}
+                expected = (len(reader.pages), metadata.get('/Title') or '', metadata.get('/Author') or '')
+                if not success or (info['page_count'], info['title'] or '', info['author'] or '') != expected:
+                    print(f"✗ Probe of {path} disagrees with PyPDF2: {info} vs {expected}")
+                    return False
+                if info['method'] != 'probe' or info['encrypted']:
+                    print(f"✗ Probe of {path} fell back or misread encryption: {info}")
+                    return False
+            print("✓ Page count, title and author match a full parse")
+            
+            success, results = probe_directory(temp_dir, max_workers=2)
+            outcomes = {os.path.basename(path): result[0] for path, result in results}
+            if not success or outcomes != {"broken.pdf": False, "sample.pdf": True, "titled.pdf": True}:
+                print(f"✗ Unexpected directory probe results: {results}")
+                return False
+            print("✓ Directory probed, broken file reported")
+            
+            library = Library(os.path.join(temp_dir, "library.db"))
+            try:
+                success, summary = library.import_directory(temp_dir, max_workers=2, metadata_only=True)
+                document = library.get_document(compute_file_hash(titled_path))
+            finally:
+                library.close()
+            if not success or summary['added'] != 2 or document is None:
+                print(f"✗ Quick import failed: {summary}")
+                return False
+            if document['page_count'] != 3 or document['text_cache_path'] is not None:
+                print(f"✗ Unexpected quick import record: {document}")
+                return False
+            print("✓ Quick import recorded metadata without extracting text")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ PDF probe test failed: {str(e)}")
+        return False
+
+def test_encrypted_pdf():
+    """Test password handling, key sharing and the encrypted text cache"""
+    print("\nTesting encrypted PDFs...")
+    
+    try:
+        import tempfile
+        import PyPDF2
+        from library import Library, preprocess_document
+        from pdf_reader import PDFReader
+        from text_store import ENCRYPTION_AVAILABLE
+        
+        pdf_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PyPDF2.pdf")
+        if not os.path.exists(pdf_path):
+            print("! Sample PDF not found, skipping encrypted PDF test")
+            return True
+        
+        with tempfile.TemporaryDirectory() as temp_dir, cache_dir_override(temp_dir):
+            writer = PyPDF2.PdfWriter()
+            for page in PyPDF2.PdfReader(pdf_path).pages:
+                writer.add_page(page)
+            writer.encrypt("secret")
+            encrypted_path = os.path.join(temp_dir, "locked.pdf")
+            writer.write(encrypted_path)
+            
+            plain_reader = PDFReader()
+            plain_reader.open_pdf(pdf_path)
+            _, expected = plain_reader.get_page_text(0)
+            plain_reader.close_pdf()
+            
+            reader = PDFReader()
+            for password in (None, "wrong"):
+                success, message = reader.open_pdf(encrypted_path, password=password)
+                if success or not reader.needs_password:
+                    print(f"✗ Opened without the right password: {message}")
+                    return False
+            
+            success, message = reader.open_pdf(encrypted_path, password="secret")
+            _, text = reader.get_page_text(0)
+            if not success or text != expected or reader.decryption_key is None:
+                print(f"✗ Decrypted text differs: {message}")
+                return False
+            
+            # A second reader, as in a worker process, opens with the key alone
+            worker_reader = PDFReader()
+            success, _ = worker_reader.open_pdf(encrypted_path, decryption_key=reader.decryption_key)
+            _, worker_text = worker_reader.get_page_text(0)
+            worker_reader.close_pdf()
+            if not success or worker_text != expected:
+                print("✗ Shared decryption key did not open the PDF")
+                return False
+            
+            wrong_key = bytes(byte ^ 0xff for byte in reader.decryption_key)
+            success, message = worker_reader.open_pdf(encrypted_path, decryption_key=wrong_key)
+            if success:
+                print("✗ A wrong decryption key was accepted")
+                return False
+            print("✓ Password checked, key shared with another reader")
+            
+            # Without key sharing every reader decrypts with the password
+            import pdf_reader
+            shared_key_supported = pdf_reader.SHARED_KEY_SUPPORTED
+            pdf_reader.SHARED_KEY_SUPPORTED = False
+            try:
+                fallback_reader = PDFReader()
+                wrong, _ = fallback_reader.open_pdf(encrypted_path, password="wrong")
+                success, message = fallback_reader.open_pdf(encrypted_path, password="secret")
+                password_key = fallback_reader.decryption_key
+                _, fallback_text = fallback_reader.get_page_text(0)
+                fallback_reader.close_pdf()
+                success_worker, _ = worker_reader.open_pdf(encrypted_path, decryption_key=password_key)
+                _, worker_text = worker_reader.get_page_text(0)
+                worker_reader.close_pdf()
+            finally:
+                pdf_reader.SHARED_KEY_SUPPORTED = shared_key_supported
+            if wrong or not success or fallback_text != expected or password_key is None:
+                print(f"✗ Password fallback did not open the PDF: {message}")
+                return False
+            if not success_worker or worker_text != expected:
+                print("✗ Password key did not open the PDF in another reader")
+                return False
+            print("✓ Password fallback opens the PDF without PyPDF2 internals")
+            
+            library = Library(os.path.join(temp_dir, "library.db"))
+            try:
+                success, record = preprocess_document(encrypted_path, reader=reader)
+                if not success or record['text_cache_path'] is not None:
+                    print(f"✗ Decrypted text cached without being asked to: {record}")
+                    return False
+                
+                success, record = preprocess_document(encrypted_path, reader=reader,
+                                                      cache_decrypted_text=True)
+                if not ENCRYPTION_AVAILABLE:
+                    if record['text_cache_path'] is not None:
+                        print("✗ Decrypted text cached without encryption support")
+                        return False
+                    print("! cryptography not installed, encrypted text cache disabled")
+                    return True
+                library.add_document(record)
+                with open(record['text_cache_path'], 'rb') as f:
+                    cached = f.read()
+                page_texts = library.load_cached_texts(record['file_hash'], reader.decryption_key)
+                unreadable = library.load_cached_texts(record['file_hash'])
+            finally:
+                library.close()
+                reader.close_pdf()
+            
+            sample = expected.strip().split("\n")[0].encode('utf-8')
+            if sample in cached or page_texts is None or page_texts[0] != expected or unreadable is not None:
+                print("✗ Text cache is not encrypted at rest")
+                return False
+            print("✓ Text cache encrypted at rest and readable with the key")
+        
+        return True
+        
+    except Exception as e:
+        print(f"✗ Encrypted PDF test failed: {str(e)}")
+        return False
+
+def test_speech_jobs():
+    """Test speech and save handles: completion, progress events and cancellation"""
+    print("\nTesting speech jobs...")
+    
+    import tempfile
+    import threading
+    from audio_converter import (AudioConverter, EVENT_CHUNK_STARTED, EVENT_WORD,
+                                 EVENT_CHUNK_FINISHED)
+    
+    converter = AudioConverter("fake")
+    text = "First sentence here. Second one! And a third?"
+    events = []
+    listeners = {
+        EVENT_CHUNK_STARTED: lambda index, start, end: events.append(('chunk', index, start, end)),
+        EVENT_WORD: lambda offset: events.append(('word', offset)),
+        EVENT_CHUNK_FINISHED: lambda index, completed: events.append(('done', index, completed))
+    }
+    
+    finished = threading.Event()
+    job = converter.speak(text, listeners)
+    job.add_done_callback(lambda job: finished.set())
+    assert job.result(timeout=5) == (True, "Speech completed"), (
+        f"Unexpected speech result: {job.result()}")
+    assert finished.wait(5), f"Unexpected speech result: {job.result()}"
+    chunks = [event for event in events if event[0] == 'chunk']
+    words = [event[1] for event in events if event[0] == 'word']
+    assert len(chunks) == 3, f"Unexpected progress events: {events}"
+    assert len(words) == len(text.split()), f"Unexpected progress events: {events}"
+    assert ('done', 2, True) in events, f"Unexpected progress events: {events}"
+    print("✓ Speech job completed with chunk and word events")
+    
+    # A word listener that holds the engine keeps the job running
+    started = threading.Event()
+    release = threading.Event()
+    
+    def hold(offset):
+        started.set()
+        release.wait(5)
+    
+    job = converter.speak(text, {EVENT_WORD: hold})
+    started.wait(5)
+    busy = converter.is_speaking
+    second = converter.speak("Another text.")
+    save = converter.save(text, os.path.join(tempfile.gettempdir(), "refused.wav"))
+    cancelled = job.cancel()
+    release.set()
+    result = job.result(timeout=5)
+    assert busy, "A running job was not reported as busy or could not be cancelled"
+    assert second.result() == (False, "Already speaking"), (
+        "A running job was not reported as busy or could not be cancelled")
+    assert cancelled, "A running job was not reported as busy or could not be cancelled"
+    assert save.result() == (False, "TTS engine is busy"), (
+        f"Save overlapping speech was not refused: {save.result()}")
+    assert result == (False, "Speech stopped"), f"Cancelled job finished with {result}"
+    assert not converter.is_speaking, f"Cancelled job finished with {result}"
+    print("✓ Running job cancelled, overlapping speech and saves refused")
+    
+    # Speech started right after a stop follows the stopped job
+    started.clear()
+    release.clear()
+    job = converter.speak(text, {EVENT_WORD: hold})
+    started.wait(5)
+    converter.stop_speech()
+    follow = converter.speak("Jump to a search hit.")
+    release.set()
+    assert not job.result(timeout=5)[0], f"Speech after a stop failed: {follow.result()}"
+    assert follow.result(timeout=5) == (True, "Speech completed"), (
+        f"Speech after a stop failed: {follow.result()}")
+    print("✓ Speech after stop_speech waits for the stopped job")
+    
+    # A job cancelled while it waits resolves, so done callbacks can read it
+    started.clear()
+    release.clear()
+    job = converter.speak(text, {EVENT_WORD: hold})
+    started.wait(5)
+    converter.stop_speech()
+    queued = converter.speak("Never spoken.")
+    statuses = []
+    queued.add_done_callback(lambda job: statuses.append((job.result(), job.stop_requested)))
+    cancelled = queued.cancel()
+    release.set()
+    job.result(timeout=5)
+    assert cancelled, f"Cancelled queued job did not resolve for its callback: {statuses}"
+    assert statuses == [((False, "Speech cancelled"), True)], (
+        f"Cancelled queued job did not resolve for its callback: {statuses}")
+    assert not queued.cancelled(), (
+        f"Cancelled queued job did not resolve for its callback: {statuses}")
+    after = converter.speak("After a cancelled job.")
+    assert after.result(timeout=5) == (True, "Speech completed"), (
+        "Speech after a cancelled queued job failed")
+    print("✓ Queued job cancelled with a result instead of CancelledError")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        saved = []
+        job = converter.save(text, os.path.join(temp_dir, "out.wav"),
+                             {EVENT_CHUNK_FINISHED: lambda index, completed: saved.append(index)})
+        success, message = job.result(timeout=5)
+        marked = converter.save(text, os.path.join(temp_dir, "marked.wav"), sentence_marks=True)
+        success_marked, _, marks = marked.result(timeout=5)
+        assert success, f"Save jobs failed: {message}, {saved}, {marks}"
+        assert saved == [0], f"Save jobs failed: {message}, {saved}, {marks}"
+        assert success_marked, f"Save jobs failed: {message}, {saved}, {marks}"
+        assert len(marks) == 3, f"Save jobs failed: {message}, {saved}, {marks}"
+    print("✓ Save jobs resolved with their results")
+    
+    converter.cleanup()
+
 def create_sample_pdf():
     """Create a simple sample PDF for testing"""
     try:
@@ -140,6 +1766,106 @@ def main():
     if not test_pdf_reader():
         all_passed = False
     
+    # Test fast extractor
+    if not passes(test_fast_extractor):
+        all_passed = False
+    
+    # Test page classification
+    if not test_page_classification():
+        all_passed = False
+    
+    # Test sentence splitting
+    if not passes(test_sentence_splitting):
+        all_passed = False
+    
+    # Test reading text
+    if not passes(test_reading_text):
+        all_passed = False
+    
+    # Test search index
+    if not passes(test_search_index):
+        all_passed = False
+    
+    # Test library
+    if not test_library():
+        all_passed = False
+    
+    # Test position tracking
+    if not passes(test_position_tracking):
+        all_passed = False
+    
+    # Test shared document
+    if not test_shared_document():
+        all_passed = False
+    
+    # Test load cancellation
+    if not test_load_cancellation():
+        all_passed = False
+    
+    # Test text store
+    if not passes(test_text_store):
+        all_passed = False
+    
+    # Test async API
+    if not test_async_api():
+        all_passed = False
+    
+    # Test streaming server
+    if not test_streaming_server():
+        all_passed = False
+    
+    # Test job server
+    if not test_job_server():
+        all_passed = False
+    
+    # Test duration estimation
+    if not test_duration_planning():
+        all_passed = False
+    
+    # Test incremental export
+    if not test_incremental_export():
+        all_passed = False
+    
+    # Test distributed rendering
+    if not passes(test_distributed_rendering):
+        all_passed = False
+    
+    # Test autoscaling
+    if not passes(test_autoscaling):
+        all_passed = False
+    
+    # Test sync map
+    if not test_sync_map():
+        all_passed = False
+    
+    # Test bounded pipeline
+    if not test_bounded_pipeline():
+        all_passed = False
+    
+    # Test profiling
+    if not test_profiling():
+        all_passed = False
+    
+    # Test soak harness
+    if not test_soak_harness():
+        all_passed = False
+    
+    # Test watch folder
+    if not test_watch_folder():
+        all_passed = False
+    
+    # Test PDF probe
+    if not test_pdf_probe():
+        all_passed = False
+    
+    # Test encrypted PDFs
+    if not test_encrypted_pdf():
+        all_passed = False
+    
+    # Test speech jobs
+    if not passes(test_speech_jobs):
+        all_passed = False
+    
     print("\n" + "=" * 45)
     
     if all_passed:
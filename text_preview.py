@@ -0,0 +1,250 @@
+"""
+Text Preview Module
+Virtualized text preview that only keeps a small window of pages in the
+Tk Text widget and loads more pages as the user scrolls
+"""
+import tkinter as tk
+from tkinter import ttk
+from collections import OrderedDict
+
+# Number of pages materialized in the Text widget at once
+WINDOW_PAGES = 5
+
+# Number of extracted page texts kept in memory
+CACHE_PAGES = 50
+
+# Load another page when the view is this close (fraction) to either edge
+EDGE_THRESHOLD = 0.15
+
+
+class VirtualTextPreview:
+    def __init__(self, parent):
+        self.page_source = None
+        self.total_pages = 0
+        self.first_page = 0
+        self.last_page = -1
+        self.page_cache = OrderedDict()
+        self.edge_check_pending = False
+        
+        self.frame = tk.Frame(parent)
+        
+        self.text_widget = tk.Text(
+            self.frame,
+            wrap="word",
+            width=60,
+            height=10,
+            font=("Arial", 10),
+            state="disabled"
+        )
+        self.text_widget.tag_configure("page_header", foreground="gray", font=("Arial", 8, "italic"))
+        self.text_widget.tag_configure("speaking", background="yellow")
+        
+        # The scrollbar represents the whole book, not just the loaded window
+        self.scrollbar = ttk.Scrollbar(self.frame, orient="vertical", command=self.on_scrollbar)
+        self.text_widget.configure(yscrollcommand=self.on_text_scroll)
+        
+        self.text_widget.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+        
+    def pack(self, **kwargs):
+        """Pack the preview frame"""
+        self.frame.pack(**kwargs)
+        
+    def set_document(self, page_source, total_pages):
+        """Attach a document
+        
+        page_source is a callable taking a 0-based page number and returning
+        (success, text), such as PDFReader.get_page_text.
+        """
+        self.clear()
+        self.page_source = page_source
+        self.total_pages = total_pages
+        
+    def clear(self):
+        """Detach the document and empty the widget"""
+        self.page_source = None
+        self.total_pages = 0
+        self.page_cache.clear()
+        self._clear_window()
+        
+    def set_page_text(self, page_number, text):
+        """Store already extracted page text so it is not extracted again"""
+        self.page_cache[page_number] = text
+        self.page_cache.move_to_end(page_number)
+        
+        while len(self.page_cache) > CACHE_PAGES:
+            self.page_cache.popitem(last=False)
+            
+    def get_page_text(self, page_number):
+        """Get page text from the cache or the page source"""
+        if page_number in self.page_cache:
+            self.page_cache.move_to_end(page_number)
+            return True, self.page_cache[page_number]
+            
+        if self.page_source is None:
+            return False, "No document loaded"
+            
+        success, text = self.page_source(page_number)
+        if success:
+            self.set_page_text(page_number, text)
+            
+        return success, text
+        
+    def show_page(self, page_number):
+        """Scroll the preview to the start of a page"""
+        if not 0 <= page_number < self.total_pages:
+            return
+            
+        if not self.first_page <= page_number <= self.last_page:
+            self._materialize_around(page_number)
+            
+        self.text_widget.yview(f"header_{page_number}")
+        
+    def highlight(self, page_number, start, end):
+        """Highlight characters start..end of a page (e.g. the sentence being spoken)"""
+        if not 0 <= page_number < self.total_pages:
+            return
+            
+        if not self.first_page <= page_number <= self.last_page:
+            self._materialize_around(page_number)
+            
+        start_index = f"page_{page_number} + {start} chars"
+        end_index = f"page_{page_number} + {end} chars"
+        
+        self.text_widget.tag_remove("speaking", "1.0", tk.END)
+        self.text_widget.tag_add("speaking", start_index, end_index)
+        self.text_widget.see(start_index)
+        
+    def clear_highlight(self):
+        """Remove the spoken sentence highlight"""
+        self.text_widget.tag_remove("speaking", "1.0", tk.END)
+        
+    def on_text_scroll(self, first, last):
+        """Map the Text widget's view onto the whole-book scrollbar"""
+        first, last = float(first), float(last)
+        
+        window_pages = self.last_page - self.first_page + 1
+        if self.total_pages and window_pages > 0:
+            book_first = (self.first_page + first * window_pages) / self.total_pages
+            book_last = (self.first_page + last * window_pages) / self.total_pages
+            self.scrollbar.set(book_first, book_last)
+        else:
+            self.scrollbar.set(first, last)
+            
+        # Extend the window outside of the scroll callback
+        if not self.edge_check_pending and window_pages > 0:
+            self.edge_check_pending = True
+            self.text_widget.after_idle(self._check_edges, first, last)
+            
+    def on_scrollbar(self, *args):
+        """Handle scrollbar drags and clicks"""
+        if not self.total_pages:
+            self.text_widget.yview(*args)
+            return
+            
+        if args[0] == "moveto":
+            position = float(args[1]) * self.total_pages
+            page_number = max(0, min(self.total_pages - 1, int(position)))
+            
+            if not self.first_page <= page_number <= self.last_page:
+                self._materialize_around(page_number)
+                
+            window_pages = self.last_page - self.first_page + 1
+            local = (position - self.first_page) / window_pages
+            self.text_widget.yview("moveto", max(0.0, min(1.0, local)))
+        else:
+            # "scroll" by units or pages; the edge check loads more pages
+            self.text_widget.yview(*args)
+            
+    def _check_edges(self, first, last):
+        """Load neighbouring pages when the view nears the window edges"""
+        self.edge_check_pending = False
+        
+        if first < EDGE_THRESHOLD and self.first_page > 0:
+            self._prepend_page()
+        elif last > 1 - EDGE_THRESHOLD and self.last_page < self.total_pages - 1:
+            self._append_page()
+            
+    def _materialize_around(self, page_number):
+        """Replace the window with pages surrounding page_number"""
+        self._clear_window()
+        
+        first = max(0, page_number - WINDOW_PAGES // 2)
+        last = min(self.total_pages - 1, first + WINDOW_PAGES - 1)
+        first = max(0, last - WINDOW_PAGES + 1)
+        
+        self.first_page = first
+        self.last_page = first - 1
+        
+        for _ in range(first, last + 1):
+            self._append_page(trim=False)
+            
+    def _clear_window(self):
+        """Remove all materialized pages"""
+        self.text_widget.config(state="normal")
+        self.text_widget.delete("1.0", tk.END)
+        self.text_widget.config(state="disabled")
+        
+        for mark in self.text_widget.mark_names():
+            if mark.startswith(("header_", "page_")):
+                self.text_widget.mark_unset(mark)
+                
+        self.first_page = 0
+        self.last_page = -1
+        
+    def _page_content(self, page_number):
+        """Build the header and body inserted for a page"""
+        success, text = self.get_page_text(page_number)
+        if not success:
+            text = f"[{text}]"
+            
+        return f"--- Page {page_number + 1} ---\n", text + "\n"
+        
+    def _append_page(self, trim=True):
+        """Materialize the page after the window"""
+        page_number = self.last_page + 1
+        header, body = self._page_content(page_number)
+        
+        self.text_widget.config(state="normal")
+        index = self.text_widget.index("end-1c")
+        self.text_widget.insert(index, header, "page_header", body)
+        self.text_widget.mark_set(f"header_{page_number}", index)
+        self.text_widget.mark_set(f"page_{page_number}", f"{index} + {len(header)} chars")
+        self.last_page = page_number
+        
+        if trim and self.last_page - self.first_page + 1 > WINDOW_PAGES:
+            self._drop_page(self.first_page)
+            self.first_page += 1
+            
+        self.text_widget.config(state="disabled")
+        
+    def _prepend_page(self):
+        """Materialize the page before the window, keeping the view steady"""
+        page_number = self.first_page - 1
+        header, body = self._page_content(page_number)
+        
+        self.text_widget.config(state="normal")
+        self.text_widget.mark_set("view_top", "@0,0")
+        self.text_widget.insert("1.0", header, "page_header", body)
+        self.text_widget.mark_set(f"header_{page_number}", "1.0")
+        self.text_widget.mark_set(f"page_{page_number}", f"1.0 + {len(header)} chars")
+        self.first_page = page_number
+        
+        if self.last_page - self.first_page + 1 > WINDOW_PAGES:
+            self._drop_page(self.last_page)
+            self.last_page -= 1
+            
+        self.text_widget.yview("view_top")
+        self.text_widget.mark_unset("view_top")
+        self.text_widget.config(state="disabled")
+        
+    def _drop_page(self, page_number):
+        """Remove a materialized page from either end of the window"""
+        start = f"header_{page_number}"
+        if page_number == self.last_page:
+            end = "end-1c"
+        else:
+            end = f"header_{page_number + 1}"
+            
+        self.text_widget.delete(start, end)
+        self.text_widget.mark_unset(f"header_{page_number}", f"page_{page_number}")
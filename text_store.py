@@ -0,0 +1,242 @@
+"""
+Text Store Module
+Whole-book text held as one UTF-8 buffer with an array-backed page offset table
+
+Stores of encrypted PDFs can be saved encrypted at rest under a key derived
+from the PDF's own file key, so the text cache is no easier to read than the
+PDF. They use AES-GCM from the optional cryptography package; without it
+encrypted stores can be neither written nor read.
+"""
+import hashlib
+import hmac
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_right
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = None
+
+# On-disk format: magic, page count, byte offsets, character offsets, UTF-8 text
+STORE_MAGIC = b"ABTXT1\n"
+STORE_EXTENSION = ".abtx"
+
+# Separator written after every page, matching PDFReader.get_all_text
+PAGE_SEPARATOR = "\n"
+
+# Encrypted stores: magic, nonce, then a whole plain store sealed with AES-GCM
+ENCRYPTED_STORE_MAGIC = b"ABTXE2\n"
+NONCE_SIZE = 12
+
+# Whether stores can be encrypted, i.e. the cryptography package is installed
+ENCRYPTION_AVAILABLE = AESGCM is not None
+
+
+def derive_store_key(decryption_key):
+    """AES-256 key of the encrypted text cache of a PDF, from the PDF's file key"""
+    return hmac.new(decryption_key, b"audiobook text cache", hashlib.sha256).digest()
+
+
+def encrypt_store_data(key, data):
+    """Encrypt the bytes of a plain store file"""
+    if AESGCM is None:
+        raise RuntimeError("Encrypting the text cache needs the cryptography package")
+    
+    nonce = os.urandom(NONCE_SIZE)
+    return ENCRYPTED_STORE_MAGIC + nonce + AESGCM(key).encrypt(nonce, data, ENCRYPTED_STORE_MAGIC)
+
+
+def decrypt_store_data(key, data):
+    """Decrypt bytes written by encrypt_store_data; returns None if the key is wrong or the data altered"""
+    header_size = len(ENCRYPTED_STORE_MAGIC) + NONCE_SIZE
+    if AESGCM is None or len(data) < header_size or data[:len(ENCRYPTED_STORE_MAGIC)] != ENCRYPTED_STORE_MAGIC:
+        return None
+    
+    nonce = data[len(ENCRYPTED_STORE_MAGIC):header_size]
+    try:
+        return AESGCM(key).decrypt(nonce, data[header_size:], ENCRYPTED_STORE_MAGIC)
+    except InvalidTag:
+        return None
+
+
+class BookTextStore:
+    def __init__(self, buffer=b"", byte_offsets=None, char_offsets=None):
+        # Page i occupies buffer[byte_offsets[i]:byte_offsets[i + 1]] including
+        # its trailing separator; char_offsets hold the same boundaries in characters
+        self.buffer = memoryview(buffer)
+        self.byte_offsets = byte_offsets if byte_offsets is not None else array('Q', [0])
+        self.char_offsets = char_offsets if char_offsets is not None else array('Q', [0])
+        self.mapped_file = None
+        self.mapping = None
+    
+    @classmethod
+    def from_pages(cls, page_texts):
+        """Build a store from an iterable of page texts"""
+        buffer = bytearray()
+        byte_offsets = array('Q', [0])
+        char_offsets = array('Q', [0])
+        
+        for text in page_texts:
+            buffer += text.encode('utf-8', 'surrogatepass')
+            buffer += PAGE_SEPARATOR.encode('utf-8')
+            byte_offsets.append(len(buffer))
+            char_offsets.append(char_offsets[-1] + len(text) + len(PAGE_SEPARATOR))
+        
+        return cls(bytes(buffer), byte_offsets, char_offsets)
+    
+    def __len__(self):
+        """Number of pages"""
+        return len(self.byte_offsets) - 1
+    
+    def __getitem__(self, page_number):
+        """Text of a page, so the store can stand in for a list of page texts"""
+        if page_number < 0:
+            page_number += len(self)
+        if not 0 <= page_number < len(self):
+            raise IndexError("page number out of range")
+        
+        return self.page_text(page_number)
+    
+    @property
+    def char_length(self):
+        """Number of characters in the whole book"""
+        return self.char_offsets[-1]
+    
+    def page_slice(self, page_number):
+        """UTF-8 bytes of a page (without separator) as a zero-copy memoryview"""
+        start = self.byte_offsets[page_number]
+        end = self.byte_offsets[page_number + 1] - len(PAGE_SEPARATOR.encode('utf-8'))
+        return self.buffer[start:end]
+    
+    def page_text(self, page_number):
+        """Decoded text of a page"""
+        return str(self.page_slice(page_number), 'utf-8', 'surrogatepass')
+    
+    def get_text(self, char_offset=0):
+        """Decoded text of the whole book from char_offset on, pages separated by newlines
+        
+        Only the text from char_offset is decoded, so starting late in a
+        large book does not decode and then copy the part before it.
+        """
+        if char_offset <= 0:
+            return str(self.buffer, 'utf-8', 'surrogatepass')
+        if char_offset >= self.char_length:
+            return ""
+        
+        page_number, page_offset = self.offset_to_position(char_offset)
+        start = self.byte_offsets[page_number]
+        start += len(self.page_text(page_number)[:page_offset].encode('utf-8', 'surrogatepass'))
+        return str(self.buffer[start:], 'utf-8', 'surrogatepass')
+    
+    def page_for_offset(self, char_offset):
+        """Page containing a character offset into the whole-book text (O(log n))"""
+        if not 0 <= char_offset < self.char_length:
+            raise IndexError("character offset out of range")
+        
+        return bisect_right(self.char_offsets, char_offset) - 1
+    
+    def offset_to_position(self, char_offset):
+        """Convert a whole-book character offset to (page, offset within page)"""
+        page_number = self.page_for_offset(char_offset)
+        return page_number, char_offset - self.char_offsets[page_number]
+    
+    def page_start(self, page_number):
+        """Whole-book character offset where a page starts"""
+        return self.char_offsets[page_number]
+    
+    def save(self, store_path, key=None):
+        """Write the store to disk, encrypted if a key (see derive_store_key) is given
+        
+        Encrypting fails unless ENCRYPTION_AVAILABLE.
+        """
+        try:
+            # Write to a temporary file first so a partial store is never read
+            temp_path = store_path + ".tmp"
+            with open(temp_path, 'wb') as f:
+                if key is not None:
+                    f.write(encrypt_store_data(key, b"".join((
+                        STORE_MAGIC, struct.pack('<Q', len(self)), self.byte_offsets.tobytes(),
+                        self.char_offsets.tobytes(), self.buffer
+                    ))))
+                else:
+                    f.write(STORE_MAGIC)
+                    f.write(struct.pack('<Q', len(self)))
+                    f.write(self.byte_offsets.tobytes())
+                    f.write(self.char_offsets.tobytes())
+                    f.write(self.buffer)
+            os.replace(temp_path, store_path)
+            
+            return True, f"Text store saved to {store_path}"
+            
+        except Exception as e:
+            return False, f"Error saving text store: {str(e)}"
+    
+    @classmethod
+    def _from_data(cls, data):
+        """Build a store over the bytes of a plain store file"""
+        position = len(STORE_MAGIC)
+        page_count, = struct.unpack_from('<Q', data, position)
+        position += 8
+        
+        table_size = (page_count + 1) * 8
+        byte_offsets = array('Q')
+        byte_offsets.frombytes(data[position:position + table_size])
+        position += table_size
+        char_offsets = array('Q')
+        char_offsets.frombytes(data[position:position + table_size])
+        position += table_size
+        
+        return cls(memoryview(data)[position:], byte_offsets, char_offsets)
+    
+    @classmethod
+    def load(cls, store_path, key=None):
+        """Memory-map a store written by save(); returns None if unreadable
+        
+        Encrypted stores need the key they were saved with and are decrypted
+        into memory instead of being mapped.
+        """
+        try:
+            mapped_file = open(store_path, 'rb')
+            try:
+                mapping = mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                mapped_file.close()
+                return None
+            
+            if mapping[:len(ENCRYPTED_STORE_MAGIC)] == ENCRYPTED_STORE_MAGIC:
+                data = decrypt_store_data(key, mapping[:]) if key is not None else None
+                mapping.close()
+                mapped_file.close()
+                if data is None or data[:len(STORE_MAGIC)] != STORE_MAGIC:
+                    return None
+                return cls._from_data(data)
+            
+            if mapping[:len(STORE_MAGIC)] != STORE_MAGIC:
+                mapping.close()
+                mapped_file.close()
+                return None
+            
+            store = cls._from_data(mapping)
+            store.mapped_file = mapped_file
+            store.mapping = mapping
+            return store
+            
+        except (OSError, struct.error):
+            return None
+    
+    def close(self):
+        """Release the memory mapping of a loaded store"""
+        self.buffer.release()
+        self.buffer = memoryview(b"")
+        
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+        if self.mapped_file is not None:
+            self.mapped_file.close()
+            self.mapped_file = None
@@ -0,0 +1,446 @@
+"""
+Watch Folder Module
+Headless daemon that converts every PDF dropped into a directory tree
+
+Changes are picked up with inotify on Linux and by periodic scanning
+elsewhere. A file is converted only once it has stopped changing and ends
+like a complete PDF, so files still being copied are left alone. Files
+whose content was already converted (by hash, in the library or earlier in
+this run) are skipped, and conversions run on a fixed pool of worker
+processes with only a few waiting jobs handed to it; the rest of a burst
+waits as plain paths.
+
+Usage:
+    python watch_folder.py <watch dir> <output dir> [--workers 2] [--poll]
+"""
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from audio_converter import AudioConverter, TTS_BACKENDS
+from cache_utils import compute_file_hash
+from library import Library, preprocess_document
+from pipeline import convert_pages
+from profiling import PROFILE_MODES, profile_run, get_profile_dir
+from text_store import BookTextStore
+
+# Seconds a file must go without changes before it is considered written
+DEBOUNCE_SECONDS = 2.0
+
+# Files that still do not look like complete PDFs after this long are dropped
+INCOMPLETE_TIMEOUT = 600.0
+
+# Seconds between scans of the polling watcher
+POLL_INTERVAL = 2.0
+
+# Conversions handed to the pool beyond one per worker
+DEFAULT_WORKERS = 2
+MAX_QUEUED_JOBS = 2
+
+# A complete PDF ends with an end-of-file marker close to its end
+PDF_EOF_MARKER = b"%%EOF"
+PDF_TAIL_BYTES = 1024
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')
+EVENT_BUFFER_SIZE = 64 * 1024
+
+# The AudioConverter owned by each worker process
+_worker_converter = None
+
+
+def is_pdf_path(path):
+    return path.lower().endswith('.pdf')
+
+
+def scan_tree(root):
+    """Paths of all PDF files below root"""
+    paths = []
+    for directory, _, files in os.walk(root):
+        paths.extend(os.path.join(directory, name) for name in files if is_pdf_path(name))
+    return paths
+
+
+def looks_complete(path):
+    """Whether a PDF file ends with its end-of-file marker"""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - PDF_TAIL_BYTES))
+            return PDF_EOF_MARKER in f.read()
+    except OSError:
+        return False
+
+
+class PollingWatcher:
+    def __init__(self, root, interval=POLL_INTERVAL):
+        """Find changed PDFs by comparing (size, mtime) between scans"""
+        self.root = root
+        self.interval = interval
+        self.next_scan = 0.0
+        self.known = {}
+    
+    def poll(self, timeout):
+        """Wait up to timeout for the next scan; returns changed paths"""
+        wait = self.next_scan - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+        if wait > 0:
+            time.sleep(wait)
+        self.next_scan = time.monotonic() + self.interval
+        
+        changed = set()
+        current = {}
+        for path in scan_tree(self.root):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            current[path] = (stat.st_size, stat.st_mtime_ns)
+            if self.known.get(path) != current[path]:
+                changed.add(path)
+        
+        self.known = current
+        return changed
+    
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    def __init__(self, root):
+        """Find changed PDFs with Linux inotify, watching every directory below root"""
+        self.root = root
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        
+        # Watch descriptor -> directory path
+        self.directories = {}
+        self._watch_tree(root)
+    
+    @staticmethod
+    def available():
+        if not sys.platform.startswith("linux"):
+            return False
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"))
+            return hasattr(libc, "inotify_init1")
+        except OSError:
+            return False
+    
+    def _watch_tree(self, top):
+        """Watch a directory and its subdirectories; returns the PDFs already in them"""
+        paths = []
+        for directory, _, files in os.walk(top):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd >= 0:
+                self.directories[wd] = directory
+            paths.extend(os.path.join(directory, name) for name in files if is_pdf_path(name))
+        return paths
+    
+    def poll(self, timeout):
+        """Wait up to timeout for events; returns changed paths"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, EVENT_BUFFER_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost; fall back to a full scan
+                    changed.update(self._watch_tree(self.root))
+                    continue
+                
+                directory = self.directories.get(wd)
+                if directory is None or not name:
+                    continue
+                
+                path = os.path.join(directory, os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    # Files may have arrived before the new directory was watched
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        changed.update(self._watch_tree(path))
+                elif is_pdf_path(path):
+                    changed.add(path)
+        
+        return changed
+    
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def create_watcher(root, force_polling=False):
+    """inotify watcher where available, polling watcher otherwise"""
+    if not force_polling and InotifyWatcher.available():
+        try:
+            return InotifyWatcher(root)
+        except OSError:
+            pass
+    return PollingWatcher(root)
+
+
+def _init_worker(backend):
+    """Create the worker process's TTS engine once"""
+    global _worker_converter
+    _worker_converter = AudioConverter(backend)
+
+
+def _convert_worker(pdf_path, file_hash, output_path, rate, profile=None):
+    """Import a PDF and convert its text pages; returns (success, record or message)
+    
+    A profiled conversion writes its report next to the output.
+    """
+    converter = _worker_converter
+    if converter is None or converter.engine is None:
+        return False, "TTS engine not initialized"
+    converter.set_voice_rate(rate)
+    
+    success, record = preprocess_document(pdf_path, file_hash)
+    if not success:
+        return False, record
+    
+    store = BookTextStore.load(record['text_cache_path'])
+    if store is None:
+        return False, f"Text cache of {pdf_path} is missing"
+    
+    try:
+        text_pages = [page for page in range(len(store)) if store[page].strip()]
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with profile_run(get_profile_dir(output_path), profile):
+            success, stats = convert_pages(lambda page: (True, store[page]), text_pages,
+                                           output_path, converter)
+        if not success:
+            return False, f"{os.path.basename(pdf_path)}: {stats}"
+        return True, record
+    finally:
+        store.close()
+
+
+class WatchFolderDaemon:
+    def __init__(self, watch_dir, output_dir, library=None, max_workers=DEFAULT_WORKERS,
+                 backend=None, rate=150, debounce_seconds=DEBOUNCE_SECONDS,
+                 force_polling=False, verbose=True, profile=None):
+        """Convert PDFs appearing below watch_dir into WAV files below output_dir"""
+        self.watch_dir = os.path.abspath(watch_dir)
+        self.output_dir = os.path.abspath(output_dir)
+        self.library = library
+        self.max_workers = max_workers
+        self.backend = backend
+        self.rate = rate
+        self.debounce_seconds = debounce_seconds
+        self.force_polling = force_polling
+        self.verbose = verbose
+        # Profiling mode of each conversion, or None to follow AUDIOBOOK_PROFILE
+        self.profile = profile
+        
+        # path -> (first seen, last change, (size, mtime) at the last check)
+        self.pending = {}
+        # Paths that are written and waiting for a worker, as (path, hash)
+        self.backlog = deque()
+        # Hashes queued, converting or converted during this run
+        self.seen_hashes = set()
+        self.in_flight = 0
+        self.finished = deque()
+        self.lock = threading.Lock()
+        self.stats = {'converted': 0, 'duplicates': 0, 'failed': 0, 'dropped': 0}
+    
+    def _log(self, message):
+        if self.verbose:
+            print(message)
+    
+    def note_change(self, path, now):
+        """Restart the quiet period of a file that changed"""
+        first_seen = self.pending[path][0] if path in self.pending else now
+        self.pending[path] = (first_seen, now, None)
+    
+    def check_pending(self, now):
+        """Move files that stopped changing and look complete to the backlog"""
+        for path, (first_seen, last_change, last_stat) in list(self.pending.items()):
+            if now - last_change < self.debounce_seconds:
+                continue
+            
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Deleted or renamed away before it settled
+                del self.pending[path]
+                continue
+            
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != last_stat or not looks_complete(path):
+                if now - first_seen > INCOMPLETE_TIMEOUT:
+                    del self.pending[path]
+                    self.stats['dropped'] += 1
+                    self._log(f"Gave up on incomplete file {path}")
+                else:
+                    # Check again after another quiet period
+                    self.pending[path] = (first_seen, now, current)
+                continue
+            
+            del self.pending[path]
+            self._enqueue(path)
+    
+    def _enqueue(self, path):
+        """Queue a settled file unless its content was converted before"""
+        try:
+            file_hash = compute_file_hash(path)
+        except OSError as e:
+            self._log(f"Cannot read {path}: {str(e)}")
+            return
+        
+        document = self.library.get_document(file_hash) if self.library is not None else None
+        if file_hash in self.seen_hashes or (document is not None and document['export_status'] == "exported"):
+            self.stats['duplicates'] += 1
+            self._log(f"Skipped {path}: already converted")
+            return
+        
+        self.seen_hashes.add(file_hash)
+        self.backlog.append((path, file_hash))
+    
+    def output_path_for(self, path):
+        relative = os.path.relpath(path, self.watch_dir)
+        return os.path.join(self.output_dir, os.path.splitext(relative)[0] + ".wav")
+    
+    def dispatch(self, executor):
+        """Hand backlog files to the pool while it has room"""
+        while self.backlog and self.in_flight < self.max_workers + MAX_QUEUED_JOBS:
+            path, file_hash = self.backlog.popleft()
+            future = executor.submit(_convert_worker, path, file_hash, self.output_path_for(path),
+                                     self.rate, self.profile)
+            self.in_flight += 1
+            future.add_done_callback(lambda future, path=path, file_hash=file_hash:
+                                     self._on_done(path, file_hash, future))
+    
+    def _on_done(self, path, file_hash, future):
+        with self.lock:
+            self.finished.append((path, file_hash, future))
+    
+    def collect(self):
+        """Record finished conversions in the library"""
+        while True:
+            with self.lock:
+                if not self.finished:
+                    return
+                path, file_hash, future = self.finished.popleft()
+            self.in_flight -= 1
+            
+            try:
+                success, result = future.result()
+            except Exception as e:
+                success, result = False, f"Worker failed: {str(e)}"
+            
+            if success:
+                self.stats['converted'] += 1
+                if self.library is not None:
+                    self.library.add_document(result)
+                    self.library.set_export_status(file_hash, "exported")
+                self._log(f"Converted {path} -> {self.output_path_for(path)}")
+            else:
+                # Let a later copy of the same content try again
+                self.seen_hashes.discard(file_hash)
+                self.stats['failed'] += 1
+                self._log(f"Failed {path}: {result}")
+    
+    def is_idle(self):
+        return not (self.pending or self.backlog or self.in_flight)
+    
+    def run(self, stop_event=None, exit_when_idle=False):
+        """Watch and convert until stop_event is set; returns the stats
+        
+        Files already present when the daemon starts are converted too. With
+        exit_when_idle it returns once everything found has been handled.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        watcher = create_watcher(self.watch_dir, self.force_polling)
+        self._log(f"Watching {self.watch_dir} with {type(watcher).__name__}")
+        
+        now = time.monotonic()
+        for path in scan_tree(self.watch_dir):
+            self.note_change(path, now - self.debounce_seconds)
+        
+        with ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                 initargs=(self.backend,)) as executor:
+            try:
+                while stop_event is None or not stop_event.is_set():
+                    for path in watcher.poll(min(0.5, self.debounce_seconds)):
+                        self.note_change(path, time.monotonic())
+                    
+                    self.check_pending(time.monotonic())
+                    self.dispatch(executor)
+                    self.collect()
+                    
+                    if exit_when_idle and self.is_idle():
+                        break
+            finally:
+                watcher.close()
+        
+        self.collect()
+        return self.stats
+
+
+def main():
+    """Run the watch-folder daemon from the command line"""
+    parser = argparse.ArgumentParser(description="Convert PDFs dropped into a folder")
+    parser.add_argument("watch_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--backend", choices=TTS_BACKENDS, default=None)
+    parser.add_argument("--rate", type=int, default=150)
+    parser.add_argument("--poll", action="store_true", help="scan periodically instead of using inotify")
+    parser.add_argument("--profile", choices=PROFILE_MODES, default=None,
+                        help="write a profiling report next to each output")
+    args = parser.parse_args()
+    
+    library = Library()
+    daemon = WatchFolderDaemon(args.watch_dir, args.output_dir, library, args.workers,
+                               args.backend, args.rate, force_polling=args.poll,
+                               profile=args.profile)
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        library.close()
+    
+    print(f"Converted: {daemon.stats['converted']}, duplicates: {daemon.stats['duplicates']}, "
+          f"failed: {daemon.stats['failed']}")
+
+
+if __name__ == "__main__":
+    main()